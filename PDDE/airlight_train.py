@@ -10,7 +10,7 @@ from torch import optim
 from torch.utils.data import DataLoader
 
 from models.air_models import UNet
-from dataset import NYU_Dataset, RESIDE_Dataset
+from dataset import NYU_Dataset, RESIDE_Dataset, SyntheticHazeDataset
 
 def get_args():
     # opt.dataRoot = 'D:/data/NYU'
@@ -18,6 +18,7 @@ def get_args():
     parser = argparse.ArgumentParser(description='Train the UNet')
     parser.add_argument('--dataset', required=False, default='RESIDE',  help='dataset name')
     parser.add_argument('--dataRoot', type=str, default='D:/data/RESIDE_V0_outdoor',  help='data file path')
+    parser.add_argument('--synthetic', type=str, default='none',  help='NYU hazy images synthesized on the fly (none, grid, random)')
     
     # learning parameters
     parser.add_argument('--seed', type=int, default=101, help='Random Seed')
@@ -137,7 +138,10 @@ if __name__ == '__main__':
     net.to(device=opt.device)
     
     dataset_args = dict(img_size=[opt.imageSize_W, opt.imageSize_H], norm=opt.norm)
-    if opt.dataset == 'NYU':
+    if opt.dataset == 'NYU' and opt.synthetic != 'none':
+        train_set = SyntheticHazeDataset(opt.dataRoot + '/train', sampling=opt.synthetic, **dataset_args)
+        val_set   = SyntheticHazeDataset(opt.dataRoot + '/val', sampling='grid', **dataset_args)
+    elif opt.dataset == 'NYU':
         train_set = NYU_Dataset(opt.dataRoot + '/train', **dataset_args)
         val_set   = NYU_Dataset(opt.dataRoot + '/val', **dataset_args)
     elif opt.dataset == 'RESIDE':
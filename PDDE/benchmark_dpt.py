@@ -0,0 +1,112 @@
+# User warnings ignore
+import warnings
+warnings.filterwarnings("ignore")
+
+import argparse
+import json
+import os
+import time
+
+import torch
+from models.depth_models import DPTDepthModel
+
+
+# DPT inference throughput (images/s) per backbone and inference setting, random input (and weights if no path)
+#   python benchmark_dpt.py --backbones vitb_rn50_384 vitl16_384 --device cpu --output output/benchmark_dpt.json
+# settings : eager (as the runners did before), channels_last, bfloat16 autocast, torch.compile (+ bfloat16),
+#            int8 (models/depth_models/quantize.py, static parts calibrated on the benchmark input)
+# error against the first setting is measured on the network output (inverse depth, before scale / shift / invert) :
+# with random weights the converted depth is close to the constant 1/shift and hides any difference
+SETTINGS = {
+    'eager':               dict(channels_last=False, autocast_dtype=None,           capture=None),
+    'channels_last':       dict(channels_last=True,  autocast_dtype=None,           capture=None),
+    'bfloat16':            dict(channels_last=True,  autocast_dtype=torch.bfloat16, capture=None),
+    'compile':             dict(channels_last=True,  autocast_dtype=None,           capture='compile'),
+    'compile_bfloat16':    dict(channels_last=True,  autocast_dtype=torch.bfloat16, capture='compile'),
+    'int8_dynamic':        dict(channels_last=True,  autocast_dtype=None,           capture=None, quantize=dict(dynamic=True, static=[])),
+    'int8':                dict(channels_last=True,  autocast_dtype=None,           capture=None, quantize=dict(dynamic=True, static=['stem', 'refinenets'])),
+}
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backbones', type=str, nargs='+', default=['vitb_rn50_384', 'vitl16_384'], help='DPT backbones')
+    parser.add_argument('--weights', type=str, nargs='+', default=None, help='pretrained DPT path per backbone (random weights if None)')
+    parser.add_argument('--settings', type=str, nargs='+', default=list(SETTINGS), help=f'inference settings {list(SETTINGS)}')
+    parser.add_argument('--imageSize_W', type=int, default=256, help='the width of the input image')
+    parser.add_argument('--imageSize_H', type=int, default=256, help='the height of the input image')
+    parser.add_argument('--batchSize', type=int, default=1, help='images per forward')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed forwards (compilation happens here)')
+    parser.add_argument('--iters', type=int, default=5, help='timed forwards')
+    parser.add_argument('--threads', type=int, default=None, help='torch intra-op threads')
+    parser.add_argument('--device', default=torch.device('cuda' if torch.cuda.is_available() else 'cpu'))
+    parser.add_argument('--output', type=str, default='output/benchmark_dpt.json', help='json report path')
+    return parser.parse_args()
+
+
+def sync(device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def benchmark(opt, backbone, path, setting, x, reference):
+    model = DPTDepthModel(path=path, scale=0.000150, shift=0.1378, invert=True, backbone=backbone,
+                          non_negative=True, enable_attention_hooks=False)
+    settings = dict(SETTINGS[setting])
+    quantize = settings.pop('quantize', None)
+    if quantize is not None:
+        if backbone != 'vitb_rn50_384':
+            # no ResNet stem in the pure ViT backbones
+            quantize = dict(quantize, static=[part for part in quantize['static'] if part != 'stem'])
+        model.quantize(calibration=[x], **quantize)
+    model.to(opt.device)
+    model.inference_mode(**settings)
+
+    with torch.no_grad():
+        start = time.perf_counter()
+        for _ in range(opt.warmup):
+            depth = model(x)
+        sync(opt.device)
+        warmup = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(opt.iters):
+            depth = model(x)
+        sync(opt.device)
+        elapsed = time.perf_counter() - start
+        inv_depth = model.forward_network(x).float()
+
+    result = dict(backbone=backbone, setting=setting, warmup_s=warmup, latency_s=elapsed / opt.iters,
+                  images_per_s=opt.batchSize * opt.iters / elapsed)
+    if reference is not None:
+        # relative L2 error and max abs error over the reference range
+        diff = inv_depth - reference
+        result['inv_depth_rel_l2'] = (diff.norm() / reference.norm()).item()
+        result['inv_depth_max_abs'] = (diff.abs().max() / reference.abs().max()).item()
+    return result, inv_depth
+
+
+if __name__ == '__main__':
+    opt = get_args()
+    if opt.threads is not None:
+        torch.set_num_threads(opt.threads)
+    weights = opt.weights if opt.weights is not None else [None] * len(opt.backbones)
+
+    results = []
+    for backbone, path in zip(opt.backbones, weights):
+        torch.manual_seed(0)
+        x = torch.rand(opt.batchSize, 3, opt.imageSize_H, opt.imageSize_W, device=opt.device) * 2 - 1
+        reference = None
+        for setting in opt.settings:
+            # same random weights for every setting of a backbone
+            torch.manual_seed(0)
+            result, depth = benchmark(opt, backbone, path, setting, x, reference)
+            if reference is None:
+                reference = depth
+            error = f"  inverse depth error : rel L2 {result['inv_depth_rel_l2']:.2e}, max abs {result['inv_depth_max_abs']:.2e}" if 'inv_depth_rel_l2' in result else ''
+            print(f"{backbone:16} {setting:18} {result['images_per_s']:8.2f} images/s  ({result['latency_s']*1000:.1f} ms / batch){error}")
+            results.append(result)
+
+    os.makedirs(os.path.dirname(opt.output) or '.', exist_ok=True)
+    config = {k: str(v) if isinstance(v, torch.device) else v for k, v in vars(opt).items()}
+    with open(opt.output, 'w') as f:
+        json.dump(dict(config=config, threads=torch.get_num_threads(), results=results), f, indent=2)
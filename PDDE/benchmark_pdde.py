@@ -0,0 +1,217 @@
+# User warnings ignore
+import warnings
+warnings.filterwarnings("ignore")
+
+import os
+os.environ['KMP_DUPLICATE_LIB_OK']='True'
+
+import argparse
+import json
+import random
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import torch
+from models.depth_models import DPTDepthModel
+from models.air_models import UNet
+
+from utils.metrics import batch_metrics
+from utils import util
+from utils.clear2hazy import clear2hazy
+from utils.entropy_module import Entropy_Module
+from utils.dehazer import IterativeDehazer
+from utils.depth_refresh import get_refresh
+from utils.profiler import StageProfiler
+from utils.io import *
+
+
+# PDDE benchmark on synthetic hazy images (no dataset needed)
+#   python benchmark_pdde.py --numImages 8 --output output/benchmark.json
+# stages : load_item (decode + resize), to_device, airlight (UNet), dpt_forward, denormalize, normalize,
+#          entropy, metrics (psnr + ssim of the batch), imwrite + dehaze (whole run_batch)
+# --engine legacy : the per-image loop of the runners before IterativeDehazer (init_depth forward, numpy entropy,
+#                   host round trip of every step output), for before / after latency
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', required=False, default='RESIDE',  help='dataset name (airlight denormalization)')
+    parser.add_argument('--scale', type=float, default=0.000150,  help='depth scale')
+    parser.add_argument('--shift', type=float, default= 0.1378,  help='depth shift')
+    parser.add_argument('--preTrainedModel', type=str, default=None, help='pretrained DPT path (random weights if None)')
+    parser.add_argument('--preTrainedAirModel', type=str, default=None, help='pretrained Air path (random weights if None)')
+
+    parser.add_argument('--seed', type=int, default=101, help='Random Seed')
+    parser.add_argument('--imageSize_W', type=int, default=256, help='the width of the resized input image to network')
+    parser.add_argument('--imageSize_H', type=int, default=256, help='the height of the resized input image to network')
+    parser.add_argument('--device', default=torch.device('cuda' if torch.cuda.is_available() else 'cpu'))
+    parser.add_argument('--backbone', type=str, default="vitb_rn50_384", help='DPT backbone')
+
+    parser.add_argument('--betaStep', type=float, default=0.005, help='beta step')
+    parser.add_argument('--stepLimit', type=int, default=50, help='Multi step limit')
+    parser.add_argument('--eps', type=float, default=1e-12, help='Epsilon value for non zero calculating')
+    parser.add_argument('--batchSize', type=int, default=1, help='number of images dehazed together')
+    parser.add_argument('--engine', type=str, default='dehazer', choices=['dehazer', 'legacy'], help='IterativeDehazer or the previous per-image loop')
+    parser.add_argument('--refresh', type=str, default='step', help='DPT depth refresh policy (step, interval, entropy, probe)')
+    parser.add_argument('--refreshInterval', type=int, default=5, help='steps per depth (interval) / longest reuse of one depth (entropy)')
+    parser.add_argument('--refreshThreshold', type=float, default=None, help='entropy change in bits (entropy, 0.05) / relative change of the probe depth (probe, 0.02)')
+    parser.add_argument('--probeScale', type=float, default=0.25, help='resolution scale of the low resolution depth probe (probe)')
+    parser.add_argument('--autocast', type=str, default='none', choices=['none', 'bfloat16', 'float16'], help='DPT autocast dtype (float16 -> bfloat16 on cpu)')
+    parser.add_argument('--capture', type=str, default='none', choices=['none', 'compile'], help='DPT graph capture (torch.compile)')
+    parser.add_argument('--quantized', type=str, default=None, help='int8 DPT path written by quantize_dpt.py calibrate (cpu only, sets --device cpu)')
+
+    parser.add_argument('--numImages', type=int, default=4, help='number of synthetic hazy images')
+    parser.add_argument('--sourceSize_W', type=int, default=640, help='width of the synthetic images before resize')
+    parser.add_argument('--sourceSize_H', type=int, default=480, help='height of the synthetic images before resize')
+    parser.add_argument('--output', type=str, default='output/benchmark.json', help='json report path')
+    return parser.parse_args()
+
+
+def make_synthetic(path, num_images, width, height, rng):
+    # smooth random clear image + far-at-the-top depth -> clear2hazy with random airlight / beta
+    items = []
+    for i in range(num_images):
+        clear = rng.random((height // 16, width // 16, 3)).astype(np.float32)
+        clear = cv2.resize(clear, (width, height), interpolation=cv2.INTER_CUBIC).clip(0, 1)
+        depth = np.linspace(10, 1, height, dtype=np.float32)[:, None, None] + rng.random((height, width, 1)).astype(np.float32)
+        airlight = rng.choice([0.8, 0.85, 0.9, 0.95, 1.0])
+        beta = rng.choice([0.04, 0.06, 0.08, 0.1, 0.12, 0.16])
+        hazy = clear2hazy(clear, airlight, depth, beta)
+
+        haze_path, clear_path = f'{path}/hazy_{i:03}_{airlight}_{beta}.png', f'{path}/clear_{i:03}.png'
+        cv2.imwrite(haze_path, cv2.cvtColor(hazy, cv2.COLOR_RGB2BGR))
+        cv2.imwrite(clear_path, cv2.cvtColor(np.rint(clear*255).astype(np.uint8), cv2.COLOR_RGB2BGR))
+        items.append((haze_path, clear_path))
+    return items
+
+
+def legacy_run_batch(opt, model, airlight_model, metrics_module, hazy_images):
+    # previous dehazing_valid_dataset_stopper loop, one image at a time -> (optimal Bx3xHxW numpy, forwards B numpy)
+    optimal_images = []
+    for hazy_image in hazy_images.split(1):
+        with torch.no_grad():
+            cur_hazy = hazy_image.to(opt.device)
+            airlight = airlight_model.forward(cur_hazy)
+            init_depth = model.forward(cur_hazy)
+        airlight = util.air_denorm(opt.dataset, True, airlight)
+        sum_depth = torch.zeros_like(init_depth)
+
+        entropy_max = 0
+        for step in range(0, opt.stepLimit):
+            with torch.no_grad():
+                cur_depth = model.forward(cur_hazy)
+
+            diff_depth = cur_depth*step - sum_depth
+            cur_hazy = util.denormalize(cur_hazy, True)
+            trans = torch.exp((diff_depth+cur_depth)*opt.betaStep*-1)
+            sum_depth = cur_depth * (step+1)
+
+            prediction = (cur_hazy - airlight) / (trans + opt.eps) + airlight
+            prediction = torch.clamp(prediction, 0, 1)
+
+            entropy, _, _ = metrics_module.get_cur(cur_hazy[0].detach().cpu().numpy().transpose(1,2,0))
+            if entropy_max < entropy:
+                entropy_max = entropy
+                optimal_dehazed = cur_hazy[0].detach().cpu().numpy()
+
+            cur_hazy = util.normalize(prediction[0].detach().cpu().numpy().transpose(1,2,0), True).unsqueeze(0).to(opt.device)
+        optimal_images.append(optimal_dehazed)
+    return np.stack(optimal_images), np.full(len(optimal_images), opt.stepLimit + 1)
+
+
+def run(opt, model, airlight_model, metrics_module, items, output_folder):
+    model.eval()
+    airlight_model.eval()
+    profiler = StageProfiler(opt.device)
+    transform = make_transform([opt.imageSize_W, opt.imageSize_H], norm=True)
+
+    dehazer = IterativeDehazer(model, airlight_model, metrics_module, opt.dataset, norm=True,
+                               beta_step=opt.betaStep, step_limit=opt.stepLimit, eps=opt.eps, device=opt.device)
+    refresh = get_refresh(opt.refresh, opt.refreshInterval, opt.refreshThreshold, opt.probeScale)
+    dpt_calls = []
+
+    with profiler.patch(model, 'forward', 'dpt_forward'), \
+         profiler.patch(airlight_model, 'forward', 'airlight'), \
+         profiler.patch(metrics_module, 'get_cur_batch', 'entropy'), \
+         profiler.patch(metrics_module, 'get_cur', 'entropy'), \
+         profiler.patch(util, 'denormalize_tensor', 'denormalize'), \
+         profiler.patch(util, 'normalize_tensor', 'normalize'), \
+         profiler.patch(util, 'denormalize', 'denormalize'), \
+         profiler.patch(util, 'normalize', 'normalize'), \
+         profiler.count_d2h():
+
+        for start in range(0, len(items), opt.batchSize):
+            hazy_images, clear_images = [], []
+            for haze_path, clear_path in items[start:start+opt.batchSize]:
+                with profiler.stage('load_item'):
+                    hazy, clear = load_item(haze_path, clear_path, transform)
+                hazy_images.append(torch.from_numpy(hazy))
+                clear_images.append(torch.from_numpy(clear))
+            hazy_images = profiler.to_device(torch.stack(hazy_images))
+            clear_images = util.denormalize_tensor(torch.stack(clear_images)).numpy()
+
+            with profiler.stage('dehaze'):
+                if opt.engine == 'legacy':
+                    batch_start = time.perf_counter()
+                    optimal_images, forwards = legacy_run_batch(opt, model, airlight_model, metrics_module, hazy_images)
+                    dehazer.latency.extend([(time.perf_counter() - batch_start) / len(optimal_images)] * len(optimal_images))
+                else:
+                    optimal_images, _, _, forwards = dehazer.run_batch(hazy_images, refresh=refresh)
+            dpt_calls.extend(forwards.tolist())
+
+            with profiler.stage('metrics'):
+                psnrs, ssims = batch_metrics(optimal_images, clear_images, device=opt.device)
+                psnrs, ssims = psnrs.tolist(), ssims.tolist()
+            for i, (optimal_dehazed, clear_image) in enumerate(zip(optimal_images, clear_images)):
+                with profiler.stage('imwrite'):
+                    image = np.rint(optimal_dehazed.transpose(1, 2, 0)*255).astype(np.uint8)
+                    cv2.imwrite(f'{output_folder}/{start+i:03}.png', cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+
+    config = {k: str(v) if isinstance(v, torch.device) else v for k, v in vars(opt).items()}
+    return profiler.report(config=config, images=len(items), mean_latency=dehazer.mean_latency(), dpt_calls=float(np.mean(dpt_calls)))
+
+
+if __name__ == '__main__':
+    opt = get_args()
+    if opt.quantized is not None:
+        # eager int8 modules run on the cpu only, whatever the default device
+        opt.device = torch.device('cpu')
+
+    random.seed(opt.seed)
+    torch.manual_seed(opt.seed)
+    torch.cuda.manual_seed_all(opt.seed)
+    rng = np.random.default_rng(opt.seed)
+
+    model = DPTDepthModel(
+        path = opt.preTrainedModel,
+        scale=opt.scale, shift=opt.shift, invert=True,
+        backbone=opt.backbone,
+        non_negative=True,
+        enable_attention_hooks=False,
+    )
+    if opt.quantized is not None:
+        model.load_quantized(opt.quantized)
+    model.to(opt.device)
+    model.inference_mode(channels_last=True,
+                         autocast_dtype=None if opt.autocast == 'none' else getattr(torch, opt.autocast),
+                         capture=None if opt.capture == 'none' else opt.capture)
+
+    airlight_model = UNet([opt.imageSize_W, opt.imageSize_H], in_channels=3, out_channels=1, bilinear=True)
+    if opt.preTrainedAirModel is not None:
+        checkpoint = torch.load(opt.preTrainedAirModel)
+        airlight_model.load_state_dict(checkpoint['model_state_dict'])
+    airlight_model.to(opt.device)
+
+    with tempfile.TemporaryDirectory() as path:
+        items = make_synthetic(path, opt.numImages, opt.sourceSize_W, opt.sourceSize_H, rng)
+        os.makedirs(path + '/dehazed')
+        report = run(opt, model, airlight_model, Entropy_Module(), items, path + '/dehazed')
+
+    output_folder = os.path.dirname(opt.output)
+    if output_folder != '' and not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+    with open(opt.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report['stages'], indent=2))
+    print(f'mean latency per image : {report["mean_latency"]:.4f}s  ->  {opt.output}')
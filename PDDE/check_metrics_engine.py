@@ -0,0 +1,51 @@
+"""
+Checks that every metrics_engine.py copy is identical to PDDE/utils/metrics_engine.py
+(the baselines run from their own folders, each metrics.py imports the copy next to it)
+
+    python check_metrics_engine.py          (exit status 1 when a copy differs)
+    python check_metrics_engine.py --sync   (copies PDDE/utils/metrics_engine.py over the others)
+"""
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CANONICAL = 'PDDE/utils/metrics_engine.py'
+COPIES = [
+    'depth/utils/metrics_engine.py',
+    'dehazing/AODnet/metrics_engine.py',
+    'dehazing/DCP/metrics_engine.py',
+    'dehazing/DCPDN/metrics_engine.py',
+    'dehazing/DCPDN/myutils/metrics_engine.py',
+    'dehazing/FFA-Net/net/metrics_engine.py',
+    'dehazing/MSBDN/metrics_engine.py',
+]
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sync', action='store_true', help=f'copy {CANONICAL} over the copies that differ')
+    return parser.parse_args()
+
+
+def differing_copies():
+    canonical = os.path.join(ROOT, CANONICAL)
+    return [copy for copy in COPIES
+            if not os.path.exists(os.path.join(ROOT, copy)) or not filecmp.cmp(canonical, os.path.join(ROOT, copy), shallow=False)]
+
+
+if __name__ == '__main__':
+    opt = get_args()
+    differing = differing_copies()
+    if opt.sync:
+        for copy in differing:
+            shutil.copyfile(os.path.join(ROOT, CANONICAL), os.path.join(ROOT, copy))
+            print(f'synced {copy}')
+    elif differing:
+        print(f'differ from {CANONICAL} :\n  ' + '\n  '.join(differing))
+        sys.exit(1)
+    else:
+        print(f'{len(COPIES)} copies identical to {CANONICAL}')
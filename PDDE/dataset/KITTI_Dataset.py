@@ -4,11 +4,13 @@ import mat73
 import os
 from torch.utils.data import Dataset
 from utils.io import *
+from .packed import PackedShards
+from .manifest import load_manifest
 import numpy as np
 
 
 class KITTI_Dataset(Dataset):
-    def __init__(self, path, img_size, norm=True, verbose=False):
+    def __init__(self, path, img_size, norm=True, verbose=False, packed=None, manifest=False):
         super().__init__()
         self.path = path
         self.img_size = img_size
@@ -16,13 +18,26 @@ class KITTI_Dataset(Dataset):
 
         self.hazy_lists = []
         self.hazy_count = 0
+        self.items = None
         
-        for hazy_folder in glob(path+'/hazy/*/'):
-            if verbose:
-                print(hazy_folder + ' dataset ready!')
-            for hazy_image in glob(hazy_folder + '*.png'):
-                self.hazy_lists.append(hazy_image)
-                self.hazy_count+=1
+        # packed : folder written by dataset.packed (no decode / resize)
+        self.packed = None if packed is None else PackedShards(packed)
+        if self.packed is not None:
+            self.hazy_count = len(self.packed)
+            return
+        
+        # manifest : True (<path>.manifest.sqlite) or a manifest path, parsed filenames and resolved clear / depth paths
+        if manifest:
+            self.items = load_manifest('KITTI', path, None if manifest is True else manifest)
+            self.hazy_lists = [item[0] for item in self.items]
+            self.hazy_count = len(self.hazy_lists)
+        else:
+            for hazy_folder in glob(path+'/hazy/*/'):
+                if verbose:
+                    print(hazy_folder + ' dataset ready!')
+                for hazy_image in glob(hazy_folder + '*.png'):
+                    self.hazy_lists.append(hazy_image)
+                    self.hazy_count+=1
         self.transform = make_transform(img_size, norm=norm)
         #self.airlights = np.load(path+'/airlight.npz')['data']
         
@@ -31,17 +46,27 @@ class KITTI_Dataset(Dataset):
         # return 100
         
     def __getitem__(self,index):
+        if self.packed is not None:
+            return self.packed.get_item(index, self.norm)
+        
         haze = self.hazy_lists[index]
         filename = os.path.basename(haze)
-        airlight_input = np.array(float(filename.split('_')[1]))
-        beta_input = np.array(float(filename.split('_')[2][:-4]))
-        
-        og_filename = filename.split('_')[0]
-        
-        clear = self.path + '/clear/' + og_filename + '.png'
+        if self.items is not None:
+            _, clear, depth, airlight, beta = self.items[index]
+            airlight_input, beta_input = np.array(airlight), np.array(beta)
+        else:
+            airlight_input = np.array(float(filename.split('_')[1]))
+            beta_input = np.array(float(filename.split('_')[2][:-4]))
+            
+            og_filename = filename.split('_')[0]
+            
+            clear = self.path + '/clear/' + og_filename + '.png'
+
+            depth = self.path + '/dense_depth/' + og_filename + '.npy'
+            if not os.path.isfile(depth):
+                depth = None
 
-        depth = self.path + '/dense_depth/' + og_filename + '.npy'
-        if os.path.isfile(depth):
+        if depth is not None:
             depth_input = np.load(depth)
             depth_input = cv2.resize(depth_input, (self.img_size[0], self.img_size[1]), interpolation=cv2.INTER_CUBIC)
             depth_input = np.expand_dims(depth_input, axis=0)
@@ -6,6 +6,8 @@ import numpy as np
 from torch.utils.data import Dataset
 from torchvision import transforms
 from utils.io import *
+from .packed import PackedShards
+from .manifest import load_manifest
 
 class NYU_Dataset_clear(Dataset):
     """
@@ -34,9 +36,23 @@ class NYU_Dataset_clear(Dataset):
     
     
 class NYU_Dataset(Dataset):
-    def __init__(self, path, img_size, norm=False, verbose=False, selection=[]):
+    def __init__(self, path, img_size, norm=False, verbose=False, selection=[], packed=None, manifest=False):
         super().__init__()
         self.norm = norm
+        self.img_size = img_size
+        self.items = None
+        
+        # packed : folder written by dataset.packed (no decode / resize)
+        self.packed = None if packed is None else PackedShards(packed)
+        if self.packed is not None:
+            return
+        
+        # manifest : True (<path>.manifest.sqlite) or a manifest path, (hazy, clear, depth) pairs in the order below
+        if manifest:
+            self.items = load_manifest('NYU', path, None if manifest is True else manifest)
+            self.transform = make_transform(img_size, norm=self.norm)
+            return
+        
         # clear images
         self.images_clear_list = glob(path + '/clear/*.jpg')
         self.depths_list = glob(path + '/depth/*.npy')
@@ -55,18 +71,31 @@ class NYU_Dataset(Dataset):
         self.transform = make_transform(img_size, norm=self.norm)
         
     def __len__(self):
+        if self.packed is not None:
+            return len(self.packed)
+        if self.items is not None:
+            return len(self.items)
         return len(self.hazy_lists) * self.images_count
         
     def __getitem__(self,index):
-        haze = self.hazy_lists[index//self.images_count][index%self.images_count]
+        if self.packed is not None:
+            return self.packed.get_item(index, self.norm, air_list=[0.8, 0.9, 1.0])
+        
+        if self.items is not None:
+            haze, clear, depth, GT_airlight, GT_beta = self.items[index]
+            GT_airlight, GT_beta = np.array(GT_airlight), np.array(GT_beta)
+        else:
+            haze = self.hazy_lists[index//self.images_count][index%self.images_count]
+            clear = self.images_clear_list[index%self.images_count]
+            depth = self.depths_list[index%self.images_count]
         filename = os.path.basename(haze)
-        clear = self.images_clear_list[index%self.images_count]
-        GT_depth = np.load(self.depths_list[index%self.images_count])
+        GT_depth = np.load(depth)
         GT_depth = cv2.resize(GT_depth, (self.img_size[0], self.img_size[1]), interpolation=cv2.INTER_CUBIC)
         GT_depth = np.expand_dims(GT_depth, axis=0)
         
-        GT_airlight = np.array(float(filename.split('_')[-2]))
-        GT_beta = np.array(float(filename.split('_')[-1][:-4]))
+        if self.items is None:
+            GT_airlight = np.array(float(filename.split('_')[-2]))
+            GT_beta = np.array(float(filename.split('_')[-1][:-4]))
 
         if self.norm:
             air_list = np.array([0.8, 0.9, 1.0])
@@ -0,0 +1,115 @@
+import os
+from collections import OrderedDict
+import cv2
+from glob import glob
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from utils.io import *
+
+
+def synthesize_haze(clear, depth, airlight, beta, quantize=True):
+    """
+    clear2hazy in tensor form, broadcast over a batch (runs on the tensors' device)
+        clear : Bx3xHxW (0~1), depth : Bx1xHxW, airlight / beta : B
+    """
+    airlight = torch.as_tensor(airlight, dtype=clear.dtype, device=clear.device).view(-1, 1, 1, 1)
+    beta = torch.as_tensor(beta, dtype=clear.dtype, device=clear.device).view(-1, 1, 1, 1)
+    trans = torch.exp(-beta * depth)
+    hazy = (clear * trans) + ((1 - trans) * airlight)
+    if quantize:
+        hazy = torch.round(hazy * 255) / 255
+    return torch.clamp(hazy, 0, 1)
+
+
+class SyntheticHazeDataset(Dataset):
+    """
+    NYU clear images + depth, hazy images synthesized on the fly (no pre-rendered hazy folders)
+        sampling='grid'   : every (airlight, beta) pair of airlight_list x beta_list,
+                            index = pair * images + image over the sorted clear names
+                            (NYU_Dataset keeps the raw glob order of its folders, indices do not line up with it)
+        sampling='random' : one (airlight, beta) drawn uniformly from [min, max] of the lists per item
+        cache_size : decoded clear images + depths kept per worker (LRU, 0 : no cache)
+    DataLoader batches go through __getitems__ : one synthesize_haze call for the whole batch
+    => return same tuple as NYU_Dataset (hazy, clear, GT_depth, GT_airlight, GT_beta, filename)
+    """
+    def __init__(self, path, img_size, norm=False, airlight_list=[0.8, 0.9, 1.0], beta_list=[0.1, 0.2, 0.3, 0.5, 0.6, 0.7],
+                 sampling='grid', quantize=True, cache_size=256, verbose=False):
+        super().__init__()
+        if sampling not in ['grid', 'random']:
+            raise ValueError('sampling is grid or random')
+        self.path = path
+        self.img_size = img_size
+        self.norm = norm
+        self.airlight_list = airlight_list
+        self.beta_list = beta_list
+        self.sampling = sampling
+        self.quantize = quantize
+        self.cache_size = cache_size
+        self.cache = OrderedDict() if cache_size > 0 else None
+
+        self.images_clear_list = sorted(glob(path + '/clear/*.jpg'))
+        self.images_count = len(self.images_clear_list)
+        self.pairs = [(airlight, beta) for airlight in airlight_list for beta in beta_list]
+        if verbose:
+            print(f'{path} : {self.images_count} clear images x {len(self.pairs) if sampling == "grid" else 1} hazy')
+        self.transform = make_transform(img_size, norm=False)
+
+    def __len__(self):
+        if self.sampling == 'grid':
+            return len(self.pairs) * self.images_count
+        return self.images_count
+
+    def load_clear(self, index):
+        # resized clear image (3xHxW, 0~1) and depth (1xHxW), the cache_size most recently used stay decoded
+        if self.cache is not None and index in self.cache:
+            self.cache.move_to_end(index)
+            return self.cache[index]
+        clear = self.images_clear_list[index]
+        name = os.path.basename(clear)[:-4]
+        clear_input = self.transform({"image": read_image(clear)})["image"]
+        GT_depth = np.load(self.path + '/depth/' + name + '.npy')
+        GT_depth = cv2.resize(GT_depth, (self.img_size[0], self.img_size[1]), interpolation=cv2.INTER_CUBIC)
+        GT_depth = np.expand_dims(GT_depth, axis=0).astype(np.float32)
+        item = (torch.from_numpy(clear_input), torch.from_numpy(GT_depth), name)
+        if self.cache is not None:
+            self.cache[index] = item
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return item
+
+    def get_params(self, index):
+        if self.sampling == 'grid':
+            return self.pairs[index // self.images_count]
+        airlight = float(np.random.uniform(min(self.airlight_list), max(self.airlight_list)))
+        beta = float(np.random.uniform(min(self.beta_list), max(self.beta_list)))
+        return airlight, beta
+
+    def __getitem__(self, index):
+        return self.__getitems__([index])[0]
+
+    def __getitems__(self, indices):
+        clears = [self.load_clear(index % self.images_count) for index in indices]
+        params = [self.get_params(index) for index in indices]
+        clear_inputs = torch.stack([clear for clear, _, _ in clears])
+        GT_depths = torch.stack([depth for _, depth, _ in clears])
+        airlights, betas = zip(*params)
+        hazy_inputs = synthesize_haze(clear_inputs, GT_depths, airlights, betas, self.quantize)
+        return [self.make_item(hazy_input, clear_input, GT_depth, name, airlight, beta)
+                for hazy_input, clear_input, GT_depth, (_, _, name), (airlight, beta)
+                in zip(hazy_inputs, clear_inputs, GT_depths, clears, params)]
+
+    def make_item(self, hazy_input, clear_input, GT_depth, name, airlight, beta):
+        filename = f'{name}_{airlight}_{beta}.jpg'
+
+        GT_airlight = np.array(airlight)
+        GT_beta = np.array(beta)
+        if self.norm:
+            air_list = np.array([0.8, 0.9, 1.0])
+            GT_airlight = (GT_airlight - air_list.mean()) / air_list.std()
+            hazy_input, clear_input = (hazy_input - 0.5) / 0.5, (clear_input - 0.5) / 0.5
+
+        GT_airlight = np.expand_dims(GT_airlight, axis=0)
+        GT_beta = np.expand_dims(GT_beta, axis=0)
+
+        return hazy_input.numpy(), clear_input.numpy(), GT_depth.numpy(), GT_airlight, GT_beta, filename
@@ -1,3 +1,4 @@
 from .NYU_Dataset import NYU_Dataset
 from .RESIDE_Dataset import RESIDE_Dataset, RESIDE_RTTS_Dataset
-from .KITTI_Dataset import KITTI_Dataset
\ No newline at end of file
+from .KITTI_Dataset import KITTI_Dataset
+from .SyntheticHaze_Dataset import SyntheticHazeDataset, synthesize_haze
\ No newline at end of file
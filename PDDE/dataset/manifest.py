@@ -0,0 +1,99 @@
+"""
+Cached dataset manifest : the glob / filename parsing / clear-depth pairing of the datasets done once per data root.
+
+<data root>.manifest.sqlite (next to the data root, so writing it does not change the scanned directories)
+    meta  (kind, signature) : signature = mtimes of the scanned directories, a changed directory rebuilds the manifest
+    items (idx, hazy, clear, depth, airlight, beta, width, height) : same order as the datasets' own glob
+"""
+import json
+import os
+import sqlite3
+from glob import glob
+from PIL import Image
+
+
+def scan_RESIDE(path):
+    rows = []
+    for hazy_folder in glob(path+'/hazy/*/'):
+        for haze in glob(hazy_folder + '*.jpg'):
+            filename = os.path.basename(haze)
+            og_filename = filename.split('_')[0]
+            clear = path + '/clear/' + og_filename + '.jpg'
+            if not os.path.isfile(clear):
+                clear = path + '/clear/' + og_filename + '.png'
+            depth = path + '/depth/' + og_filename + '.mat'
+            depth = depth if os.path.isfile(depth) else None
+            rows.append((haze, clear, depth, float(filename.split('_')[1]), float(filename.split('_')[2][:-4])))
+    return rows
+
+
+def scan_KITTI(path):
+    rows = []
+    for hazy_folder in glob(path+'/hazy/*/'):
+        for haze in glob(hazy_folder + '*.png'):
+            filename = os.path.basename(haze)
+            og_filename = filename.split('_')[0]
+            depth = path + '/dense_depth/' + og_filename + '.npy'
+            depth = depth if os.path.isfile(depth) else None
+            rows.append((haze, path + '/clear/' + og_filename + '.png', depth,
+                         float(filename.split('_')[1]), float(filename.split('_')[2][:-4])))
+    return rows
+
+
+def scan_NYU(path):
+    # NYU_Dataset pairs the i-th hazy image of every folder with the i-th clear image / depth (glob order)
+    images_clear_list = glob(path + '/clear/*.jpg')
+    depths_list = glob(path + '/depth/*.npy')
+    rows = []
+    for images_hazy_folder in glob(path+'/hazy/*/'):
+        for i, haze in enumerate(glob(images_hazy_folder+'*.jpg')):
+            filename = os.path.basename(haze)
+            rows.append((haze, images_clear_list[i], depths_list[i],
+                         float(filename.split('_')[-2]), float(filename.split('_')[-1][:-4])))
+    return rows
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def scan_RTTS(path):
+    # flat folder : image files only (by extension), the header of every row is read when the manifest is built
+    return [(haze, None, None, None, None) for haze in glob(path+'/*') if haze.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+SCANNERS = {'RESIDE': scan_RESIDE, 'KITTI': scan_KITTI, 'NYU': scan_NYU, 'RTTS': scan_RTTS}
+
+
+def dir_signature(path, kind):
+    # adding / removing / renaming a file changes the mtime of its directory
+    folders = [path] if kind == 'RTTS' else [path, path + '/hazy', path + '/clear', path + '/depth', path + '/dense_depth'] + glob(path + '/hazy/*/')
+    return json.dumps({folder: os.path.getmtime(folder) for folder in sorted(folders) if os.path.isdir(folder)})
+
+
+def load_manifest(kind, path, manifest_path=None):
+    """
+    => list of (hazy, clear, depth, airlight, beta) rows, clear / depth None when missing
+    """
+    if manifest_path is None:
+        manifest_path = os.path.normpath(path) + '.manifest.sqlite'
+    signature = dir_signature(path, kind)
+
+    db = sqlite3.connect(manifest_path)
+    db.execute('CREATE TABLE IF NOT EXISTS meta (kind TEXT PRIMARY KEY, signature TEXT)')
+    db.execute('CREATE TABLE IF NOT EXISTS items (kind TEXT, idx INTEGER, hazy TEXT, clear TEXT, depth TEXT, airlight REAL, beta REAL, width INTEGER, height INTEGER, PRIMARY KEY (kind, idx))')
+    row = db.execute('SELECT signature FROM meta WHERE kind=?', (kind,)).fetchone()
+
+    if row is None or row[0] != signature:
+        rows = []
+        for idx, (haze, clear, depth, airlight, beta) in enumerate(SCANNERS[kind](path)):
+            with Image.open(haze) as image:     # header only
+                width, height = image.size
+            rows.append((kind, idx, haze, clear, depth, airlight, beta, width, height))
+        db.execute('DELETE FROM items WHERE kind=?', (kind,))
+        db.executemany('INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (kind, signature))
+        db.commit()
+
+    items = db.execute('SELECT hazy, clear, depth, airlight, beta FROM items WHERE kind=? ORDER BY idx', (kind,)).fetchall()
+    db.close()
+    return items
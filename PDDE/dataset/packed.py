@@ -0,0 +1,131 @@
+"""
+Preprocessed dataset cache : decode / resize once, then serve the resized arrays from memory-mapped shards.
+
+    python -m dataset.packed --dataset RESIDE --dataRoot D:/data/RESIDE_V0_outdoor/val --packedRoot D:/data/packed/RESIDE_val
+
+root/index.json         : img_size, shard shapes, (filename, shard, slot, airlight, beta, has_depth) per item
+root/hazy_0000.u8 ...   : N x 3 x H x W uint8
+root/clear_0000.u8 ...  : N x 3 x H x W uint8
+root/depth_0000.f16 ... : N x 1 x H x W float16
+airlight / beta are stored without normalization, the dataset applies its own normalization when serving.
+"""
+import argparse
+import json
+import os
+import numpy as np
+from tqdm import tqdm
+
+
+class PackedShards():
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, 'index.json')) as f:
+            self.index = json.load(f)
+        self.items = self.index['items']
+        self.maps = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getstate__(self):
+        # DataLoader workers re-open the memmaps instead of pickling their contents
+        state = self.__dict__.copy()
+        state['maps'] = {}
+        return state
+
+    def _map(self, kind, shard):
+        if (kind, shard) not in self.maps:
+            dtype, channels = (np.float16, 1) if kind == 'depth' else (np.uint8, 3)
+            ext = 'f16' if kind == 'depth' else 'u8'
+            path = os.path.join(self.root, f'{kind}_{shard:04}.{ext}')
+            count = self.index['shards'][shard]
+            self.maps[(kind, shard)] = np.memmap(path, dtype=dtype, mode='r', shape=(count, channels, *self.index['shape']))
+        return self.maps[(kind, shard)]
+
+    def get_raw(self, index):
+        # zero-copy uint8 / float16 views into the shards
+        filename, shard, slot, airlight, beta, has_depth = self.items[index]
+        hazy, clear = self._map('hazy', shard)[slot], self._map('clear', shard)[slot]
+        depth = self._map('depth', shard)[slot] if has_depth else None
+        return hazy, clear, depth, airlight, beta, filename
+
+    def get_item(self, index, norm, air_list=None):
+        # same output as the datasets' __getitem__ : (hazy, clear, depth, airlight, beta, filename)
+        hazy, clear, depth, airlight, beta, filename = self.get_raw(index)
+        hazy = hazy.astype(np.float32) / 255
+        clear = clear.astype(np.float32) / 255
+        if norm:
+            hazy, clear = (hazy - 0.5) / 0.5, (clear - 0.5) / 0.5
+        if depth is None:
+            depth = np.array((1, self.index['img_size'][0], self.index['img_size'][1]))
+        else:
+            depth = depth.astype(np.float32)
+
+        airlight = np.array(airlight)
+        if norm and air_list is not None:
+            air_list = np.array(air_list)
+            airlight = (airlight - air_list.mean()) / air_list.std()
+        return hazy, clear, depth, np.expand_dims(airlight, axis=0), np.expand_dims(np.array(beta), axis=0), filename
+
+
+def pack_dataset(dataset, root, shard_size=1024):
+    """
+    dataset : NYU_Dataset / RESIDE_Dataset / KITTI_Dataset built with norm=False
+    """
+    if dataset.norm:
+        raise ValueError('pack_dataset needs a dataset built with norm=False')
+    if not os.path.exists(root):
+        os.makedirs(root)
+
+    index = {'img_size': list(dataset.img_size), 'shape': None, 'shards': [], 'items': []}
+    maps = {}
+    for i in tqdm(range(len(dataset))):
+        hazy, clear, depth, airlight, beta, filename = dataset[i]
+        shard, slot = i // shard_size, i % shard_size
+        if index['shape'] is None:
+            index['shape'] = list(hazy.shape[1:])
+        if slot == 0:
+            count = min(shard_size, len(dataset) - i)
+            index['shards'].append(count)
+            for kind, dtype, channels, ext in [('hazy', np.uint8, 3, 'u8'), ('clear', np.uint8, 3, 'u8'), ('depth', np.float16, 1, 'f16')]:
+                path = os.path.join(root, f'{kind}_{shard:04}.{ext}')
+                maps[kind] = np.memmap(path, dtype=dtype, mode='w+', shape=(count, channels, *index['shape']))
+
+        maps['hazy'][slot] = np.rint(np.clip(hazy, 0, 1) * 255).astype(np.uint8)
+        maps['clear'][slot] = np.rint(np.clip(clear, 0, 1) * 255).astype(np.uint8)
+        has_depth = np.ndim(depth) == 3
+        if has_depth:
+            maps['depth'][slot] = np.asarray(depth, dtype=np.float32).reshape(1, *index['shape'])
+        index['items'].append([filename, shard, slot, float(airlight.reshape(-1)[0]), float(beta.reshape(-1)[0]), has_depth])
+
+        if slot == shard_size - 1 or i == len(dataset) - 1:
+            for memmap in maps.values():
+                memmap.flush()
+
+    with open(os.path.join(root, 'index.json'), 'w') as f:
+        json.dump(index, f)
+    return index
+
+
+if __name__ == '__main__':
+    from . import NYU_Dataset, RESIDE_Dataset, KITTI_Dataset
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', required=False, default='RESIDE',  help='dataset name (NYU, RESIDE, KITTI)')
+    parser.add_argument('--dataRoot', type=str, required=True, help='data split path (e.g. .../RESIDE_V0_outdoor/val)')
+    parser.add_argument('--packedRoot', type=str, required=True, help='output folder of the packed shards')
+    parser.add_argument('--imageSize_W', type=int, default=256, help='the width of the resized input image to network')
+    parser.add_argument('--imageSize_H', type=int, default=256, help='the height of the resized input image to network')
+    parser.add_argument('--shardSize', type=int, default=1024, help='items per shard')
+    opt = parser.parse_args()
+
+    dataset_args = dict(img_size=[opt.imageSize_W, opt.imageSize_H], norm=False)
+    if opt.dataset == 'NYU':
+        dataset = NYU_Dataset(opt.dataRoot, **dataset_args)
+    elif opt.dataset == 'RESIDE':
+        dataset = RESIDE_Dataset(opt.dataRoot, **dataset_args)
+    elif opt.dataset == 'KITTI':
+        dataset = KITTI_Dataset(opt.dataRoot, **dataset_args)
+    else:
+        raise ValueError('dataset is NYU, RESIDE or KITTI')
+    pack_dataset(dataset, opt.packedRoot, opt.shardSize)
@@ -20,6 +20,9 @@ from torch.utils.data import DataLoader
 from utils import util
 from utils.util import compute_errors
 from utils.entropy_module import Entropy_Module
+from utils.dehazer import IterativeDehazer
+from utils.stopper import get_stopper
+from utils.depth_refresh import get_refresh
 from utils.io import *
 
 
@@ -48,6 +51,16 @@ def get_args():
     parser.add_argument('--betaStep', type=float, default=0.005, help='beta step')
     parser.add_argument('--stepLimit', type=int, default=50, help='Multi step limit')
     parser.add_argument('--eps', type=float, default=1e-12, help='Epsilon value for non zero calculating')
+    parser.add_argument('--batchSize', type=int, default=1, help='number of images dehazed together')
+    parser.add_argument('--stopper', type=str, default='none', help='online stop rule (none, first_decrease, patience, patience_prev, limit)')
+    parser.add_argument('--stopperLimit', type=int, default=20, help='patience of the limit stop rule')
+    parser.add_argument('--refresh', type=str, default='step', help='DPT depth refresh policy (step, interval, entropy, probe)')
+    parser.add_argument('--refreshInterval', type=int, default=5, help='steps per depth (interval) / longest reuse of one depth (entropy)')
+    parser.add_argument('--refreshThreshold', type=float, default=None, help='entropy change in bits (entropy, 0.05) / relative change of the probe depth (probe, 0.02)')
+    parser.add_argument('--probeScale', type=float, default=0.25, help='resolution scale of the low resolution depth probe (probe)')
+    parser.add_argument('--autocast', type=str, default='none', choices=['none', 'bfloat16', 'float16'], help='DPT autocast dtype (float16 -> bfloat16 on cpu)')
+    parser.add_argument('--capture', type=str, default='none', choices=['none', 'compile'], help='DPT graph capture (torch.compile)')
+    parser.add_argument('--quantized', type=str, default=None, help='int8 DPT path written by quantize_dpt.py calibrate (cpu only, sets --device cpu)')
     return parser.parse_args()
     
 
@@ -62,58 +75,46 @@ def run(opt, model, airlight_model, metrics_module, loader):
     f = open(output_folder + '/RTTS_Ours.csv','w', newline='')
     wr = csv.writer(f)
 
+    dehazer = IterativeDehazer(model, airlight_model, metrics_module, opt.dataset, norm=opt.norm,
+                               beta_step=opt.betaStep, step_limit=opt.stepLimit, eps=opt.eps, device=opt.device)
+
+    stopper = get_stopper(opt.stopper, opt.stopperLimit)
+    refresh = get_refresh(opt.refresh, opt.refreshInterval, opt.refreshThreshold, opt.probeScale)
+    dpt_calls, probes = [], []
+    forwards_saved = []
+
     pbar = tqdm(loader)
     for batch in pbar:
         hazy_images, input_names = batch
-        input_name = input_names[0].split('.')[0]
         
-        with torch.no_grad():
-            cur_hazy = hazy_images.to(opt.device)
-            airlight = airlight_model.forward(cur_hazy)
-            init_depth = model.forward(cur_hazy)
-        airlight = util.air_denorm(opt.dataset, opt.norm, airlight)
+        optimal_images, entropy_maxs, _, forwards = dehazer.run_batch(hazy_images, score_prediction=True, stopper=stopper, refresh=refresh)
+        forwards_saved.extend(opt.stepLimit - forwards)
+        dpt_calls.extend(forwards)
+        if refresh is not None:
+            probes.extend(refresh.probes.tolist())
         
-        cur_depth = None
-        sum_depth = torch.zeros_like(init_depth).to('cuda')
-
-        entropy_max = 0
-        for step in range(0, opt.stepLimit):
-            with torch.no_grad():
-                cur_depth = model.forward(cur_hazy)
-            
-            diff_depth = cur_depth*step - sum_depth
-            trans = torch.exp((diff_depth+cur_depth)*opt.betaStep*-1)
-            sum_depth = cur_depth * (step+1)
-            
-            cur_hazy = util.denormalize(cur_hazy, opt.norm)
+        for optimal_dehazed, entropy_max, input_name in zip(optimal_images, entropy_maxs, input_names):
+            input_name = input_name.split('.')[0]
+            wr.writerow([input_name, entropy_max, dehazer.latency[-1]])
             
-            dehazed = (cur_hazy - airlight) / (trans + opt.eps) + airlight
-            dehazed = torch.clamp(dehazed, 0, 1)
-            dehazed = dehazed[0].detach().cpu().numpy().transpose(1,2,0)
-
-            entropy, _, _ = metrics_module.get_cur(dehazed)
-            if entropy_max < entropy:
-                entropy_max = entropy
-                optimal_dehazed = dehazed
-            
-            cur_hazy = util.normalize(dehazed, opt.norm).unsqueeze(0).to(opt.device)
-            
-            # dehazed = (dehazed*255).astype(np.uint8)
-            # cv2.imwrite(f'{output_folder}/{input_name}_{step}.jpg', cv2.cvtColor(dehazed, cv2.COLOR_RGB2BGR))
-        
-        wr.writerow([input_name, entropy_max])
-        
-        optimal_dehazed = (optimal_dehazed*255).astype(np.uint8)
-        cv2.imwrite(f'{output_folder}/{input_name}.jpg', cv2.cvtColor(optimal_dehazed, cv2.COLOR_RGB2BGR))
+            optimal_dehazed = (optimal_dehazed.transpose(1,2,0)*255).astype(np.uint8)
+            cv2.imwrite(f'{output_folder}/{input_name}.jpg', cv2.cvtColor(optimal_dehazed, cv2.COLOR_RGB2BGR))
+        pbar.set_postfix(latency=f'{dehazer.latency[-1]:.3f}s')
         
         # cur_depth_viz = util.visualize_depth_inverse(best_depth)
         # cv2.imwrite(f'{output_folder}/{input_name}.jpg', cur_depth_viz)
     
     f.close()
+    print(f'mean latency per image : {dehazer.mean_latency():.4f}s')
+    print(f'[{opt.dataset}] stopper={opt.stopper} : {np.mean(forwards_saved):.2f} / {opt.stepLimit} DPT forwards saved per image')
+    print(f'[{opt.dataset}] refresh={opt.refresh} : {np.mean(dpt_calls):.2f} DPT calls per image' + (f' (+ {np.mean(probes):.2f} low resolution probes)' if probes else ''))
 
 
 if __name__ == '__main__':
     opt = get_args()
+    if opt.quantized is not None:
+        # eager int8 modules run on the cpu only, whatever the default device
+        opt.device = torch.device('cpu')
     opt.norm = True
     opt.verbose = True
     
@@ -131,8 +132,12 @@ if __name__ == '__main__':
         non_negative=True,
         enable_attention_hooks=False,
     )
-    model = model.to(memory_format=torch.channels_last)
+    if opt.quantized is not None:
+        model.load_quantized(opt.quantized)
     model.to(opt.device)
+    model.inference_mode(channels_last=True,
+                         autocast_dtype=None if opt.autocast == 'none' else getattr(torch, opt.autocast),
+                         capture=None if opt.capture == 'none' else opt.capture)
     
         
     airlight_model = UNet([opt.imageSize_W, opt.imageSize_H], in_channels=3, out_channels=1, bilinear=True)
@@ -148,7 +153,7 @@ if __name__ == '__main__':
     elif opt.dataset == 'RTTS':
         val_set = RESIDE_RTTS_Dataset(opt.dataRoot + '/RTTS',   **dataset_args)
 
-    loader_args = dict(batch_size=1, num_workers=1, drop_last=False, shuffle=False)
+    loader_args = dict(batch_size=opt.batchSize, num_workers=1, drop_last=False, shuffle=False)
     val_loader = DataLoader(dataset=val_set, **loader_args)
     metrics_module = Entropy_Module()
     
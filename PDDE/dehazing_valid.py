@@ -123,8 +123,8 @@ if __name__ == '__main__':
         non_negative=True,
         enable_attention_hooks=False,
     )
-    model = model.to(memory_format=torch.channels_last)
     model.to(opt.device)
+    model.inference_mode(channels_last=True)
     
         
     airlight_model = UNet([opt.imageSize_W, opt.imageSize_H], in_channels=3, out_channels=1, bilinear=True)
@@ -24,6 +24,8 @@ from utils.metrics import get_ssim, get_psnr
 from utils import util
 from utils.util import compute_errors
 from utils.entropy_module import Entropy_Module
+from utils.dehazer import IterativeDehazer
+from utils.results_store import ResultsWriter, beta_of
 from glob import glob
 from utils.io import *
 
@@ -61,6 +63,17 @@ def get_args():
     parser.add_argument('--betaStep', type=float, default=0.005, help='beta step')
     parser.add_argument('--stepLimit', type=int, default=50, help='Multi step limit')
     parser.add_argument('--eps', type=float, default=1e-12, help='Epsilon value for non zero calculating')
+    parser.add_argument('--autocast', type=str, default='none', choices=['none', 'bfloat16', 'float16'], help='DPT autocast dtype (float16 -> bfloat16 on cpu)')
+    parser.add_argument('--capture', type=str, default='none', choices=['none', 'compile'], help='DPT graph capture (torch.compile)')
+    parser.add_argument('--quantized', type=str, default=None, help='int8 DPT path written by quantize_dpt.py calibrate (cpu only, sets --device cpu)')
+    parser.add_argument('--backend', type=str, default='torch', choices=['torch', 'onnx'], help='DPT / Air backend (onnx : onnxruntime cpu, graphs from export_onnx.py)')
+    parser.add_argument('--onnxModel', type=str, default='weights/onnx/dpt_dpt_hybrid_kitti-cb926ef4_RESIDE_046_256x256.onnx', help='DPT onnx path')
+    parser.add_argument('--onnxAirModel', type=str, default='weights/onnx/air_Air_UNet_RESIDE_V0_epoch_16_256x256.onnx', help='Air onnx path')
+    parser.add_argument('--onnxThreads', type=int, default=None, help='onnxruntime intra-op threads (default : one per core)')
+    
+    # results parameters
+    parser.add_argument('--resultsRoot', type=str, default='D:/data/output_dehaze/_results', help='results store root (utils/results_store.py)')
+    parser.add_argument('--run', type=str, default='SOTS_Ours', help='run name in the results store')
     return parser.parse_args()
     
 
@@ -73,87 +86,65 @@ def run(opt, model, airlight_model, metrics_module, loader):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    pbar = tqdm(loader)
-    for batch in pbar:
-        hazy_images, clear_images, depth_images, _, gt_betas, input_names = batch
-        gt_beta = gt_betas[0]
-        # if os.path.basename(input_names[0]).split('_')[0] != '0150':
-        #     continue
+    dehazer = IterativeDehazer(model, airlight_model, metrics_module, opt.dataset, norm=opt.norm,
+                               beta_step=opt.betaStep, step_limit=opt.stepLimit, eps=opt.eps, device=opt.device)
+
+    with ResultsWriter(opt.resultsRoot, opt.run) as writer:
+        pbar = tqdm(loader)
+        for batch in pbar:
+            hazy_images, clear_images, depth_images, _, gt_betas, input_names = batch
+            gt_beta = gt_betas[0]
+            # if os.path.basename(input_names[0]).split('_')[0] != '0150':
+            #     continue
             
-        output_name = output_folder + '/' + input_names[0][:-4] + '/' + input_names[0][:-4] + '.csv'
-        if not os.path.exists(f'{output_folder}/{input_names[0][:-4]}'):
-            os.makedirs(f'{output_folder}/{input_names[0][:-4]}')
-        f = open(output_name,'w', newline='')
-        wr = csv.writer(f)
+            image_name = input_names[0][:-4]
+            if not os.path.exists(f'{output_folder}/{image_name}'):
+                os.makedirs(f'{output_folder}/{image_name}')
         
-        with torch.no_grad():
-            cur_hazy = hazy_images.to(opt.device)
-            # depth_images = depth_images.to(opt.device)
-            airlight = airlight_model.forward(cur_hazy)
-            init_depth = model.forward(cur_hazy)
-        airlight = util.air_denorm(opt.dataset,opt.norm,airlight)
-        hazy_image = util.denormalize(hazy_images, opt.norm)[0].detach().cpu().numpy().transpose(1,2,0)
-        clear_image = util.denormalize(clear_images, opt.norm)[0].detach().cpu().numpy().transpose(1,2,0)
+            clear_image = util.denormalize(clear_images, opt.norm)[0].to(opt.device)
         
-        # best_mean_entropy_image = None
-        # best_max_entropy_image = None
-        # best_min_entropy_image = None
+            # best_mean_entropy_image = None
+            # best_max_entropy_image = None
+            # best_min_entropy_image = None
         
-        cur_depth = None
-        sum_depth = torch.zeros_like(init_depth).to('cuda')
-        
-        for step in range(0, opt.stepLimit):
-            with torch.no_grad():
-                cur_depth = model.forward(cur_hazy)
-                
-            diff_depth = cur_depth*step - sum_depth
-            cur_hazy = util.denormalize(cur_hazy,opt.norm)
-            trans = torch.exp((diff_depth+cur_depth)*opt.betaStep*-1)
-            sum_depth = cur_depth * (step+1)
-            prediction = (cur_hazy - airlight) / (trans + opt.eps) + airlight
-            prediction = torch.clamp(prediction, 0, 1)
-
-            cur_mean_entropy, _, _ = metrics_module.get_cur(cur_hazy[0].detach().cpu().numpy().transpose(1,2,0))
-            cur_psnr = get_psnr(cur_hazy[0].detach().cpu().numpy(),util.denormalize(clear_images,opt.norm)[0].detach().cpu().numpy())
-            cur_ssim = get_ssim(cur_hazy[0].detach().cpu().numpy(),util.denormalize(clear_images,opt.norm)[0].detach().cpu().numpy()).item()
-
-            ratio = np.median(depth_images[0].detach().cpu().numpy()) / np.median(cur_depth[0].detach().cpu().numpy())
-            # multi_score = util.compute_errors(cur_depth[0].detach().cpu().numpy() * ratio, depth_images[0].detach().cpu().numpy())
-
-            # if cur_mean_entropy<last_mean_entropy and (best_mean_entropy_image is None) and step!=1:
-            #     print("^^^^^^^^^^^^^^^^^^^^^^^^ best mean_entropy")
-            #     best_mean_entropy_image = cv2.cvtColor(cur_hazy[0].detach().cpu().numpy().transpose(1,2,0),cv2.COLOR_RGB2BGR)
-            
-            # if cur_max_entropy<last_max_entropy and (best_max_entropy_image is None) and step!=1:
-            #     print("^^^^^^^^^^^^^^^^^^^^^^^^ best max_entropy")
-            #     best_max_entropy_image = cv2.cvtColor(cur_hazy[0].detach().cpu().numpy().transpose(1,2,0),cv2.COLOR_RGB2BGR)
+            for step, cur_image, cur_depth, _ in dehazer.steps(hazy_images):
+                cur_mean_entropy = metrics_module.get_cur_batch(cur_image)[0][0].item()
+                cur_psnr = get_psnr(cur_image[0].detach(), clear_image)
+                cur_ssim = get_ssim(cur_image[0].detach(), clear_image).item()
+
+                # if cur_mean_entropy<last_mean_entropy and (best_mean_entropy_image is None) and step!=1:
+                #     print("^^^^^^^^^^^^^^^^^^^^^^^^ best mean_entropy")
+                #     best_mean_entropy_image = cv2.cvtColor(cur_hazy[0].detach().cpu().numpy().transpose(1,2,0),cv2.COLOR_RGB2BGR)
             
-            # if cur_min_entropy<last_min_entropy and (best_min_entropy_image is None) and step!=1:
-            #     print("^^^^^^^^^^^^^^^^^^^^^^^^ best min_entropy")
-            #     best_min_entropy_image = cv2.cvtColor(cur_hazy[0].detach().cpu().numpy().transpose(1,2,0),cv2.COLOR_RGB2BGR)
-            wr.writerow([step, cur_mean_entropy, cur_psnr, cur_ssim])
+                # if cur_max_entropy<last_max_entropy and (best_max_entropy_image is None) and step!=1:
+                #     print("^^^^^^^^^^^^^^^^^^^^^^^^ best max_entropy")
+                #     best_max_entropy_image = cv2.cvtColor(cur_hazy[0].detach().cpu().numpy().transpose(1,2,0),cv2.COLOR_RGB2BGR)
             
-            cur_depth = cur_depth[0]/torch.max(cur_depth[0])
-            cur_depth = cur_depth.repeat(3,1,1)
-            image_set = torch.cat([cur_hazy[0], cur_depth],1)*255
-            cv2.imwrite(f'{output_folder}/{input_names[0][:-4]}/{step:03}.jpg', cv2.cvtColor(image_set.detach().cpu().numpy().astype(np.uint8).transpose(1,2,0), cv2.COLOR_RGB2BGR))
-
+                # if cur_min_entropy<last_min_entropy and (best_min_entropy_image is None) and step!=1:
+                #     print("^^^^^^^^^^^^^^^^^^^^^^^^ best min_entropy")
+                #     best_min_entropy_image = cv2.cvtColor(cur_hazy[0].detach().cpu().numpy().transpose(1,2,0),cv2.COLOR_RGB2BGR)
+                writer.append(image_name, beta_of(image_name), step, entropy=cur_mean_entropy, psnr=cur_psnr, ssim=cur_ssim)
             
-            cur_hazy = util.normalize(prediction[0].detach().cpu().numpy().transpose(1,2,0),opt.norm).unsqueeze(0).to(opt.device)
-        # if best_mean_entropy_image is not None:
-        #     cv2.imshow("best_mean", best_mean_entropy_image)
-        # if best_max_entropy_image is not None:
-        #     cv2.imshow("best_max", best_max_entropy_image)
-        # if best_min_entropy_image is not None:
-        #     cv2.imshow("best_min", best_min_entropy_image)
-        # cv2.waitKey(0)
-        
-        f.close()
+                cur_depth = cur_depth[0]/torch.max(cur_depth[0])
+                cur_depth = cur_depth.repeat(3,1,1)
+                image_set = torch.cat([cur_image[0], cur_depth],1)*255
+                cv2.imwrite(f'{output_folder}/{input_names[0][:-4]}/{step:03}.jpg', cv2.cvtColor(image_set.detach().cpu().numpy().astype(np.uint8).transpose(1,2,0), cv2.COLOR_RGB2BGR))
+
+            # if best_mean_entropy_image is not None:
+            #     cv2.imshow("best_mean", best_mean_entropy_image)
+            # if best_max_entropy_image is not None:
+            #     cv2.imshow("best_max", best_max_entropy_image)
+            # if best_min_entropy_image is not None:
+            #     cv2.imshow("best_min", best_min_entropy_image)
+            # cv2.waitKey(0)
            
 
 
 if __name__ == '__main__':
     opt = get_args()
+    if opt.quantized is not None:
+        # eager int8 modules run on the cpu only, whatever the default device
+        opt.device = torch.device('cpu')
     opt.norm = True
     opt.verbose = True
     
@@ -164,21 +155,29 @@ if __name__ == '__main__':
     print("=========| Option |=========\n", opt)
     
     
-    model = DPTDepthModel(
-        path = opt.preTrainedModel,
-        scale=opt.scale, shift=opt.shift, invert=True,
-        backbone=opt.backbone,
-        non_negative=True,
-        enable_attention_hooks=False,
-    )
-    model = model.to(memory_format=torch.channels_last)
-    model.to(opt.device)
-    
-        
-    airlight_model = UNet([opt.imageSize_W, opt.imageSize_H], in_channels=3, out_channels=1, bilinear=True)
-    checkpoint = torch.load(opt.preTrainedAirModel)
-    airlight_model.load_state_dict(checkpoint['model_state_dict'])
-    airlight_model.to(opt.device)
+    if opt.backend == 'onnx':
+        from models.onnx_backend import OnnxModel
+        model = OnnxModel(opt.onnxModel, opt.onnxThreads)
+        airlight_model = OnnxModel(opt.onnxAirModel, opt.onnxThreads)
+    else:
+        model = DPTDepthModel(
+            path = opt.preTrainedModel,
+            scale=opt.scale, shift=opt.shift, invert=True,
+            backbone=opt.backbone,
+            non_negative=True,
+            enable_attention_hooks=False,
+        )
+        if opt.quantized is not None:
+            model.load_quantized(opt.quantized)
+        model.to(opt.device)
+        model.inference_mode(channels_last=True,
+                             autocast_dtype=None if opt.autocast == 'none' else getattr(torch, opt.autocast),
+                             capture=None if opt.capture == 'none' else opt.capture)
+
+        airlight_model = UNet([opt.imageSize_W, opt.imageSize_H], in_channels=3, out_channels=1, bilinear=True)
+        checkpoint = torch.load(opt.preTrainedAirModel)
+        airlight_model.load_state_dict(checkpoint['model_state_dict'])
+        airlight_model.to(opt.device)
 
     dataset_args = dict(img_size=[opt.imageSize_W, opt.imageSize_H], norm=opt.norm)
     if opt.dataset == 'NYU':
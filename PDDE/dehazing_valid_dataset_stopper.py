@@ -17,10 +17,13 @@ from models.air_models import UNet
 from dataset import *
 from torch.utils.data import DataLoader
 
-from utils.metrics import get_ssim, get_psnr
+from utils.metrics import batch_metrics
 from utils import util
 from utils.util import compute_errors
 from utils.entropy_module import Entropy_Module
+from utils.dehazer import IterativeDehazer
+from utils.stopper import get_stopper
+from utils.depth_refresh import get_refresh
 from utils.io import *
 
 
@@ -29,6 +32,8 @@ def get_args():
     # RESIDE
     parser.add_argument('--dataset', required=False, default='RESIDE',  help='dataset name')
     parser.add_argument('--dataRoot', type=str, default='D:/data/RESIDE_V0_outdoor',  help='data file path')
+    parser.add_argument('--packedRoot', type=str, default=None,  help='packed dataset path of the evaluated split (dataset.packed)')
+    parser.add_argument('--manifest', action='store_true',  help='list the dataset from a cached sqlite manifest (dataset.manifest)')
     parser.add_argument('--scale', type=float, default=0.000150,  help='depth scale')
     parser.add_argument('--shift', type=float, default= 0.1378,  help='depth shift')
     # parser.add_argument('--preTrainedModel', type=str, default='weights/depth_weights/dpt_hybrid_nyu-2ce69ec_RESIDE_017_RESIDE_003_RESIDE_004.pt', help='pretrained DPT path')
@@ -49,6 +54,24 @@ def get_args():
     parser.add_argument('--betaStep', type=float, default=0.005, help='beta step')
     parser.add_argument('--stepLimit', type=int, default=50, help='Multi step limit')
     parser.add_argument('--eps', type=float, default=1e-12, help='Epsilon value for non zero calculating')
+    parser.add_argument('--batchSize', type=int, default=1, help='number of images dehazed together')
+    parser.add_argument('--stopper', type=str, default='none', help='online stop rule (none, first_decrease, patience, patience_prev, limit)')
+    parser.add_argument('--stopperLimit', type=int, default=20, help='patience of the limit stop rule')
+    parser.add_argument('--refresh', type=str, default='step', help='DPT depth refresh policy (step, interval, entropy, probe)')
+    parser.add_argument('--refreshInterval', type=int, default=5, help='steps per depth (interval) / longest reuse of one depth (entropy)')
+    parser.add_argument('--refreshThreshold', type=float, default=None, help='entropy change in bits (entropy, 0.05) / relative change of the probe depth (probe, 0.02)')
+    parser.add_argument('--probeScale', type=float, default=0.25, help='resolution scale of the low resolution depth probe (probe)')
+    parser.add_argument('--autocast', type=str, default='none', choices=['none', 'bfloat16', 'float16'], help='DPT autocast dtype (float16 -> bfloat16 on cpu)')
+    parser.add_argument('--capture', type=str, default='none', choices=['none', 'compile'], help='DPT graph capture (torch.compile)')
+    parser.add_argument('--quantized', type=str, default=None, help='int8 DPT path written by quantize_dpt.py calibrate (cpu only, sets --device cpu)')
+    parser.add_argument('--backend', type=str, default='torch', choices=['torch', 'onnx'], help='DPT / Air backend (onnx : onnxruntime cpu, graphs from export_onnx.py)')
+    parser.add_argument('--onnxModel', type=str, default='weights/onnx/dpt_dpt_hybrid_kitti-cb926ef4_RESIDE_046_256x256.onnx', help='DPT onnx path (--coarseToFine needs an export with --dynamicSpatial)')
+    parser.add_argument('--onnxAirModel', type=str, default='weights/onnx/air_Air_UNet_RESIDE_V0_epoch_16_256x256.onnx', help='Air onnx path')
+    parser.add_argument('--onnxThreads', type=int, default=None, help='onnxruntime intra-op threads (default : one per core)')
+    parser.add_argument('--coarseToFine', action='store_true', help='coarse-to-fine beta search instead of the linear sweep')
+    parser.add_argument('--coarseScale', type=float, default=0.5, help='resolution scale of the coarse trajectory')
+    parser.add_argument('--coarseFactor', type=int, default=5, help='beta step multiplier of the coarse trajectory')
+    parser.add_argument('--parity', action='store_true', help='also run the linear sweep (per-step refresh with the same stopper when --refresh is set) and report PSNR/SSIM parity')
     return parser.parse_args()
     
 
@@ -63,47 +86,44 @@ def run(opt, model, airlight_model, metrics_module, loader):
     f = open(output_folder + '/SOTS_Ours.csv','w', newline='')
     wr = csv.writer(f)
 
+    dehazer = IterativeDehazer(model, airlight_model, metrics_module, opt.dataset, norm=opt.norm,
+                               beta_step=opt.betaStep, step_limit=opt.stepLimit, eps=opt.eps, device=opt.device)
+
+    stopper = get_stopper(opt.stopper, opt.stopperLimit)
+    refresh = get_refresh(opt.refresh, opt.refreshInterval, opt.refreshThreshold, opt.probeScale)
+    dpt_calls, probes = [], []
+    forwards_saved = []
+    parity = {'linear_psnr': [], 'linear_ssim': [], 'psnr': [], 'ssim': []}
+
     pbar = tqdm(loader)
     for batch in pbar:
         hazy_images, clear_images, _, _, gt_betas, input_names = batch
-        input_name = input_names[0][:-4]
-        gt_beta = gt_betas[0]
-        clear_image = util.denormalize(clear_images,opt.norm)[0].detach().cpu().numpy()
+        clear_images = util.denormalize(clear_images,opt.norm).to(opt.device)
         
-        with torch.no_grad():
-            cur_hazy = hazy_images.to(opt.device)
-            airlight = airlight_model.forward(cur_hazy)
-            init_depth = model.forward(cur_hazy)
-        airlight = util.air_denorm(opt.dataset,opt.norm,airlight)
+        if opt.coarseToFine:
+            optimal_images, entropy_maxs, _, forwards, _ = dehazer.run_coarse_to_fine(hazy_images, opt.coarseScale, opt.coarseFactor)
+        else:
+            optimal_images, entropy_maxs, _, forwards = dehazer.run_batch(hazy_images, stopper=stopper, refresh=refresh)
+            if refresh is not None:
+                probes.extend(refresh.probes.tolist())
+        forwards_saved.extend(opt.stepLimit - forwards)
+        dpt_calls.extend(forwards)
+        if opt.parity:
+            linear_images, _, _, _ = dehazer.run_batch(hazy_images, stopper=stopper if refresh is not None else None)
+            del dehazer.latency[-len(linear_images):]     # latency of this run only
+            linear_psnrs, linear_ssims = batch_metrics(linear_images, clear_images, device=opt.device)
+            parity['linear_psnr'].extend(linear_psnrs.tolist())
+            parity['linear_ssim'].extend(linear_ssims.tolist())
         
-        cur_depth = None
-        sum_depth = torch.zeros_like(init_depth).to('cuda')
-
-        entropy_max = 0
-        # entropy_max, ent_flag, ent_limit = 0, 0, 20
-        for step in range(0, opt.stepLimit):
-            with torch.no_grad():
-                cur_depth = model.forward(cur_hazy)
-            
-            diff_depth = cur_depth*step - sum_depth
-            cur_hazy = util.denormalize(cur_hazy,opt.norm)
-            trans = torch.exp((diff_depth+cur_depth)*opt.betaStep*-1)
-            sum_depth = cur_depth * (step+1)
-            
-            prediction = (cur_hazy - airlight) / (trans + opt.eps) + airlight
-            prediction = torch.clamp(prediction, 0, 1)
-
-            entropy, _, _ = metrics_module.get_cur(cur_hazy[0].detach().cpu().numpy().transpose(1,2,0))
-            if entropy_max < entropy:
-                entropy_max = entropy
-                optimal_dehazed = cur_hazy[0].detach().cpu().numpy()
+        # whole batch on the device, one copy of the B values back
+        psnrs, ssims = batch_metrics(optimal_images, clear_images, device=opt.device)
+        for psnr, ssim, entropy_max, gt_beta, input_name in zip(psnrs.tolist(), ssims.tolist(), entropy_maxs, gt_betas, input_names):
+            input_name = input_name[:-4]
+            parity['psnr'].append(psnr)
+            parity['ssim'].append(ssim)
             
-            cur_hazy = util.normalize(prediction[0].detach().cpu().numpy().transpose(1,2,0),opt.norm).unsqueeze(0).to(opt.device)
-        
-        psnr = get_psnr(optimal_dehazed, clear_image)
-        ssim = get_ssim(optimal_dehazed, clear_image).item()
-        
-        wr.writerow([input_name, gt_beta.item(), psnr, ssim, entropy_max])
+            wr.writerow([input_name, gt_beta.item(), psnr, ssim, entropy_max, dehazer.latency[-1]])
+        pbar.set_postfix(latency=f'{dehazer.latency[-1]:.3f}s')
         
         # optimal_dehazed = (optimal_dehazed*255).astype(np.uint8).transpose(1,2,0)
         # cv2.imwrite(f'{output_folder}/{input_name}.jpg', cv2.cvtColor(optimal_dehazed, cv2.COLOR_RGB2BGR))
@@ -113,12 +133,29 @@ def run(opt, model, airlight_model, metrics_module, loader):
         
 
     f.close()
+    print(f'mean latency per image : {dehazer.mean_latency():.4f}s')
+    if opt.coarseToFine:
+        print(f'[{opt.dataset}] coarse-to-fine : {np.mean(forwards_saved):.2f} / {opt.stepLimit} full resolution DPT forwards saved per image')
+    else:
+        print(f'[{opt.dataset}] stopper={opt.stopper} : {np.mean(forwards_saved):.2f} / {opt.stepLimit} DPT forwards saved per image')
+        print(f'[{opt.dataset}] refresh={opt.refresh} : {np.mean(dpt_calls):.2f} DPT calls per image' + (f' (+ {np.mean(probes):.2f} low resolution probes)' if probes else ''))
+    if opt.parity:
+        reference = 'per-step refresh' if refresh is not None and not opt.coarseToFine else 'linear sweep'
+        print(f"{reference:16} : PSNR {np.mean(parity['linear_psnr']):.3f}  SSIM {np.mean(parity['linear_ssim']):.4f}")
+        print(f"{'this run':16} : PSNR {np.mean(parity['psnr']):.3f}  SSIM {np.mean(parity['ssim']):.4f}")
+        print(f"{'delta':16} : PSNR {np.mean(parity['psnr']) - np.mean(parity['linear_psnr']):+.3f}  SSIM {np.mean(parity['ssim']) - np.mean(parity['linear_ssim']):+.4f}")
 
 
 if __name__ == '__main__':
     opt = get_args()
+    if opt.quantized is not None:
+        # eager int8 modules run on the cpu only, whatever the default device
+        opt.device = torch.device('cpu')
     opt.norm = True
     opt.verbose = True
+    if opt.coarseToFine and (opt.stopper != 'none' or opt.refresh != 'step'):
+        # the coarse-to-fine search has its own schedule : no online stop rule, one depth per fine step
+        raise ValueError('--coarseToFine runs without --stopper and --refresh')
     
     #opt.seed = random.randint(1, 10000)
     random.seed(opt.seed)
@@ -127,29 +164,37 @@ if __name__ == '__main__':
     print("=========| Option |=========\n", opt)
     
     
-    model = DPTDepthModel(
-        path = opt.preTrainedModel,
-        scale=opt.scale, shift=opt.shift, invert=True,
-        backbone=opt.backbone,
-        non_negative=True,
-        enable_attention_hooks=False,
-    )
-    model = model.to(memory_format=torch.channels_last)
-    model.to(opt.device)
-    
-        
-    airlight_model = UNet([opt.imageSize_W, opt.imageSize_H], in_channels=3, out_channels=1, bilinear=True)
-    checkpoint = torch.load(opt.preTrainedAirModel)
-    airlight_model.load_state_dict(checkpoint['model_state_dict'])
-    airlight_model.to(opt.device)
-
-    dataset_args = dict(img_size=[opt.imageSize_W, opt.imageSize_H], norm=opt.norm)
+    if opt.backend == 'onnx':
+        from models.onnx_backend import OnnxModel
+        model = OnnxModel(opt.onnxModel, opt.onnxThreads)
+        airlight_model = OnnxModel(opt.onnxAirModel, opt.onnxThreads)
+    else:
+        model = DPTDepthModel(
+            path = opt.preTrainedModel,
+            scale=opt.scale, shift=opt.shift, invert=True,
+            backbone=opt.backbone,
+            non_negative=True,
+            enable_attention_hooks=False,
+        )
+        if opt.quantized is not None:
+            model.load_quantized(opt.quantized)
+        model.to(opt.device)
+        model.inference_mode(channels_last=True,
+                             autocast_dtype=None if opt.autocast == 'none' else getattr(torch, opt.autocast),
+                             capture=None if opt.capture == 'none' else opt.capture)
+
+        airlight_model = UNet([opt.imageSize_W, opt.imageSize_H], in_channels=3, out_channels=1, bilinear=True)
+        checkpoint = torch.load(opt.preTrainedAirModel)
+        airlight_model.load_state_dict(checkpoint['model_state_dict'])
+        airlight_model.to(opt.device)
+
+    dataset_args = dict(img_size=[opt.imageSize_W, opt.imageSize_H], norm=opt.norm, packed=opt.packedRoot, manifest=opt.manifest)
     if opt.dataset == 'NYU':
         val_set   = NYU_Dataset(opt.dataRoot + '/train', **dataset_args)
     elif opt.dataset == 'RESIDE':
         val_set   = RESIDE_Dataset(opt.dataRoot + '/val',   **dataset_args)
 
-    loader_args = dict(batch_size=1, num_workers=1, drop_last=False, shuffle=False)
+    loader_args = dict(batch_size=opt.batchSize, num_workers=1, drop_last=False, shuffle=False)
     val_loader = DataLoader(dataset=val_set, **loader_args)
     metrics_module = Entropy_Module()
     
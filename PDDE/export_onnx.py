@@ -0,0 +1,187 @@
+# User warnings ignore
+import warnings
+warnings.filterwarnings("ignore")
+
+import os
+os.environ['KMP_DUPLICATE_LIB_OK']='True'
+
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from glob import glob
+from torch.export import Dim
+from models.depth_models import DPTDepthModel
+from models.air_models import UNet
+from models.onnx_backend import OnnxModel
+from utils.io import load_item2, make_transform
+
+
+# ONNX graphs of the PDDE networks for the onnxruntime backend (--backend onnx of the runners)
+#   python export_onnx.py --preTrainedModel weights/depth_weights/dpt_hybrid_kitti-cb926ef4_RESIDE_046.pt \
+#                         --preTrainedAirModel weights/air_weights/Air_UNet_RESIDE_V0_epoch_16.pt --outputDir weights/onnx
+# dpt : DPTDepthModel.forward (scale / shift / invert baked in), dynamic batch, fixed or dynamic (--dynamicSpatial) H x W
+#       second output inv_depth : network output before scale / shift / invert
+# air : UNet, dynamic batch, fixed H x W (OutConv2 pools to 256 x 256 and flattens into a Linear)
+# after export : parity against eager torch and latency of torch vs onnxruntime
+#   parity is measured on the network output (dpt : inv_depth, air : airlight) as relative L2 error,
+#   the converted dpt depth is ~1/shift with random weights and would pass any tolerance
+#   --images : real hazy images as parity inputs (random inputs otherwise)
+#   --checkOnly : parity of the already exported graphs, no export (fails with a non-zero exit above --rtol)
+#     python export_onnx.py --checkOnly --preTrainedModel ... --preTrainedAirModel ... --images "D:/data/RESIDE_V0_outdoor/val/hazy/*/*.jpg"
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=float, default=0.000150,  help='depth scale')
+    parser.add_argument('--shift', type=float, default= 0.1378,  help='depth shift')
+    parser.add_argument('--preTrainedModel', type=str, default=None, help='pretrained DPT path (random weights if None)')
+    parser.add_argument('--preTrainedAirModel', type=str, default=None, help='pretrained Air path (random weights if None)')
+    parser.add_argument('--backbone', type=str, default="vitb_rn50_384", help='DPT backbone')
+    parser.add_argument('--models', type=str, nargs='+', default=['dpt', 'air'], help='networks to export (dpt, air)')
+
+    parser.add_argument('--imageSize_W', type=int, default=256, help='the width of the exported input')
+    parser.add_argument('--imageSize_H', type=int, default=256, help='the height of the exported input')
+    parser.add_argument('--dynamicSpatial', action='store_true', help='dpt : any H x W multiple of 32 (slower export)')
+    parser.add_argument('--maxBatch', type=int, default=64, help='largest batch of the dynamic batch dim')
+
+    parser.add_argument('--outputDir', type=str, default='weights/onnx', help='onnx output folder')
+    parser.add_argument('--threads', type=int, default=None, help='intra-op threads of torch and onnxruntime for the comparison')
+    parser.add_argument('--iters', type=int, default=5, help='timed forwards per backend')
+    parser.add_argument('--rtol', type=float, default=1e-3, help='max relative L2 error of the network output accepted by the parity check')
+    parser.add_argument('--images', type=str, default=None, help='glob of hazy images used as parity inputs (random inputs if None)')
+    parser.add_argument('--numImages', type=int, default=8, help='parity images taken from --images')
+    parser.add_argument('--checkOnly', action='store_true', help='parity check of the exported graphs only (no export)')
+    return parser.parse_args()
+
+
+class DepthOutputs(nn.Module):
+    # (depth, inv_depth) : the exported depth and the network output it is converted from
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        inv_depth = self.model.forward_network(x)
+        return self.model.to_depth(inv_depth.clone()), inv_depth
+
+
+def make_model(opt, name):
+    # random weights are seeded per network : --checkOnly rebuilds the weights of the exported graph
+    torch.manual_seed(0)
+    if name == 'dpt':
+        return DPTDepthModel(
+            path = opt.preTrainedModel,
+            scale=opt.scale, shift=opt.shift, invert=True,
+            backbone=opt.backbone,
+            non_negative=True,
+            enable_attention_hooks=False,
+        ).eval()
+    model = UNet([opt.imageSize_W, opt.imageSize_H], in_channels=3, out_channels=1, bilinear=True)
+    if opt.preTrainedAirModel is not None:
+        checkpoint = torch.load(opt.preTrainedAirModel, map_location='cpu')
+        model.load_state_dict(checkpoint['model_state_dict'])
+    return model.eval()
+
+
+def onnx_path(opt, name):
+    weights = opt.preTrainedModel if name == 'dpt' else opt.preTrainedAirModel
+    stem = 'random' if weights is None else os.path.splitext(os.path.basename(weights))[0]
+    spatial = 'dyn' if name == 'dpt' and opt.dynamicSpatial else f'{opt.imageSize_W}x{opt.imageSize_H}'
+    return f'{opt.outputDir}/{name}_{stem}_{spatial}.onnx'
+
+
+def latency(fn, x, iters):
+    fn(x)
+    start = time.perf_counter()
+    for _ in range(iters):
+        fn(x)
+    return (time.perf_counter() - start) / iters
+
+
+def parity_inputs(opt, name):
+    # batches checked against torch : the hazy images of --images, or random batches (2 and 1 images, other H x W if dynamic)
+    H, W = opt.imageSize_H, opt.imageSize_W
+    if opt.images is not None:
+        transform = make_transform([W, H], norm=True)
+        files = sorted(glob(opt.images))[:opt.numImages]
+        if not files:
+            raise FileNotFoundError(opt.images)
+        images = torch.stack([torch.from_numpy(load_item2(file, transform)) for file in files])
+        return list(images.split(2))
+    inputs = [torch.rand(2, 3, H, W) * 2 - 1, torch.rand(1, 3, H, W) * 2 - 1]
+    if name == 'dpt' and opt.dynamicSpatial:
+        inputs.append(torch.rand(1, 3, H + 64, W - 32) * 2 - 1)
+    return inputs
+
+
+def network_output(model, name, x):
+    # output compared by the parity check : dpt inverse depth (before scale / shift / invert), air airlight
+    with torch.no_grad():
+        return (model.forward_network(x) if name == 'dpt' else model(x)).numpy()
+
+
+def check_parity(session, references, inputs, name):
+    parity = []
+    for x, reference in zip(inputs, references):
+        outputs = session.session.run(None, {session.input_name: x.numpy()})
+        out = outputs[1] if name == 'dpt' else outputs[0]
+        diff = out - reference
+        parity.append(dict(shape=list(x.shape), rel_l2=float(np.linalg.norm(diff) / np.linalg.norm(reference)),
+                           max_abs=float(np.abs(diff).max() / np.abs(reference).max())))
+    return parity
+
+
+def export(opt, name):
+    model = make_model(opt, name)
+    H, W = opt.imageSize_H, opt.imageSize_W
+    shapes = {0: Dim('batch', min=1, max=opt.maxBatch)}
+    if name == 'dpt' and opt.dynamicSpatial:
+        shapes.update({2: 32 * Dim('h32', min=1, max=64), 3: 32 * Dim('w32', min=1, max=64)})
+    inputs = parity_inputs(opt, name)
+
+    # eager references first : export leaves the ViT activation hooks of the traced model unusable
+    references = [network_output(model, name, x) for x in inputs]
+    with torch.no_grad():
+        torch_latency = latency(model, inputs[-1], opt.iters)
+
+    path = onnx_path(opt, name)
+    export_time = 0.0
+    if not opt.checkOnly:
+        example = torch.rand(2, 3, H, W) * 2 - 1
+        start = time.perf_counter()
+        if name == 'dpt':
+            torch.onnx.export(DepthOutputs(model), (example,), path, dynamo=True, optimize=True,
+                              input_names=['input'], output_names=['output', 'inv_depth'], dynamic_shapes={'x': shapes})
+        else:
+            torch.onnx.export(model, (example,), path, dynamo=True, optimize=True,
+                              input_names=['input'], output_names=['output'], dynamic_shapes={'x': shapes})
+        export_time = time.perf_counter() - start
+
+    session = OnnxModel(path, opt.threads)
+    parity = check_parity(session, references, inputs, name)
+    onnx_latency = latency(session, inputs[-1], opt.iters)
+
+    result = dict(model=name, path=path, export_s=export_time, parity=parity,
+                  torch_ms=torch_latency * 1000, onnx_ms=onnx_latency * 1000, speedup=torch_latency / onnx_latency)
+    print(f"{name:4} {path} ({export_time:.0f}s)")
+    for check in parity:
+        print(f"     {str(check['shape']):18} rel L2 {check['rel_l2']:.2e}  max abs / range {check['max_abs']:.2e}")
+    print(f"     torch {result['torch_ms']:.1f} ms, onnxruntime {result['onnx_ms']:.1f} ms / batch (x{result['speedup']:.2f})")
+    if max(check['rel_l2'] for check in parity) > opt.rtol:
+        raise RuntimeError(f'{path} : onnxruntime network output differs from torch by more than rtol={opt.rtol}')
+    return result
+
+
+if __name__ == '__main__':
+    opt = get_args()
+    if opt.threads is not None:
+        torch.set_num_threads(opt.threads)
+    if not os.path.exists(opt.outputDir):
+        os.makedirs(opt.outputDir)
+
+    results = [export(opt, name) for name in opt.models]
+    with open(f"{opt.outputDir}/{'parity' if opt.checkOnly else 'export'}_report.json", 'w') as f:
+        json.dump(dict(config=vars(opt), threads=torch.get_num_threads(), results=results), f, indent=2)
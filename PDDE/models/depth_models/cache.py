@@ -0,0 +1,135 @@
+import os
+import hashlib
+import sqlite3
+import time
+import numpy as np
+import torch
+
+
+class DepthCache():
+    """
+    Content-addressed on-disk cache of depth predictions.
+
+    key   : sha1(model checkpoint hash, input shape, input bytes) per sample
+    value : float16 depth map stored in a slot of a memory-mapped shard file (one shard family per resolution)
+    index : sqlite (key -> shard, slot, last_used), least recently used slots are reused once max_bytes is reached
+    every forward ends with its index writes committed (hit recency in one executemany, misses in one
+    BEGIN IMMEDIATE transaction), so several processes can share one cache directory
+    """
+    def __init__(self, root, max_bytes=8 * 1024**3, shard_slots=256):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.shard_slots = shard_slots
+        self.shards = {}
+        self.hits, self.misses = 0, 0
+
+        if not os.path.exists(root):
+            os.makedirs(root)
+        self.db = sqlite3.connect(os.path.join(root, 'index.sqlite'), timeout=60)
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, res TEXT, shard INTEGER, slot INTEGER, last_used REAL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS shards (res TEXT, shard INTEGER, slots INTEGER, nbytes INTEGER, PRIMARY KEY (res, shard))')
+        self.db.commit()
+
+    @staticmethod
+    def hash_file(path):
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @staticmethod
+    def make_key(model_hash, image):
+        # image : 3xHxW tensor (any device)
+        image = image.detach().contiguous().cpu()
+        sha = hashlib.sha1()
+        sha.update(model_hash.encode())
+        sha.update(str(tuple(image.shape) + (str(image.dtype),)).encode())
+        sha.update(image.numpy().tobytes())
+        return sha.hexdigest()
+
+    def _shard(self, res, shard):
+        if (res, shard) not in self.shards:
+            h, w = map(int, res.split('x'))
+            path = os.path.join(self.root, f'depth_{res}_{shard:04}.f16')
+            mode = 'r+' if os.path.exists(path) else 'w+'
+            self.shards[(res, shard)] = np.memmap(path, dtype=np.float16, mode=mode, shape=(self.shard_slots, h, w))
+        return self.shards[(res, shard)]
+
+    def _total_bytes(self):
+        total = self.db.execute('SELECT SUM(nbytes) FROM shards').fetchone()[0]
+        return 0 if total is None else total
+
+    def _allocate(self, res, h, w):
+        # 1. free slot in an existing shard
+        counts = dict(self.db.execute('SELECT shard, COUNT(*) FROM entries WHERE res=? GROUP BY shard', (res,)).fetchall())
+        for shard, slots in self.db.execute('SELECT shard, slots FROM shards WHERE res=?', (res,)).fetchall():
+            if counts.get(shard, 0) < slots:
+                used = {row[0] for row in self.db.execute('SELECT slot FROM entries WHERE res=? AND shard=?', (res, shard))}
+                return shard, min(set(range(slots)) - used)
+
+        # 2. new shard while under the size bound
+        nbytes = self.shard_slots * h * w * 2
+        if self._total_bytes() + nbytes <= self.max_bytes or self.db.execute('SELECT COUNT(*) FROM shards WHERE res=?', (res,)).fetchone()[0] == 0:
+            shard = self.db.execute('SELECT COUNT(*) FROM shards WHERE res=?', (res,)).fetchone()[0]
+            self.db.execute('INSERT INTO shards VALUES (?, ?, ?, ?)', (res, shard, self.shard_slots, nbytes))
+            return shard, 0
+
+        # 3. evict the least recently used entry of this resolution
+        key, shard, slot = self.db.execute('SELECT key, shard, slot FROM entries WHERE res=? ORDER BY last_used LIMIT 1', (res,)).fetchone()
+        self.db.execute('DELETE FROM entries WHERE key=?', (key,))
+        return shard, slot
+
+    def get(self, key):
+        # read only, the recency of hits is written by touch()
+        row = self.db.execute('SELECT res, shard, slot FROM entries WHERE key=?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        res, shard, slot = row
+        self.hits += 1
+        return np.array(self._shard(res, shard)[slot])
+
+    def touch(self, keys):
+        # last_used of the hit keys, one statement and one commit
+        if len(keys) > 0:
+            now = time.time()
+            self.db.executemany('UPDATE entries SET last_used=? WHERE key=?', [(now, key) for key in keys])
+            self.db.commit()
+
+    def put(self, key, depth):
+        # depth : HxW array
+        h, w = depth.shape
+        res = f'{h}x{w}'
+        shard, slot = self._allocate(res, h, w)
+        memmap = self._shard(res, shard)
+        memmap[slot] = depth.astype(np.float16)
+        self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', (key, res, shard, slot, time.time()))
+
+    def flush(self):
+        for memmap in self.shards.values():
+            memmap.flush()
+        self.db.commit()
+
+    def forward(self, model, model_hash, x):
+        """
+        Cached model.forward(x) for a Bx3xHxW batch : only the missing samples are forwarded.
+        output is Bx1xHxW float32 on x.device
+        """
+        keys = [self.make_key(model_hash, image) for image in x]
+        cached = [self.get(key) for key in keys]
+        missing = [i for i, depth in enumerate(cached) if depth is None]
+
+        self.touch([key for key, depth in zip(keys, cached) if depth is not None])
+
+        if len(missing) > 0:
+            out = model(x[missing])
+            # slot allocation and inserts in one write transaction (no two processes take the same slot)
+            self.db.execute('BEGIN IMMEDIATE')
+            for i, depth in zip(missing, out[:, 0].detach().float().cpu().numpy()):
+                self.put(keys[i], depth)
+                cached[i] = depth.astype(np.float16)    # same values as a later cache hit
+            self.flush()
+
+        depth = torch.from_numpy(np.stack(cached).astype(np.float32)).unsqueeze(1)
+        return depth.to(x.device)
@@ -116,26 +116,17 @@ def forward_vit(pretrained, x):
     layer_3 = pretrained.act_postprocess3[0:2](layer_3)
     layer_4 = pretrained.act_postprocess4[0:2](layer_4)
 
-    unflatten = nn.Sequential(
-        nn.Unflatten(
-            2,
-            torch.Size(
-                [
-                    h // pretrained.model.patch_size[1],
-                    w // pretrained.model.patch_size[0],
-                ]
-            ),
-        )
-    )
+    # Tensor.unflatten instead of nn.Unflatten(torch.Size) : sizes may be symbolic (onnx export with dynamic spatial dims)
+    grid = (h // pretrained.model.patch_size[1], w // pretrained.model.patch_size[0])
 
     if layer_1.ndim == 3:
-        layer_1 = unflatten(layer_1)
+        layer_1 = layer_1.unflatten(2, grid)
     if layer_2.ndim == 3:
-        layer_2 = unflatten(layer_2)
+        layer_2 = layer_2.unflatten(2, grid)
     if layer_3.ndim == 3:
-        layer_3 = unflatten(layer_3)
+        layer_3 = layer_3.unflatten(2, grid)
     if layer_4.ndim == 3:
-        layer_4 = unflatten(layer_4)
+        layer_4 = layer_4.unflatten(2, grid)
 
     layer_1 = pretrained.act_postprocess1[3 : len(pretrained.act_postprocess1)](layer_1)
     layer_2 = pretrained.act_postprocess2[3 : len(pretrained.act_postprocess2)](layer_2)
@@ -146,6 +137,30 @@ def forward_vit(pretrained, x):
 
 
 def _resize_pos_embed(self, posemb, gs_h, gs_w):
+    # cached per grid : (gs_h, gs_w, device, dtype) -> (weights version, resized posemb)
+    key = (gs_h, gs_w, posemb.device, posemb.dtype)
+    cacheable = _pos_embed_cacheable(posemb)
+    if cacheable:
+        version = (posemb._version, posemb.data_ptr())
+        cached = self._pos_embed_cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+    posemb = _interpolate_pos_embed(self, posemb, gs_h, gs_w)
+
+    if cacheable:
+        self._pos_embed_cache[key] = (version, posemb)
+    return posemb
+
+
+def _pos_embed_cacheable(posemb):
+    # no cache while training the embedding (autograd graph) or tracing (torch.compile / export / jit : symbolic tensors)
+    if torch.jit.is_tracing() or torch.compiler.is_compiling():
+        return False
+    return not (torch.is_grad_enabled() and posemb.requires_grad)
+
+
+def _interpolate_pos_embed(self, posemb, gs_h, gs_w):
     posemb_tok, posemb_grid = (
         posemb[:, : self.start_index],
         posemb[0, self.start_index :],
@@ -344,6 +359,8 @@ def _make_vit_b16_backbone(
     pretrained.model._resize_pos_embed = types.MethodType(
         _resize_pos_embed, pretrained.model
     )
+    # resized position embeddings per grid size (weights version checked on every hit : load_state_dict, .to(), optimizer steps)
+    pretrained.model._pos_embed_cache = {}
 
     return pretrained
 
@@ -487,6 +504,8 @@ def _make_vit_b_rn50_backbone(
     pretrained.model._resize_pos_embed = types.MethodType(
         _resize_pos_embed, pretrained.model
     )
+    # resized position embeddings per grid size (weights version checked on every hit : load_state_dict, .to(), optimizer steps)
+    pretrained.model._pos_embed_cache = {}
 
     return pretrained
 
@@ -574,3 +593,25 @@ def _make_pretrained_deitb16_distil_384(
         start_index=2,
         enable_attention_hooks=enable_attention_hooks,
     )
+
+
+if __name__ == "__main__":
+    # per-forward position embedding overhead, resize every call vs cached : python -m models.depth_models.vit
+    import time
+
+    def per_call(fn, iters=1000):
+        fn()
+        start = time.perf_counter()
+        for _ in range(iters):
+            fn()
+        return (time.perf_counter() - start) / iters * 1e6
+
+    for name, features in [("vitb_rn50_384", 768), ("vitl16_384", 1024)]:
+        module = types.SimpleNamespace(start_index=1, _pos_embed_cache={})
+        posemb = nn.Parameter(torch.randn(1, 24 * 24 + 1, features))
+        for size in [256, 384, 512]:
+            gs = size // 16
+            with torch.no_grad():
+                resize = per_call(lambda: _interpolate_pos_embed(module, posemb, gs, gs))
+                cached = per_call(lambda: _resize_pos_embed(module, posemb, gs, gs))
+            print(f"{name:14} {size}x{size} : resize {resize:8.1f} us, cached {cached:6.2f} us per forward")
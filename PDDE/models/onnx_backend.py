@@ -0,0 +1,41 @@
+import os
+import numpy as np
+import torch
+import onnxruntime as ort
+
+
+class OnnxModel():
+    """
+    onnxruntime (CPU execution provider) session behind the torch model interface the runners use :
+    forward / __call__ on a Bx3xHxW tensor -> output tensor on the input's device, eval / to are no-ops
+        threads : intra-op threads (None : onnxruntime default, one per physical core)
+    graphs are written by export_onnx.py (dynamic batch, fixed or dynamic spatial dims)
+    """
+    def __init__(self, path, threads=None):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f'{path} (export it with export_onnx.py)')
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = 1
+        if threads is not None:
+            options.intra_op_num_threads = threads
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.training = False
+
+    def forward(self, x):
+        array = x.detach().float().cpu().contiguous().numpy()
+        out = self.session.run(None, {self.input_name: array})[0]
+        return torch.from_numpy(out).to(x.device)
+
+    def __call__(self, x):
+        return self.forward(x)
+
+    def eval(self):
+        return self
+
+    def to(self, *args, **kwargs):
+        return self
+
@@ -0,0 +1,202 @@
+# User warnings ignore
+import warnings
+warnings.filterwarnings("ignore")
+
+import os
+os.environ['KMP_DUPLICATE_LIB_OK']='True'
+
+import argparse
+import json
+import random
+import time
+from tqdm import tqdm
+
+import numpy as np
+import torch
+from models.depth_models import DPTDepthModel
+from models.air_models import UNet
+
+from dataset import *
+from torch.utils.data import DataLoader, Subset
+
+from utils.metrics import batch_metrics
+from utils import util
+from utils.util import compute_errors
+from utils.entropy_module import Entropy_Module
+from utils.dehazer import IterativeDehazer
+
+
+# int8 DPT for cpu inference (models/depth_models/quantize.py)
+#   calibrate : python quantize_dpt.py calibrate --dataRoot D:/data/RESIDE_V0_outdoor --static stem refinenets --quantized weights/depth_weights/dpt_hybrid_int8.pt
+#   report    : python quantize_dpt.py report --dataRoot D:/data/RESIDE_V0_outdoor --quantized weights/depth_weights/dpt_hybrid_int8.pt --output output/quantize_report.json
+# report : compute_errors (abs_rel, a1 = delta < 1.25) of fp32 / int8 depth against GT depth (median scaled like
+#          the validDepth_* scripts) and of int8 against fp32 (unscaled),
+#          end-to-end PDDE PSNR / SSIM with each depth model, DPT forward latency
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['calibrate', 'report'])
+    parser.add_argument('--dataset', required=False, default='RESIDE',  help='dataset name')
+    parser.add_argument('--dataRoot', type=str, default='D:/data/RESIDE_V0_outdoor',  help='data file path')
+    parser.add_argument('--split', type=str, default='val',  help='calibration / report split (NYU : train)')
+    parser.add_argument('--scale', type=float, default=0.000150,  help='depth scale')
+    parser.add_argument('--shift', type=float, default= 0.1378,  help='depth shift')
+    parser.add_argument('--preTrainedModel', type=str, default='weights/depth_weights/dpt_hybrid_kitti-cb926ef4_RESIDE_046.pt', help='pretrained DPT path')
+    parser.add_argument('--preTrainedAirModel', type=str, default='weights/air_weights/Air_UNet_RESIDE_V0_epoch_16.pt', help='pretrained Air path')
+    parser.add_argument('--quantized', type=str, default='weights/depth_weights/dpt_hybrid_int8.pt', help='int8 DPT path (written by calibrate)')
+
+    parser.add_argument('--seed', type=int, default=101, help='Random Seed')
+    parser.add_argument('--imageSize_W', type=int, default=256, help='the width of the resized input image to network')
+    parser.add_argument('--imageSize_H', type=int, default=256, help='the height of the resized input image to network')
+    parser.add_argument('--backbone', type=str, default="vitb_rn50_384", help='DPT backbone')
+    parser.add_argument('--batchSize', type=int, default=4, help='images per calibration / report batch')
+
+    parser.add_argument('--dynamic', type=int, default=1, help='int8 nn.Linear of the ViT blocks (0 / 1)')
+    parser.add_argument('--static', type=str, nargs='*', default=[], help='statically quantized parts (stem, refinenets)')
+    parser.add_argument('--calibImages', type=int, default=64, help='calibration images (first slice of the shuffled split)')
+    parser.add_argument('--numImages', type=int, default=100, help='report images (slice of the shuffled split after the calibration images)')
+
+    parser.add_argument('--betaStep', type=float, default=0.005, help='beta step')
+    parser.add_argument('--stepLimit', type=int, default=50, help='Multi step limit')
+    parser.add_argument('--eps', type=float, default=1e-12, help='Epsilon value for non zero calculating')
+    parser.add_argument('--output', type=str, default='output/quantize_report.json', help='json report path')
+    return parser.parse_args()
+
+
+def make_model(opt):
+    model = DPTDepthModel(
+        path = opt.preTrainedModel,
+        scale=opt.scale, shift=opt.shift, invert=True,
+        backbone=opt.backbone,
+        non_negative=True,
+        enable_attention_hooks=False,
+    )
+    return model.eval()
+
+
+def make_dataset(opt):
+    dataset_args = dict(img_size=[opt.imageSize_W, opt.imageSize_H], norm=True)
+    if opt.dataset == 'NYU':
+        return NYU_Dataset(opt.dataRoot + '/' + opt.split, **dataset_args)
+    elif opt.dataset == 'RESIDE':
+        return RESIDE_Dataset(opt.dataRoot + '/' + opt.split, **dataset_args)
+
+
+def split_indices(opt, size):
+    # one shuffle of the split (seeded), calibration and report take disjoint slices of it
+    order = list(range(size))
+    random.Random(opt.seed).shuffle(order)
+    return order[:opt.calibImages], order[opt.calibImages:opt.calibImages + opt.numImages]
+
+
+def make_loader(opt, dataset, indices):
+    return DataLoader(Subset(dataset, indices), batch_size=opt.batchSize, num_workers=1, shuffle=False)
+
+
+def calibrate(opt):
+    model = make_model(opt)
+    dataset = make_dataset(opt)
+    indices, _ = split_indices(opt, len(dataset))
+    calibration = (hazy_images for hazy_images, *_ in tqdm(make_loader(opt, dataset, indices), desc='calibration'))
+    model.quantize(dynamic=bool(opt.dynamic), static=opt.static, calibration=calibration)
+    if not os.path.exists(os.path.dirname(opt.quantized) or '.'):
+        os.makedirs(os.path.dirname(opt.quantized))
+    model.save_quantized(opt.quantized, calibration=dict(dataset=opt.dataset, dataRoot=opt.dataRoot, split=opt.split,
+                                                         size=len(dataset), indices=indices))
+    print(f'{opt.quantized} : {os.path.getsize(opt.quantized) / 1024**2:.1f} MB (fp32 {os.path.getsize(opt.preTrainedModel) / 1024**2:.1f} MB)')
+
+
+def depth_errors(gt, pred, median_scaling=True):
+    # compute_errors per image, pixels with gt > 0
+    # median_scaling : pred * median(gt) / median(pred) first, as the validDepth_* scripts do
+    errors = []
+    for gt_depth, pred_depth in zip(gt, pred):
+        valid = gt_depth > 0
+        gt_depth, pred_depth = gt_depth[valid], pred_depth[valid]
+        if median_scaling:
+            pred_depth = pred_depth * (np.median(gt_depth) / np.median(pred_depth))
+        errors.append(compute_errors(gt_depth, pred_depth))
+    return errors
+
+
+def report_indices(opt, dataset):
+    # report slice of the split, checked against the calibration images saved with the int8 weights
+    _, indices = split_indices(opt, len(dataset))
+    calibration = torch.load(opt.quantized, map_location='cpu', weights_only=False).get('calibration')
+    if calibration is None:
+        raise ValueError(f'{opt.quantized} has no calibration record, calibrate it again with quantize_dpt.py calibrate')
+    same_split = (calibration['dataset'], os.path.normpath(calibration['dataRoot']), calibration['split'], calibration['size']) == \
+                 (opt.dataset, os.path.normpath(opt.dataRoot), opt.split, len(dataset))
+    overlap = set(indices) & set(calibration['indices']) if same_split else set()
+    if overlap:
+        raise ValueError(f'{len(overlap)} report images were used for calibration (use the calibration --seed / --calibImages)')
+    return indices
+
+
+def report(opt):
+    dataset = make_dataset(opt)
+    indices = report_indices(opt, dataset)
+    models = {'fp32': make_model(opt).inference_mode(channels_last=True),
+              'int8': make_model(opt).load_quantized(opt.quantized).inference_mode(channels_last=True)}
+    airlight_model = UNet([opt.imageSize_W, opt.imageSize_H], in_channels=3, out_channels=1, bilinear=True)
+    checkpoint = torch.load(opt.preTrainedAirModel, map_location='cpu')
+    airlight_model.load_state_dict(checkpoint['model_state_dict'])
+    airlight_model.eval()
+    metrics_module = Entropy_Module()
+    dehazers = {name: IterativeDehazer(model, airlight_model, metrics_module, opt.dataset, norm=True,
+                                       beta_step=opt.betaStep, step_limit=opt.stepLimit, eps=opt.eps, device='cpu')
+                for name, model in models.items()}
+
+    results = {name: dict(depth=[], psnr=[], ssim=[], latency=[]) for name in models}
+    agreement = []
+    for hazy_images, clear_images, depth_images, *_ in tqdm(make_loader(opt, dataset, indices), desc='report'):
+        clear_images = util.denormalize(clear_images, True)
+        gt_depth = depth_images.numpy().astype(np.float64)
+        depths = {}
+        for name, model in models.items():
+            with torch.no_grad():
+                start = time.perf_counter()
+                depths[name] = model(hazy_images).numpy().astype(np.float64)
+                results[name]['latency'].append((time.perf_counter() - start) / len(hazy_images))
+            results[name]['depth'] += depth_errors(gt_depth, depths[name])
+
+            optimal_images, _, _, _ = dehazers[name].run_batch(hazy_images)
+            psnrs, ssims = batch_metrics(optimal_images, clear_images)
+            results[name]['psnr'] += psnrs.tolist()
+            results[name]['ssim'] += ssims.tolist()
+        # int8 against fp32 as is : a scale drift of the quantized model counts as error
+        agreement += depth_errors(depths['fp32'], depths['int8'], median_scaling=False)
+
+    summary = {}
+    for name, result in results.items():
+        depth = np.mean(result['depth'], axis=0)
+        summary[name] = dict(abs_rel=depth[0], a1=depth[4], psnr=np.mean(result['psnr']), ssim=np.mean(result['ssim']),
+                             latency_ms=np.mean(result['latency']) * 1000)
+    agreement = np.mean(agreement, axis=0)
+    summary['int8_vs_fp32'] = dict(abs_rel=agreement[0], a1=agreement[4],
+                                   psnr_delta=summary['int8']['psnr'] - summary['fp32']['psnr'],
+                                   speedup=summary['fp32']['latency_ms'] / summary['int8']['latency_ms'])
+
+    print(f"{'':14}{'abs_rel':>10}{'a1':>10}{'PSNR':>10}{'SSIM':>10}{'ms/image':>10}")
+    for name in models:
+        row = summary[name]
+        print(f"{name:14}{row['abs_rel']:10.4f}{row['a1']:10.4f}{row['psnr']:10.3f}{row['ssim']:10.4f}{row['latency_ms']:10.1f}")
+    row = summary['int8_vs_fp32']
+    print(f"int8 vs fp32 : abs_rel {row['abs_rel']:.4f}  a1 {row['a1']:.4f}  PSNR {row['psnr_delta']:+.3f} dB  speedup x{row['speedup']:.2f}")
+
+    if not os.path.exists(os.path.dirname(opt.output) or '.'):
+        os.makedirs(os.path.dirname(opt.output))
+    with open(opt.output, 'w') as f:
+        json.dump(dict(config=vars(opt), summary=summary), f, indent=2, default=float)
+
+
+if __name__ == '__main__':
+    opt = get_args()
+    random.seed(opt.seed)
+    torch.manual_seed(opt.seed)
+    print("=========| Option |=========\n", opt)
+
+    if opt.command == 'calibrate':
+        calibrate(opt)
+    else:
+        report(opt)
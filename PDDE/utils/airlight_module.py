@@ -2,231 +2,102 @@ from math import nan
 import cv2
 import numpy as np
 import torch
+import torch.nn.functional as F
 from .util import denormalize
 
 
-def get_Airlight(images, norm=True, color_cast_threshold=5):
-    # image input must be Bx3xWxH
+def get_Airlight(images, norm=True, color_cast_threshold=5, approx_ccl=False, ccl_iters=256):
+    """
+    Device-resident batched airlight estimation (AWC + LLF).
+    images : Bx3xHxW tensor (normalized if norm), stays on its device
+    approx_ccl : count connected components by label propagation on the device (capped by ccl_iters)
+                 instead of cv2.connectedComponents on a host copy of the binarized hue
+    return Bx3xHxW airlight, a broadcast (expand) view of the Bx3 airlight colors
+    """
+    B, _, H, W = images.shape
+    img_size = H * W
     if norm:
-        images = torch.round(((images * 0.5) + 0.5) * 255.0).type(torch.uint8)
+        images = torch.round(((images * 0.5) + 0.5) * 255.0)
     else:
-        images = torch.round(images * 255).type(torch.uint8)
+        images = torch.round(images * 255)
     images = torch.clamp(images, 0, 255)
     
-    airlight = []
-    for image in images:
-        img_size = image.shape[1] * image.shape[2]
-        
-        # 1. RGB to HSV
-        hue, saturation, value = rgb2hsv(image)
-        
-        # 2. Hue histogram labeling
-        val, cnt = torch.unique(hue, return_counts=True)
-        prob = cnt / img_size    # PMF
-        T_H = 1 / 360
-        
-        binarized_hue = np.zeros((hue.shape), np.uint8)
-        for v, p in zip(val, prob):
-            if p > T_H:
-                row, col = torch.where(hue == v)
-                for r, c in zip(row, col):
-                    binarized_hue[r][c] = 1
-        binarized_hue = binarized_hue.astype('uint8')
-        
-        # 3. Color cast attenuation
-        num_labels, _ = cv2.connectedComponents(binarized_hue)   # Connected Component Labeling (CCL)
-        if num_labels < color_cast_threshold:   # has color cast
-            bottom_1p = round(img_size * 0.01)
-
-            avg_least_values = torch.topk(hue.flatten(), bottom_1p, largest=False).values.float().mean().round().item()
-            hue = hue - avg_least_values
-            hue[hue < 0] = 0
-            
-            avg_least_values = torch.topk(saturation.flatten(), bottom_1p, largest=False).values.float().mean().round().item()
-            saturation = saturation - avg_least_values
-            saturation[saturation < 0] = 0
-            
-            avg_least_values = torch.topk(value.flatten(), bottom_1p, largest=False).values.float().mean().round().item()
-            value = value - avg_least_values
-            value[value < 0] = 0
-        
-        # 4. HSV to RGB
-        image = hsv2rgb(hue, saturation, value).round().int().clamp(0, 255)
-        min_channel = torch.amin(image, 0)
-        
-        val, cnt = torch.unique(min_channel, return_counts=True)
-        prob = cnt / img_size
-        
-        l = np.zeros((256))
-        for i, v in enumerate(val):
-            l[v] = prob[i]
-        l = torch.Tensor(l)
-        
-        # 2. 1D minimum filter
-        P_m = []
-        for i in range(256):
-            if i <= 5:
-                P_m.append(torch.min(l[:i+6]))
-            elif 5 < i <= 249:
-                P_m.append(torch.min(l[i-5:i+6]))
-            else:
-                P_m.append(torch.min(l[i-5:]))
-        
-        # 3. Airlight color estimation to RGB to RGB
-        threshold, idx = 0.0, []
-        for i in range(255, -1, -1):
-            if P_m[i] > 0.0:
-                threshold += P_m[i]
-                idx.append(i)
-                if threshold >= 0.01:
-                    break
-        
-        avg = {'r': [], 'g': [], 'b': []}
-        for i in idx:
-            row, col = torch.where(min_channel == i)
-            for r, c in zip(row, col):
-                avg['r'].append(image[0][r][c])
-                avg['g'].append(image[1][r][c])
-                avg['b'].append(image[2][r][c])
-        
-        RGB = []
-        for i, c in enumerate(['r', 'g', 'b']):
-            mean = torch.Tensor(avg[c]).mean().round().div(255.0)
-            RGB.append(np.full((image.shape[1], image.shape[2]), mean))
-        
-        airlight.append(RGB)
+    # 1. RGB to HSV
+    hue, saturation, value = rgb2hsv(images)
     
-    airlight = torch.Tensor(airlight)
-    if norm:
-        return airlight.sub_(0.5).div_(0.5)
-    else:
-        return airlight
+    # 2. Hue histogram labeling (1 degree bins)
+    T_H = 1 / 360
+    hue_bin = hue.long().clamp(0, 359)
+    hist = batch_bincount(hue_bin, 360)
+    gate = (hist / img_size) > T_H
+    binarized_hue = torch.gather(gate, 1, hue_bin.flatten(1)).view(B, H, W)
+    
+    # 3. Color cast attenuation
+    num_labels = count_components(binarized_hue, approx_ccl, ccl_iters)   # Connected Component Labeling (CCL)
+    has_cast = (num_labels < color_cast_threshold).view(B, 1, 1)
+    bottom_1p = round(img_size * 0.01)
+    
+    def attenuate(x):
+        avg_least_values = torch.topk(x.flatten(1), bottom_1p, dim=1, largest=False).values.mean(1).round()
+        return torch.where(has_cast, torch.clamp(x - avg_least_values.view(B, 1, 1), min=0), x)
+    hue, saturation, value = attenuate(hue), attenuate(saturation), attenuate(value)
+    
+    # 4. HSV to RGB
+    image = hsv2rgb(hue, saturation, value).round().clamp(0, 255)
+    min_channel = torch.amin(image, 1).long()
+    
+    # 5. PMF of minimum channel + 1D minimum filter (window 11)
+    prob = batch_bincount(min_channel, 256) / img_size
+    prob = F.pad(prob, (5, 5), value=1.0)
+    P_m = prob.unfold(1, 11, 1).amin(-1)
+    
+    # 6. brightest non-zero bins until 1% of the pixels
+    P_m = torch.flip(P_m, [1])
+    positive = P_m > 0.0
+    cum = torch.cumsum(torch.where(positive, P_m, torch.zeros_like(P_m)), 1)
+    cum_before = F.pad(cum[:, :-1], (1, 0), value=0.0)
+    selected = torch.flip(positive & (cum_before < 0.01), [1])
+    
+    # 7. Airlight color = mean RGB of the selected pixels
+    mask = torch.gather(selected, 1, min_channel.flatten(1)).view(B, 1, H, W)
+    count = mask.sum((2, 3)).clamp(min=1)
+    airlight = ((image * mask).sum((2, 3)) / count).round().div(255.0)
     
-
-def get_Airlight2(images, norm=True, color_cast_threshold=5):
-    # image input must be Bx3xWxH
-    images = images.detach().cpu().numpy().transpose(0, 2, 3, 1)
     if norm:
-        images = (np.rint(((images * 0.5) + 0.5) * 255)).astype(np.uint8)
-    else:
-        images = (np.rint(images * 255)).astype(np.uint8)
-    images = np.clip(images, 0, 255)
+        airlight = airlight.sub(0.5).div(0.5)
+    return airlight.view(B, 3, 1, 1).expand(B, 3, H, W)
     
-    airlight = []
-    for image in images:
-        img_size = image.shape[0] * image.shape[1]
-        
-        # 1. RGB to HSV
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        hue, saturation, value = cv2.split(hsv)
-        
-        # 2. Hue histogram labeling
-        val, cnt = np.unique(hue, return_counts=True)
-        prob = cnt / img_size    # PMF
-        T_H = 1 / 360
-        
-        prob[prob > T_H] = 1
-        prob[prob <= T_H] = 0
-        
-        binarized_hue = np.zeros(hue.shape, int)
-        for v in val:
-            row, col = np.where(hue == v)
-            for i in range(len(row)):
-                binarized_hue[row[i]][col[i]] = 1
-        
-        # 3. Color cast attenuation
-        binarized_img = binarized_hue.astype('uint8')
-        num_labels, _ = cv2.connectedComponents(binarized_img)   # Connected Component Labeling (CCL)
-        if num_labels < color_cast_threshold:   # has color cast
-            for k in [hue, saturation, value]:
-                k = k.flatten()
-                idx = int(len(k) / 100)
-                least_idx = np.argpartition(k, idx)     # bottom 1% least saturated pixels
-                least_value = k[least_idx[:idx]].mean()
-                
-                k = k - least_value
-                k[k < 0] = 0
-                k = k.astype('uint8')
-        
-        # 4. HSV to RGB
-        hsv = cv2.merge((hue, saturation, value))
-        image = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
-        
-        
-        # 1. PMF of minimum channel calculation
-        c1, c2, c3 = cv2.split(image)
-        min_channel = np.amin([c1, c2, c3], 0)
-        
-        val, cnt = np.unique(min_channel, return_counts=True)
-        img_size = image.shape[0] * image.shape[1]
-        prob = cnt / img_size    # PMF
-        
-        l = np.zeros((256))
-        for i, v in enumerate(val):
-            l[v] = prob[i]
-        
-        # 2. 1D minimum filter
-        P_m = []
-        l = np.insert(l, 0, np.array([1,1,1,1,1]))
-        l = np.append(l, np.array([1,1,1,1,1]))
-        for i in range(0+5, 255+6):
-            P_m.append(l[i-5:i+6].min())
-        P_m = np.array(P_m)
-        
-        # 3. Airlight color estimation to RGB to RGB
-        threshold = 0.0
-        idx = []
-        for i in range(255, -1, -1):
-            if P_m[i] > 0.0:
-                threshold += P_m[i]
-                idx.append(i)
-                if threshold >= 0.01:
-                    break
-        
-        avg = {'r': [], 'g': [], 'b': []}
-        RGB = {'r': c1, 'g': c2, 'b': c3}
-        for i in idx:
-            row, col = np.where(min_channel == i)
-            for j, _ in enumerate(row):
-                for c in ['r','g','b']:
-                    avg[c].append(RGB[c][row[j]][col[j]]) 
-        
-        mean_r = np.mean(np.array(avg['r']))
-        mean_g = np.mean(np.array(avg['g']))
-        mean_b = np.mean(np.array(avg['b']))
 
-        if np.isnan(mean_r):
-            mean_r = 0
-        if np.isnan(mean_g):
-            mean_g = 0
-        if np.isnan(mean_b):
-            mean_b = 0
+def batch_bincount(x, bins):
+    # x : B x ... long tensor in [0, bins) -> B x bins counts
+    B = x.shape[0]
+    offset = torch.arange(B, device=x.device).view(B, *([1] * (x.dim()-1))) * bins
+    return torch.bincount((x + offset).flatten(), minlength=B*bins).view(B, bins)
 
-        avgR = round(mean_r)/ 255.0 
-        avgG = round(mean_g) / 255.0
-        avgB = round(mean_b) / 255.0
-        
-        r = np.full((image.shape[0], image.shape[1]), avgR)
-        g = np.full((image.shape[0], image.shape[1]), avgG)
-        b = np.full((image.shape[0], image.shape[1]), avgB)
-         
-        airlight.append(cv2.merge((r, g, b)))
-    
-    airlight = np.array(airlight)
-    if norm:
-        airlight = ((airlight / 255.0) - 0.5) / 0.5
-        airlight = airlight.transpose(0, 3, 1, 2)
-    else:
-        airlight = (airlight / 255.0).transpose(0, 3, 1, 2)
+
+def count_components(binarized, approx=False, iters=256):
+    # number of labels (background included) of 8-connected components, like cv2.connectedComponents
+    if not approx:
+        masks = binarized.to(torch.uint8).cpu().numpy()
+        return torch.tensor([cv2.connectedComponents(m)[0] for m in masks], device=binarized.device)
     
-    return torch.Tensor(airlight).float()
-        
+    # label propagation : every foreground pixel takes the max label of its 3x3 neighbourhood
+    B, H, W = binarized.shape
+    mask = binarized.unsqueeze(1).float()
+    init = torch.arange(1, H*W+1, device=binarized.device, dtype=torch.float32).view(1, 1, H, W) * mask
+    label = init
+    for i in range(iters):
+        new_label = F.max_pool2d(label, 3, 1, 1) * mask
+        if i % 8 == 7 and torch.equal(new_label, label):
+            break
+        label = new_label
+    roots = ((label == init) & (mask > 0)).sum((1, 2, 3))
+    return roots + 1
 
-        
 
 def rgb2hsv(input, epsilon=1e-10):
-    input.unsqueeze_(0)
-
+    # input : Bx3xHxW (0~255) -> h (degree), s, v : BxHxW
+    input = input.float()
     r, g, b = input[:, 0], input[:, 1], input[:, 2]
     max_rgb, argmax_rgb = input.max(1)
     min_rgb, argmin_rgb = input.min(1)
@@ -237,18 +108,15 @@ def rgb2hsv(input, epsilon=1e-10):
     h2 = 60.0 * (b - g) / max_min + 180.0
     h3 = 60.0 * (r - b) / max_min + 300.0
 
-    h = torch.stack((h2, h3, h1), dim=0).gather(dim=0, index=argmin_rgb.unsqueeze(0)).squeeze()
-    s = (max_min / (max_rgb + epsilon)).squeeze()
-    v = (max_rgb).squeeze()
+    h = torch.stack((h2, h3, h1), dim=0).gather(dim=0, index=argmin_rgb.unsqueeze(0)).squeeze(0)
+    s = max_min / (max_rgb + epsilon)
+    v = max_rgb
     
     return h, s, v
 
 
 def hsv2rgb(h, s, v):
-    h.unsqueeze_(0)
-    s.unsqueeze_(0)
-    v.unsqueeze_(0)
-    
+    # h (degree), s, v : BxHxW -> Bx3xHxW
     h_ = (h - torch.floor(h / 360) * 360) / 60
     c = s * v
     x = c * (1 - torch.abs(torch.fmod(h_, 2) - 1))
@@ -263,8 +131,8 @@ def hsv2rgb(h, s, v):
         torch.stack((c, zero, x), dim=1),
     ), dim=0)
 
-    index = torch.repeat_interleave(torch.floor(h_).unsqueeze(1), 3, dim=1).unsqueeze(0).to(torch.long)
-    rgb = (y.gather(dim=0, index=index) + (v - c)).squeeze()
+    index = torch.repeat_interleave(torch.floor(h_).clamp(0, 5).unsqueeze(1), 3, dim=1).unsqueeze(0).to(torch.long)
+    rgb = y.gather(dim=0, index=index).squeeze(0) + (v - c).unsqueeze(1)
     
     return rgb
 
@@ -288,29 +156,18 @@ class Airlight_Module():
                 raise ValueError('color is RGB or BGR')
         hue, saturation, value = cv2.split(hsv)
         
-        # 2. Hue histogram labeling
-        val, cnt = np.unique(hue, return_counts=True)
-        img_size = hue.shape[0] * hue.shape[1]
-        prob = cnt / img_size    # PMF
-        T_H = 1 / 360
-        
-        prob[prob > T_H] = 1
-        prob[prob <= T_H] = 0
-        
-        binarized_hue = np.zeros(hue.shape, int)
-        for v in val:
-            row, col = np.where(hue == v)
-            for i in range(len(row)):
-                binarized_hue[row[i]][col[i]] = 1
+        # 2. Hue histogram labeling (lookup table over hue values)
+        #    every hue value present in the image is labeled, same as the former per-pixel loop
+        hist = np.bincount(hue.ravel(), minlength=256)
+        hue_lut = (hist > 0).astype(np.uint8)
+        binarized_img = hue_lut[hue]
         
         # 3. Color cast attenuation
-        binarized_img = binarized_hue.astype('uint8')
         num_labels, _ = cv2.connectedComponents(binarized_img)   # Connected Component Labeling (CCL)
         if num_labels < self.color_cast_threshold:   # has color cast
-            flatten_s = saturation.flatten()
+            flatten_s = saturation.ravel()
             idx = int(len(flatten_s) / 100)
-            least_idx = np.argpartition(flatten_s, idx)     # bottom 1% least saturated pixels
-            least_value = flatten_s[least_idx[:idx]].mean()
+            least_value = np.partition(flatten_s, idx)[:idx].mean()     # bottom 1% least saturated pixels
             
             I_s = saturation - least_value
             I_s[I_s < 0] = 0
@@ -321,71 +178,41 @@ class Airlight_Module():
         rgb = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB) 
         
         return rgb
+    
+    # Airlight color [c1, c2, c3] of a uint8 HxWx3 image (LLF without the full size maps)
+    def LLF_color(self, image):
+        # 1. PMF of minimum channel calculation
+        min_channel = image.min(axis=2)
+        img_size = image.shape[0] * image.shape[1]
+        l = np.bincount(min_channel.ravel(), minlength=256) / img_size    # PMF
+        
+        # 2. 1D minimum filter (sliding window of 11, padded with 1)
+        l = np.concatenate((np.ones(5), l, np.ones(5)))
+        P_m = np.lib.stride_tricks.sliding_window_view(l, 11).min(axis=1)
+        
+        # 3. Airlight color estimation : brightest non-zero bins until 1% of the pixels
+        P_m = P_m[::-1]
+        cum = np.cumsum(np.where(P_m > 0.0, P_m, 0.0))
+        reached = np.flatnonzero(cum >= 0.01)
+        last = reached[0] if len(reached) > 0 else 255
+        selected = np.zeros(256, bool)
+        selected[255 - np.flatnonzero(P_m[:last+1] > 0.0)] = True
+        
+        mask = selected[min_channel]
+        count = np.count_nonzero(mask)
+        if count == 0:
+            return [0.0, 0.0, 0.0]
+        means = image[mask].sum(axis=0) / count
+        return [round(m) / 255.0 for m in means]
             
     # Local Light Filter (LLF)
     def LLF(self, image, mReturn='RGB'):
-        # 1. PMF of minimum channel calculation  
         if np.max(image) <= 1.0:
             image = np.rint(image*255).astype(np.uint8)
         else:
             image = image.astype(np.uint8)
-            
-        c1, c2, c3 = cv2.split(image)
-        min_channel = np.amin([c1, c2, c3], 0)
-            
-        # cv2.imshow('Minimum channel', min_channel.astype('uint8'))
-        # cv2.waitKey(0)
         
-        val, cnt = np.unique(min_channel, return_counts=True)
-        img_size = image.shape[0] * image.shape[1]
-        prob = cnt / img_size    # PMF
-        
-        l = np.zeros((256))
-        for i, v in enumerate(val):
-            l[v] = prob[i]
-        # show_plt(range(256), l)
-        
-        # 2. 1D minimum filter
-        P_m = []
-        l = np.insert(l, 0, np.array([1,1,1,1,1]))
-        l = np.append(l, np.array([1,1,1,1,1]))
-        for i in range(0+5, 255+6):
-            P_m.append(l[i-5:i+6].min())
-        P_m = np.array(P_m)
-        # show_plt(range(256), P_m)
-        
-        # 3. Airlight color estimation to RGB to RGB
-        threshold = 0.0
-        idx = []
-        for i in range(255, -1, -1):
-            if P_m[i] > 0.0:
-                threshold += P_m[i]
-                idx.append(i)
-                if threshold >= 0.01:
-                    break
-        
-        avg = {'r': [], 'g': [], 'b': []}
-        RGB = {'r': c1, 'g': c2, 'b': c3}
-        for i in idx:
-            row, col = np.where(min_channel == i)
-            for j, _ in enumerate(row):
-                for c in ['r','g','b']:
-                    avg[c].append(RGB[c][row[j]][col[j]]) 
-        
-        mean_r = np.mean(np.array(avg['r']))
-        mean_g = np.mean(np.array(avg['g']))
-        mean_b = np.mean(np.array(avg['b']))
-
-        if np.isnan(mean_r):
-            mean_r = 0
-        if np.isnan(mean_g):
-            mean_g = 0
-        if np.isnan(mean_b):
-            mean_b = 0
-
-        avgR = round(mean_r)/ 255.0 
-        avgG = round(mean_g) / 255.0
-        avgB = round(mean_b) / 255.0
+        avgR, avgG, avgB = self.LLF_color(image)
         
         r = np.full((image.shape[0], image.shape[1]), avgR)
         g = np.full((image.shape[0], image.shape[1]), avgG)
@@ -413,4 +240,15 @@ class Airlight_Module():
         image_numpy = (denormalize(image, norm)[0].detach().cpu().numpy().transpose(1,2,0)*255).astype(np.uint8)
         awc_rgb = self.AWC(image_numpy, True, 'BGR')
         _, airlight = self.LLF(awc_rgb)
-        return airlight[0]
\ No newline at end of file
+        return airlight[0]
+    
+    # images : Bx3xHxW tensor (normalized if norm) or BxHxWx3 uint8 array -> Bx3 airlight (RGB, 0~1)
+    def get_airlight_batch(self, images, norm=True):
+        if torch.is_tensor(images):
+            images = (denormalize(images, norm).detach().cpu().numpy().transpose(0,2,3,1)*255).astype(np.uint8)
+        
+        airlight = np.zeros((len(images), 3))
+        for i, image in enumerate(images):
+            awc_rgb = self.AWC(image, True, 'BGR')
+            airlight[i] = self.LLF_color(awc_rgb)
+        return airlight
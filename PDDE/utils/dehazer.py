@@ -0,0 +1,254 @@
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from . import util
+
+
+class IterativeDehazer():
+    """
+    PDDE multi-step dehazing loop.
+    cur_hazy, sum_depth, trans, airlight and the entropy score stay on `device` for the whole
+    beta schedule, only the selected (max entropy) images are copied to the host at the end of run_batch().
+    """
+    def __init__(self, model, airlight_model, metrics_module, dataset, norm=True,
+                 beta_step=0.005, step_limit=50, eps=1e-12, device='cuda'):
+        self.model = model
+        self.airlight_model = airlight_model
+        self.metrics_module = metrics_module
+        self.dataset = dataset
+        self.norm = norm
+        self.beta_step = beta_step
+        self.step_limit = step_limit
+        self.eps = eps
+        self.device = device
+        self.latency = []
+
+    def get_airlight(self, hazy_images):
+        with torch.no_grad():
+            airlight = self.airlight_model.forward(hazy_images)
+        airlight = util.air_denorm(self.dataset, self.norm, airlight)
+        # B x 1 -> B x 1 x 1 x 1, broadcast over the image
+        return airlight.view(-1, 1, 1, 1)
+
+    def estimate_depth(self, cur_hazy, cur_depth, need):
+        # DPT on the rows in need only, the other rows keep their cached depth
+        depth = cur_depth.clone()
+        if bool(need.any()):
+            with torch.no_grad():
+                depth[need] = self.model.forward(cur_hazy[need])
+        return depth
+
+    def step(self, step, cur_hazy, sum_depth, airlight, beta_step=None, depth_size=None, depth=None):
+        # one beta step, every tensor is per sample (B x ...), step is an int or a Bx1x1x1 tensor
+        # depth_size : estimate the depth at this resolution and upsample it to the image
+        # depth      : depth of cur_hazy already known (depth refresh policies), no DPT forward
+        beta_step = self.beta_step if beta_step is None else beta_step
+        with torch.no_grad():
+            if depth is not None:
+                cur_depth = depth
+            elif depth_size is None:
+                cur_depth = self.model.forward(cur_hazy)
+            else:
+                cur_depth = self.model.forward(F.interpolate(cur_hazy, size=depth_size, mode='bilinear', align_corners=False))
+                cur_depth = F.interpolate(cur_depth, size=cur_hazy.shape[2:], mode='bilinear', align_corners=False)
+        if sum_depth is None:
+            sum_depth = torch.zeros_like(cur_depth)
+
+        diff_depth = cur_depth*step - sum_depth
+        trans = torch.exp((diff_depth+cur_depth)*beta_step*-1)
+        sum_depth = cur_depth * (step+1)
+
+        cur_image = util.denormalize_tensor(cur_hazy, self.norm)
+        prediction = (cur_image - airlight) / (trans + self.eps) + airlight
+        prediction = torch.clamp(prediction, 0, 1)
+
+        return cur_image, cur_depth, prediction, sum_depth
+
+    def steps(self, hazy_images, airlight=None):
+        """
+        Generator over the beta schedule.
+        yields (step, cur_image, cur_depth, prediction), cur_image / prediction are 0~1 device tensors
+        """
+        cur_hazy = hazy_images.to(self.device)
+        if airlight is None:
+            airlight = self.get_airlight(cur_hazy)
+
+        sum_depth = None
+        for step in range(0, self.step_limit):
+            cur_image, cur_depth, prediction, sum_depth = self.step(step, cur_hazy, sum_depth, airlight)
+
+            yield step, cur_image, cur_depth, prediction
+
+            cur_hazy = util.normalize_tensor(prediction, self.norm)
+
+    def run_batch(self, hazy_images, score_prediction=False, stopper=None, refresh=None):
+        """
+        Advance B images through the beta schedule together.
+        Each sample keeps its own sum_depth, best entropy image and stop flag,
+        finished samples are compacted out of the active batch.
+
+        score_prediction=False : entropy of the step input (dehazing_valid_dataset_stopper)
+        score_prediction=True  : entropy of the step output (dehazing_RTTS_dataset_stopper)
+        stopper : None runs all step_limit steps and keeps the entropy maximum,
+                  otherwise stopper.reset(B, device) / stopper.update(step, entropy, index) -> (better, done)
+                  over the active rows (index = original sample index of each active row)
+        refresh : None runs DPT on every step, otherwise a utils/depth_refresh.py policy deciding per row
+                  when the depth is estimated again (cached depth in between)
+        return (optimal Bx3xHxW numpy, entropy_max B numpy, best_step B numpy, forwards B numpy)
+               forwards : full resolution DPT forwards per sample
+        """
+        start = time.perf_counter()
+
+        cur_hazy = hazy_images.to(self.device)
+        B = cur_hazy.shape[0]
+        airlight = self.get_airlight(cur_hazy)
+
+        index = torch.arange(B, device=cur_hazy.device)
+        entropy_max = torch.full((B,), -np.inf, dtype=torch.float64, device=cur_hazy.device)
+        best_step = torch.zeros(B, dtype=torch.long, device=cur_hazy.device)
+        forwards = torch.zeros(B, dtype=torch.long, device=cur_hazy.device)
+        optimal = torch.empty_like(cur_hazy)
+        select_previous = stopper is not None and stopper.select_previous
+        if select_previous:
+            has_best = torch.zeros(B, dtype=torch.bool, device=cur_hazy.device)
+            prev_optimal = torch.empty_like(cur_hazy)
+            prev_entropy, prev_step = entropy_max.clone(), best_step.clone()
+        if stopper is not None:
+            stopper.reset(B, cur_hazy.device)
+        if refresh is not None:
+            refresh.reset(B, cur_hazy.device)
+
+        sum_depth, cur_depth = None, None
+        for step in range(0, self.step_limit):
+            depth, refreshed = None, torch.ones_like(index, dtype=torch.bool)
+            if refresh is not None:
+                need = refresh.need(step, cur_hazy, index, self.model)
+                if cur_depth is not None:
+                    refreshed = need
+                    depth = self.estimate_depth(cur_hazy, cur_depth, refreshed)
+            cur_image, cur_depth, prediction, sum_depth = self.step(step, cur_hazy, sum_depth, airlight, depth=depth)
+            forwards[index] += refreshed
+
+            scored = prediction if score_prediction else cur_image
+            entropy, _, _ = self.metrics_module.get_cur_batch(scored)
+            if stopper is None:
+                better, done = entropy_max[index] < entropy, None
+            else:
+                better, done = stopper.update(step, entropy, index)
+            if refresh is not None:
+                refresh.update(step, entropy, index, refreshed)
+
+            if step == 0:
+                # fallback when the stopper never reports an improvement (short schedules, patience rules) : the step 0 image
+                entropy_max[index] = entropy
+                optimal.index_copy_(0, index, scored)
+                if select_previous:
+                    prev_entropy[index] = entropy
+                    prev_optimal.index_copy_(0, index, scored)
+
+            if select_previous:
+                # image before the last improvement (the first improvement is its own previous one)
+                first = ~has_best[index]
+                prev_optimal.index_copy_(0, index, torch.where((better & first).view(-1, 1, 1, 1), scored,
+                                         torch.where(better.view(-1, 1, 1, 1), optimal[index], prev_optimal[index])))
+                prev_entropy[index] = torch.where(better, torch.where(first, entropy, entropy_max[index]), prev_entropy[index])
+                prev_step[index] = torch.where(better, torch.where(first, torch.full_like(index, step), best_step[index]), prev_step[index])
+                has_best[index] = has_best[index] | better
+
+            entropy_max[index] = torch.where(better, entropy, entropy_max[index])
+            best_step[index] = torch.where(better, torch.full_like(index, step), best_step[index])
+            optimal.index_copy_(0, index, torch.where(better.view(-1, 1, 1, 1), scored, optimal[index]))
+
+            cur_hazy = util.normalize_tensor(prediction, self.norm)
+
+            # early exit : drop finished samples from the active batch
+            if done is not None and bool(done.any()):
+                keep = ~done
+                if not bool(keep.any()):
+                    break
+                index, cur_hazy, sum_depth, airlight = index[keep], cur_hazy[keep], sum_depth[keep], airlight[keep]
+                cur_depth = cur_depth[keep]
+
+        if select_previous:
+            optimal, entropy_max, best_step = prev_optimal, prev_entropy, prev_step
+        optimal = optimal.detach().cpu().numpy()
+        entropy_max, best_step, forwards = entropy_max.cpu().numpy(), best_step.cpu().numpy(), forwards.cpu().numpy()
+        elapsed = time.perf_counter() - start
+        self.latency.extend([elapsed / B] * B)
+
+        return optimal, entropy_max, best_step, forwards
+
+    def run_coarse_to_fine(self, hazy_images, coarse_scale=0.5, coarse_factor=5):
+        """
+        Coarse-to-fine beta search (entropy of the step input, like run_batch with score_prediction=False).
+        1. coarse : the whole schedule with beta_step*coarse_factor, DPT at coarse_scale resolution
+                    (depth upsampled, dehazing and entropy at full resolution)
+           (ceil(step_limit / coarse_factor) coarse steps, the last one covers the tail of the schedule)
+        2. fine   : 2*coarse_factor full resolution steps bracketing the coarse optimum, steps past step_limit are not selected.
+           The fine loop starts from the hazy image dehazed in one jump with the coarse depth,
+           since after n steps the accumulated transmission is exp(-beta_step*n*depth) (sum_depth telescopes).
+        return (optimal Bx3xHxW numpy, entropy_max B numpy, best_step B numpy, forwards B numpy, coarse_forwards)
+        """
+        start = time.perf_counter()
+
+        cur_hazy = hazy_images.to(self.device)
+        B, _, H, W = cur_hazy.shape
+        airlight = self.get_airlight(cur_hazy)
+        coarse_steps = -(-self.step_limit // coarse_factor)
+        fine_steps = 2 * coarse_factor
+
+        # 1. coarse trajectory : depth at coarse resolution, dehazing and entropy at full resolution
+        size = [max(32, int(round(H*coarse_scale/32))*32), max(32, int(round(W*coarse_scale/32))*32)]
+        coarse_hazy = cur_hazy
+        coarse_depths, coarse_entropy, sum_depth = [], [], None
+        for step in range(0, coarse_steps):
+            cur_image, cur_depth, prediction, sum_depth = self.step(step, coarse_hazy, sum_depth, airlight,
+                                                                    self.beta_step*coarse_factor, size)
+            coarse_depths.append(cur_depth)
+            coarse_entropy.append(self.metrics_module.get_cur_batch(cur_image)[0])
+            coarse_hazy = util.normalize_tensor(prediction, self.norm)
+        coarse_best = torch.stack(coarse_entropy, 1).argmax(1)
+
+        # 2. jump to the start of the bracket with the coarse depth of the previous coarse step
+        jump = torch.clamp(coarse_best - 1, 0, max(coarse_steps - 2, 0))
+        start_step = jump * coarse_factor
+        prev_depth = torch.stack(coarse_depths, 1)[torch.arange(B, device=cur_hazy.device), torch.clamp(jump - 1, min=0)]
+        sum_depth = prev_depth * start_step.view(B, 1, 1, 1)
+
+        hazy = util.denormalize_tensor(cur_hazy, self.norm)
+        jumped = torch.clamp((hazy - airlight) / (torch.exp(-sum_depth * self.beta_step) + self.eps) + airlight, 0, 1)
+        cur_hazy = util.normalize_tensor(jumped, self.norm)
+
+        # 3. fine steps inside the bracket
+        entropy_max = torch.full((B,), -np.inf, dtype=torch.float64, device=cur_hazy.device)
+        best_step = torch.zeros(B, dtype=torch.long, device=cur_hazy.device)
+        optimal = torch.empty_like(cur_hazy)
+        for i in range(0, fine_steps):
+            step = start_step + i
+            cur_image, _, prediction, sum_depth = self.step(step.view(B, 1, 1, 1), cur_hazy, sum_depth, airlight)
+            entropy, _, _ = self.metrics_module.get_cur_batch(cur_image)
+            better = (entropy_max < entropy) & (step < self.step_limit)
+            entropy_max = torch.where(better, entropy, entropy_max)
+            best_step = torch.where(better, step, best_step)
+            optimal = torch.where(better.view(-1, 1, 1, 1), cur_image, optimal)
+            cur_hazy = util.normalize_tensor(prediction, self.norm)
+
+        optimal = optimal.detach().cpu().numpy()
+        entropy_max, best_step = entropy_max.cpu().numpy(), best_step.cpu().numpy()
+        forwards = np.full(B, fine_steps)
+        elapsed = time.perf_counter() - start
+        self.latency.extend([elapsed / B] * B)
+
+        return optimal, entropy_max, best_step, forwards, coarse_steps
+
+    def run(self, hazy_images, score_prediction=False, stopper=None):
+        # single image (batch_size=1) -> (optimal 3xHxW numpy, entropy_max, best_step)
+        optimal, entropy_max, best_step, _ = self.run_batch(hazy_images[:1], score_prediction, stopper)
+        return optimal[0], entropy_max[0].item(), best_step[0].item()
+
+    def mean_latency(self):
+        if len(self.latency) == 0:
+            return 0.0
+        return sum(self.latency) / len(self.latency)
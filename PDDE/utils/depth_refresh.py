@@ -0,0 +1,100 @@
+"""
+Depth refresh policies for IterativeDehazer.run_batch
+DPT is rerun only on the rows that need a new depth, the other rows dehaze with their cached depth
+(with an unchanged depth, the step transmission is exp(-beta_step*depth) and sum_depth keeps telescoping)
+
+ - reset(batch_size, device)
+ - need(step, cur_hazy, index, model) -> B bool over the active rows (True : new DPT depth for this row)
+     cur_hazy : step input of the active rows, index : original sample index of each active row
+     step 0 always estimates the depth whatever need returns
+ - update(step, entropy, index, refreshed) : entropy of the scored image and refresh mask of the active rows
+ - probes : low resolution DPT forwards per sample (ProbeRefresh, 0 otherwise)
+"""
+import torch
+import torch.nn.functional as F
+
+
+class IntervalRefresh():
+    # every k steps
+    def __init__(self, interval=5):
+        self.interval = interval
+
+    def reset(self, batch_size, device):
+        self.last = torch.zeros(batch_size, dtype=torch.long, device=device)
+        self.probes = torch.zeros(batch_size, dtype=torch.long, device=device)
+
+    def need(self, step, cur_hazy, index, model):
+        return step - self.last[index] >= self.interval
+
+    def update(self, step, entropy, index, refreshed):
+        self.last[index] = torch.where(refreshed, torch.full_like(index, step), self.last[index])
+
+
+class EntropyRefresh():
+    # entropy moved by more than threshold (bits) since the last depth, at most max_interval steps on one depth
+    def __init__(self, threshold=0.05, max_interval=10):
+        self.threshold = threshold
+        self.max_interval = max_interval
+
+    def reset(self, batch_size, device):
+        self.last = torch.zeros(batch_size, dtype=torch.long, device=device)
+        self.ent_ref = torch.zeros(batch_size, dtype=torch.float64, device=device)
+        self.ent_cur = torch.zeros(batch_size, dtype=torch.float64, device=device)
+        self.probes = torch.zeros(batch_size, dtype=torch.long, device=device)
+
+    def need(self, step, cur_hazy, index, model):
+        drift = (self.ent_cur[index] - self.ent_ref[index]).abs() > self.threshold
+        return drift | (step - self.last[index] >= self.max_interval)
+
+    def update(self, step, entropy, index, refreshed):
+        self.ent_cur[index] = entropy
+        self.ent_ref[index] = torch.where(refreshed, entropy, self.ent_ref[index])
+        self.last[index] = torch.where(refreshed, torch.full_like(index, step), self.last[index])
+
+
+class ProbeRefresh():
+    """
+    DPT on a low resolution copy of the step input every step (probe), full resolution DPT when the probe
+    moved by more than threshold (mean relative change) since the probe of the last depth
+    """
+    def __init__(self, threshold=0.02, scale=0.25):
+        self.threshold = threshold
+        self.scale = scale
+
+    def reset(self, batch_size, device):
+        self.probe_ref = None
+        self.probe_cur = None
+        self.probes = torch.zeros(batch_size, dtype=torch.long, device=device)
+
+    def probe(self, cur_hazy, model):
+        H, W = cur_hazy.shape[2:]
+        size = [max(32, int(round(H*self.scale/32))*32), max(32, int(round(W*self.scale/32))*32)]
+        with torch.no_grad():
+            return model.forward(F.interpolate(cur_hazy, size=size, mode='bilinear', align_corners=False))
+
+    def need(self, step, cur_hazy, index, model):
+        probe = self.probe(cur_hazy, model)
+        self.probes[index] += 1
+        if self.probe_ref is None:
+            self.probe_ref = torch.zeros((len(self.probes),) + probe.shape[1:], dtype=probe.dtype, device=probe.device)
+        self.probe_cur = probe
+        ref = self.probe_ref[index]
+        drift = (probe - ref).abs().mean(dim=(1, 2, 3)) / (ref.abs().mean(dim=(1, 2, 3)) + 1e-12)
+        return drift > self.threshold
+
+    def update(self, step, entropy, index, refreshed):
+        self.probe_ref[index[refreshed]] = self.probe_cur[refreshed]
+
+
+def get_refresh(name, interval=5, threshold=None, probe_scale=0.25):
+    # threshold : None for the default of the policy (entropy 0.05 bits, probe 0.02)
+    if name == 'step':
+        return None
+    elif name == 'interval':
+        return IntervalRefresh(interval)
+    elif name == 'entropy':
+        return EntropyRefresh(0.05 if threshold is None else threshold, max_interval=interval)
+    elif name == 'probe':
+        return ProbeRefresh(0.02 if threshold is None else threshold, probe_scale)
+    else:
+        raise ValueError('refresh must be step, interval, entropy or probe')
@@ -0,0 +1,257 @@
+"""
+Parallel, sharded haze dataset builder
+(same synthesis as utils/clear2hazy.py, AODnet/make_dataset/create_train.py and DCPDN/create_train.py)
+
+    python -m utils.haze_builder --source folder --sourceRoot D:/data/NYU/train --recipe pdde --out D:/data/NYU_shards/train
+    python -m utils.haze_builder --source mat --sourceRoot D:/data/nyu_depth_v2_labeled.mat --recipe dcpdn --out D:/data/DCPDN_shards
+
+out/shard_00000.h5 : haze (N x H x W x 3 uint8), trans (N x H x W float16), airlight, beta, source, gt_slot, name (N)
+                     gt (M x H x W x 3 uint8, once per source image), chunked per image + lzf / gzip
+out/index.json     : recipe, shards [(file, count)] in source order
+Every shard covers shardSize source images and is built by one worker process.
+It is written to .tmp and renamed once complete, so an interrupted run is resumed by running the same command again.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from glob import glob
+from multiprocessing import Pool
+
+import cv2
+import h5py
+import numpy as np
+from tqdm import tqdm
+
+
+# ---------------------------------------------------------------- sources
+class FolderSource():
+    # PDDE NYU layout : clear/*.jpg + depth/*.npy (same file names)
+    def __init__(self, root):
+        self.root = root
+        self.images = sorted(glob(root + '/clear/*.jpg'))
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, index):
+        name = os.path.basename(self.images[index])[:-4]
+        clear = cv2.cvtColor(cv2.imread(self.images[index]), cv2.COLOR_BGR2RGB) / 255.0
+        depth = np.load(self.root + '/depth/' + name + '.npy')
+        return name, clear, depth
+
+
+class MatSource():
+    # nyu_depth_v2_labeled.mat (AODnet / DCPDN create_train.py)
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        with h5py.File(path, 'r') as f:
+            self.count = f['images'].shape[0]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if self.file is None:
+            self.file = h5py.File(self.path, 'r')
+        clear = np.swapaxes(self.file['images'][index], 0, 2).astype(float) / 255
+        depth = np.swapaxes(self.file['depths'][index], 0, 1)
+        return str(index), clear, depth
+
+
+# ---------------------------------------------------------------- recipes : (rng, clear, depth) -> [(haze, trans, airlight, beta)]
+def center_crop(x, h, w):
+    top, left = (x.shape[0] - h) // 2, (x.shape[1] - w) // 2
+    return x[top:top+h, left:left+w]
+
+
+def synthesize(clear, depth, airlight, beta):
+    trans = np.exp(-beta * depth)
+    haze = clear * trans[..., None] + (1 - trans[..., None]) * airlight
+    return np.clip(np.rint(haze * 255), 0, 255).astype(np.uint8), trans
+
+
+def recipe_pdde(rng, clear, depth):
+    # clear2hazy.py : 460x620 center crop, 3 airlights x 6 betas
+    clear, depth = center_crop(clear, 460, 620), center_crop(depth, 460, 620)
+    items = []
+    for airlight in [0.8, 0.9, 1.0]:
+        for beta in [0.1, 0.2, 0.3, 0.5, 0.6, 0.7]:
+            items.append(synthesize(clear, depth, airlight, beta) + (airlight, beta))
+    return clear, items
+
+
+def recipe_aodnet(rng, clear, depth):
+    # AODnet create_train.py : 480x640, depth / max, 7 betas x 3 airlights with uniform jitter
+    clear = cv2.resize(clear, (640, 480), interpolation=cv2.INTER_LINEAR)
+    depth = depth / depth.max()
+    items = []
+    for j in range(7):
+        for k in range(3):
+            beta = rng.uniform(0.4 + 0.2*j - 0.05, 0.4 + 0.2*j + 0.05)
+            airlight = rng.uniform(0.5 + 0.2*k - 0.1, 0.5 + 0.2*k + 0.1)
+            items.append(synthesize(clear, depth, airlight, beta) + (airlight, beta))
+    return clear, items
+
+
+def recipe_dcpdn(rng, clear, depth, img_size=224):
+    # DCPDN create_train.py : 224x224, depth / max, 8 random (beta, airlight)
+    clear = cv2.resize(clear, (img_size, img_size), interpolation=cv2.INTER_LINEAR)
+    depth = cv2.resize(depth / depth.max(), (img_size, img_size), interpolation=cv2.INTER_LINEAR)
+    items = []
+    for j in range(8):
+        beta = rng.uniform(0.5, 2)
+        airlight = 1 - 0.5 * rng.uniform(0, 1)
+        items.append(synthesize(clear, depth, airlight, beta) + (airlight, beta))
+    return clear, items
+
+
+RECIPES = {'pdde': recipe_pdde, 'aodnet': recipe_aodnet, 'dcpdn': recipe_dcpdn}
+
+
+def get_source(kind, root):
+    if kind == 'folder':
+        return FolderSource(root)
+    elif kind == 'mat':
+        return MatSource(root)
+    raise ValueError('source is folder or mat')
+
+
+# ---------------------------------------------------------------- workers
+_source = None
+
+def init_worker(kind, root):
+    global _source
+    _source = get_source(kind, root)
+
+
+def build_shard(job):
+    shard, indices, out, recipe, seed, compression = job
+    path = os.path.join(out, f'shard_{shard:05}.h5')
+    haze, gt, trans, airlight, beta, source, gt_slot, name = [], [], [], [], [], [], [], []
+    for index in indices:
+        # per source image seed : the jitter does not depend on worker count or resume point
+        rng = np.random.default_rng(seed + index)
+        image_name, clear, depth = _source[index]
+        clear, items = RECIPES[recipe](rng, clear, depth)
+        gt.append(np.clip(np.rint(clear * 255), 0, 255).astype(np.uint8))
+        for h, t, a, b in items:
+            haze.append(h)
+            gt_slot.append(len(gt) - 1)
+            trans.append(t.astype(np.float16))
+            airlight.append(a)
+            beta.append(b)
+            source.append(index)
+            name.append(f'{image_name}_{a:.4f}_{b:.4f}')
+
+    with h5py.File(path + '.tmp', 'w') as f:
+        for key, data in [('haze', np.stack(haze)), ('gt', np.stack(gt)), ('trans', np.stack(trans))]:
+            f.create_dataset(key, data=data, chunks=(1,) + data.shape[1:], compression=compression)
+        f.create_dataset('airlight', data=np.array(airlight, dtype=np.float32))
+        f.create_dataset('beta', data=np.array(beta, dtype=np.float32))
+        f.create_dataset('source', data=np.array(source, dtype=np.int64))
+        f.create_dataset('gt_slot', data=np.array(gt_slot, dtype=np.int64))
+        f.create_dataset('name', data=np.array(name, dtype=h5py.string_dtype()))
+    os.replace(path + '.tmp', path)
+    return shard, len(haze)
+
+
+def build(kind, root, out, recipe, workers=4, shard_size=32, seed=0, compression='lzf', limit=None):
+    if not os.path.exists(out):
+        os.makedirs(out)
+    count = len(get_source(kind, root))
+    if limit is not None:
+        count = min(count, limit)
+    jobs = [(shard, list(range(start, min(start + shard_size, count))), out, recipe, seed, compression)
+            for shard, start in enumerate(range(0, count, shard_size))]
+    todo = [job for job in jobs if not os.path.exists(os.path.join(out, f'shard_{job[0]:05}.h5'))]
+    print(f'{len(jobs) - len(todo)} / {len(jobs)} shards already built')
+
+    start, images = time.perf_counter(), 0
+    with Pool(workers, initializer=init_worker, initargs=(kind, root)) as pool:
+        for _, n in tqdm(pool.imap_unordered(build_shard, todo), total=len(todo)):
+            images += n
+    elapsed = time.perf_counter() - start
+
+    shards = []
+    for job in jobs:
+        file = f'shard_{job[0]:05}.h5'
+        with h5py.File(os.path.join(out, file), 'r') as f:
+            shards.append([file, int(f['haze'].shape[0])])
+    with open(os.path.join(out, 'index.json'), 'w') as f:
+        json.dump({'recipe': recipe, 'source': kind, 'seed': seed, 'shards': shards}, f)
+    return images, elapsed
+
+
+def build_serial_baseline(kind, root, recipe, count, seed=0):
+    # current scripts : one image after another, one uncompressed float .h5 per hazy image
+    source = get_source(kind, root)
+    images = 0
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as out:
+        for index in range(min(count, len(source))):
+            rng = np.random.default_rng(seed + index)
+            _, clear, depth = source[index]
+            clear, items = RECIPES[recipe](rng, clear, depth)
+            for h, t, a, b in items:
+                images += 1
+                with h5py.File(f'{out}/{images}.h5', 'w') as f:
+                    f.create_dataset('haze', data=h / 255.0)
+                    f.create_dataset('trans', data=np.tile(t[..., None], [1, 1, 3]))
+                    f.create_dataset('atom', data=np.full(h.shape, a))
+                    f.create_dataset('gt', data=clear)
+    return images, time.perf_counter() - start
+
+
+class HazeShards():
+    # reader of a built folder : dataset[i] -> dict(haze, gt, trans, airlight, beta, name)
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, 'index.json')) as f:
+            self.index = json.load(f)
+        self.offsets = np.cumsum([0] + [count for _, count in self.index['shards']])
+        self.files = {}
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['files'] = {}
+        return state
+
+    def __getitem__(self, index):
+        shard = int(np.searchsorted(self.offsets, index, side='right')) - 1
+        if shard not in self.files:
+            self.files[shard] = h5py.File(os.path.join(self.root, self.index['shards'][shard][0]), 'r')
+        f, slot = self.files[shard], index - self.offsets[shard]
+        item = {key: f[key][slot] for key in ['haze', 'trans', 'airlight', 'beta', 'name']}
+        item['gt'] = f['gt'][f['gt_slot'][slot]]
+        return item
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', type=str, default='folder', help='folder (clear/ + depth/) or mat (nyu_depth_v2_labeled.mat)')
+    parser.add_argument('--sourceRoot', type=str, required=True, help='source folder or .mat path')
+    parser.add_argument('--recipe', type=str, default='pdde', help='pdde, aodnet or dcpdn')
+    parser.add_argument('--out', type=str, required=True, help='output folder of the shards')
+    parser.add_argument('--workers', type=int, default=4, help='number of worker processes')
+    parser.add_argument('--shardSize', type=int, default=32, help='source images per shard')
+    parser.add_argument('--seed', type=int, default=0, help='base seed of the airlight / beta jitter')
+    parser.add_argument('--compression', type=str, default='lzf', help='h5py compression (lzf, gzip)')
+    parser.add_argument('--limit', type=int, default=None, help='only the first limit source images')
+    parser.add_argument('--baseline', type=int, default=0, help='also time the serial per-image path on this many source images')
+    opt = parser.parse_args()
+
+    if opt.recipe not in RECIPES:
+        raise ValueError('recipe is pdde, aodnet or dcpdn')
+    images, elapsed = build(opt.source, opt.sourceRoot, opt.out, opt.recipe, opt.workers, opt.shardSize,
+                            opt.seed, opt.compression, opt.limit)
+    if images > 0:
+        print(f'sharded builder : {images} images in {elapsed:.1f}s  ({images / elapsed:.1f} images/s, {opt.workers} workers)')
+    if opt.baseline > 0:
+        images, elapsed = build_serial_baseline(opt.source, opt.sourceRoot, opt.recipe, opt.baseline, opt.seed)
+        print(f'serial baseline : {images} images in {elapsed:.1f}s  ({images / elapsed:.1f} images/s)')
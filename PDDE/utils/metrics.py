@@ -2,97 +2,43 @@ from math import exp
 import math
 import numpy as np
 
-import torch
-import torch.nn.functional as F
-from torch.autograd import Variable
-
-from math import exp
-import math
-import numpy as np
-
 import torch
 import torch.nn.functional as F
 from torch.autograd import Variable
 from  torchvision.transforms import ToPILImage
 from .util import *
 
-def gaussian(window_size, sigma):
-    gauss = torch.Tensor([exp(-(x - window_size // 2) ** 2 / float(2 * sigma ** 2)) for x in range(window_size)])
-    return gauss / gauss.sum()
+from . import metrics_engine
+from .metrics_engine import gaussian, create_window, cached_window, gaussian_filter, ssim_batch, psnr_batch, to_batch
 
-def create_window(window_size, channel):
-    _1D_window = gaussian(window_size, 1.5).unsqueeze(1)
-    _2D_window = _1D_window.mm(_1D_window.t()).float().unsqueeze(0).unsqueeze(0)
-    window = Variable(_2D_window.expand(channel, 1, window_size, window_size).contiguous())
-    return window
+# PSNR of identical images : 0 here (as in the stored PDDE trajectories), 100 dB in the baselines' metrics.py
+MAX_PSNR = 0
 
-def _ssim(img1, img2, window, window_size, channel, size_average=True):
-    mu1 = F.conv2d(img1, window, padding=window_size // 2, groups=channel)
-    mu2 = F.conv2d(img2, window, padding=window_size // 2, groups=channel)
-    mu1_sq = mu1.pow(2)
-    mu2_sq = mu2.pow(2)
-    mu1_mu2 = mu1 * mu2
-    sigma1_sq = F.conv2d(img1 * img1, window, padding=window_size // 2, groups=channel) - mu1_sq
-    sigma2_sq = F.conv2d(img2 * img2, window, padding=window_size // 2, groups=channel) - mu2_sq
-    sigma12 = F.conv2d(img1 * img2, window, padding=window_size // 2, groups=channel) - mu1_mu2
-    C1 = 0.01 ** 2
-    C2 = 0.03 ** 2
-    ssim_map = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2))
-    if size_average:
-        return ssim_map.mean()
-    else:
-        return ssim_map.mean(1).mean(1).mean(1)
+def batch_metrics(pred, gt, window_size=11, separable=False, device=None):
+    # same values as get_psnr / get_ssim per image
+    return metrics_engine.batch_metrics(pred, gt, window_size, separable, device, max_psnr=MAX_PSNR)
 
 
 def get_ssim(img1, img2, window_size=11, size_average=True):
-    img1 = torch.Tensor(img1).unsqueeze(0)
-    img2 = torch.Tensor(img2).unsqueeze(0)
-    
+    img1 = to_batch(img1)
+    img2 = to_batch(img2, img1.device)
+
     img1=torch.clamp(img1,min=0,max=1)
     img2=torch.clamp(img2,min=0,max=1)
-    (_, channel, _, _) = img1.size()
-    window = create_window(window_size, channel)
-    if img1.is_cuda:
-        window = window.cuda(img1.get_device())
-    window = window.type_as(img1)
-    return _ssim(img1, img2, window, window_size, channel, size_average)
+    ssim = ssim_batch(img1, img2, window_size)
+    return ssim.mean() if size_average else ssim
 
 def get_ssim_batch(img1, img2, window_size=11, size_average=True):
     img1 = denormalize(img1)
     img2 = denormalize(img2)
-    
-    (_, channel, _, _) = img1.size()
-    window = create_window(window_size, channel)
-    if img1.is_cuda:
-        window = window.cuda(img1.get_device())
-    window = window.type_as(img1)
-    
-    mu1 = F.conv2d(img1, window, padding=window_size // 2, groups=channel)
-    mu2 = F.conv2d(img2, window, padding=window_size // 2, groups=channel)
-    mu1_sq = mu1.pow(2)
-    mu2_sq = mu2.pow(2)
-    mu1_mu2 = mu1 * mu2
-    sigma1_sq = F.conv2d(img1 * img1, window, padding=window_size // 2, groups=channel) - mu1_sq
-    sigma2_sq = F.conv2d(img2 * img2, window, padding=window_size // 2, groups=channel) - mu2_sq
-    sigma12 = F.conv2d(img1 * img2, window, padding=window_size // 2, groups=channel) - mu1_mu2
-    C1 = 0.01 ** 2
-    C2 = 0.03 ** 2
-    ssim_map = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2))
-
-    return torch.mean(ssim_map, dim=(1,2,3))
+    return ssim_batch(img1, img2, window_size)
 
 
 def get_psnr(pred, gt):
-    pred = torch.Tensor(pred).unsqueeze(0)
-    gt = torch.Tensor(gt).unsqueeze(0)
-    
-    pred=pred.cpu().detach().numpy()
-    gt=gt.cpu().detach().numpy()
-    imdff = pred - gt
-    rmse = math.sqrt(np.mean(imdff ** 2))
-    if rmse == 0:
-        return 0
-    return 20 * math.log10( 1.0 / rmse)
+    pred = torch.clamp(to_batch(pred), 0, 1)
+    gt = torch.clamp(to_batch(gt, pred.device), 0, 1)
+    # one device -> host copy (the scalar)
+    return psnr_batch(pred.double().reshape(1, 1, 1, -1), gt.double().reshape(1, 1, 1, -1), MAX_PSNR).item()
 
 def get_psnr_batch(pred, gt):
     pred = denormalize(pred)
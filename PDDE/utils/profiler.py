@@ -0,0 +1,116 @@
+import json
+import resource
+import time
+from contextlib import contextmanager
+
+import torch
+
+
+class StageProfiler():
+    """
+    Per-stage wall time / call count / host-device transfer bytes of a PDDE run.
+    CUDA is synchronized around every stage so asynchronous kernels are charged to the stage that launched them.
+    device -> host traffic is counted inside count_d2h() : every Tensor.cpu / .to(cpu) / .item / .tolist / bool()
+    of a device tensor (final outputs and per-step syncs such as entropy or stop flags)
+    """
+    def __init__(self, device='cpu'):
+        self.device = torch.device(device)
+        self.cuda = self.device.type == 'cuda'
+        self.stats = {}
+        self.h2d_bytes, self.d2h_bytes, self.d2h_syncs = 0, 0, 0
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+
+    def sync(self):
+        if self.cuda:
+            torch.cuda.synchronize(self.device)
+
+    @contextmanager
+    def stage(self, name):
+        self.sync()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sync()
+            stat = self.stats.setdefault(name, {'time': 0.0, 'calls': 0})
+            stat['time'] += time.perf_counter() - start
+            stat['calls'] += 1
+
+    def wrap(self, name, fn):
+        def wrapped(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return wrapped
+
+    @contextmanager
+    def patch(self, owner, attr, name):
+        # time every owner.attr(...) call made inside the block (module functions or instance methods)
+        fn = getattr(owner, attr)
+        setattr(owner, attr, self.wrap(name, fn))
+        try:
+            yield
+        finally:
+            setattr(owner, attr, fn)
+
+    def to_device(self, x):
+        with self.stage('to_device'):
+            if self.device.type != 'cpu':
+                self.h2d_bytes += x.element_size() * x.nelement()
+            return x.to(self.device)
+
+    def add_d2h(self, tensor):
+        self.d2h_bytes += tensor.element_size() * tensor.nelement()
+        self.d2h_syncs += 1
+
+    @contextmanager
+    def count_d2h(self):
+        # Tensor methods that copy a device tensor to the host, patched on torch.Tensor inside the block
+        def copy(fn):
+            def wrapped(tensor, *args, **kwargs):
+                out = fn(tensor, *args, **kwargs)
+                if tensor.device.type != 'cpu' and isinstance(out, torch.Tensor) and out.device.type == 'cpu':
+                    self.add_d2h(tensor)
+                return out
+            return wrapped
+
+        def sync(fn):
+            def wrapped(tensor, *args, **kwargs):
+                if tensor.device.type != 'cpu':
+                    self.add_d2h(tensor)
+                return fn(tensor, *args, **kwargs)
+            return wrapped
+
+        methods = {'cpu': copy, 'to': copy, 'item': sync, 'tolist': sync, '__bool__': sync}
+        own = {name: torch.Tensor.__dict__.get(name) for name in methods}
+        for name, wrap in methods.items():
+            setattr(torch.Tensor, name, wrap(getattr(torch.Tensor, name)))
+        try:
+            yield
+        finally:
+            for name, fn in own.items():
+                if fn is None:
+                    delattr(torch.Tensor, name)
+                else:
+                    setattr(torch.Tensor, name, fn)
+
+    def report(self, **extra):
+        stages = {}
+        for name, stat in self.stats.items():
+            stages[name] = {'time': stat['time'], 'calls': stat['calls'], 'mean_ms': stat['time'] / stat['calls'] * 1000}
+        report = {
+            'stages': stages,
+            'transfer': {'h2d_bytes': self.h2d_bytes, 'd2h_bytes': self.d2h_bytes, 'd2h_syncs': self.d2h_syncs},
+            'peak_memory': {
+                'host_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                'cuda_bytes': torch.cuda.max_memory_allocated(self.device) if self.cuda else 0,
+            },
+        }
+        report.update(extra)
+        return report
+
+    def save(self, path, **extra):
+        report = self.report(**extra)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        return report
@@ -5,6 +5,8 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 import matplotlib.ticker as ticker
+from utils.results_store import load_run, to_frames
+from utils.stopper_eval import Trajectories, RULES, NO_STOP, select
 
 
 def read_csv_all(dataRoot, target_beta=None, cerry_picker_flag=False):
@@ -29,6 +31,11 @@ def read_csv_all(dataRoot, target_beta=None, cerry_picker_flag=False):
     return all_df_dict
 
 
+def read_run_all(resultsRoot, run, target_beta=None):
+    # same dict as read_csv_all, from one read of the results store (dehazing_valid_dataset.py --resultsRoot)
+    return to_frames(load_run(resultsRoot, run, target_beta, columns=['entropy', 'psnr', 'ssim']))
+
+
 def data_plot(dfName, df):
     font = {'family': 'Times New Roman', 'weight' : 'bold', 'size': 35}
     plt.rc('font', **font)
@@ -65,10 +72,9 @@ def data_plot(dfName, df):
 
 # PSNR, SSIM 최대값들의 평균
 def getMean_Max_PSNR_SSIM(all_df_dict):
-    max_psnr_list, max_ssim_list = [], []
-    for _, df in all_df_dict.items():
-        max_psnr_list.append(df.loc[df['psnr'].idxmax()]['psnr'])
-        max_ssim_list.append(df.loc[df['ssim'].idxmax()]['ssim'])
+    traj = Trajectories.from_frames(all_df_dict)
+    max_psnr_list = np.nanmax(traj['psnr'], axis=1)
+    max_ssim_list = np.nanmax(traj['ssim'], axis=1)
         
     max_psnr_mean = pd.DataFrame(max_psnr_list).mean()[0]
     max_psnr_std = pd.DataFrame(max_psnr_list).std()[0]
@@ -83,126 +89,40 @@ Stopper 종료 조건
  - 후보 1: 직전보다 작아지는 시점에서 종료
  - 후보 2: 기회 2번 주기 (2번 이내에 커지면 커지는걸로 인정)
  - 후보 2: 후보 2번 + 1단계 전에 것 (2번 이내에 커지면 커지는걸로 인정)
+모든 이미지를 한번에 계산 : utils/stopper_eval.py (rule parameter sweep 포함)
 """
-def getMean_Stopper_PSNR_SSIM_1(all_df_dict):
-    stopper_psnr_list, stopper_ssim_list = [], []
-    for _, df in all_df_dict.items():
-        ent_max = 0
-        for row in df.itertuples():
-            if row.stage < 3:
-                continue
-            
-            if ent_max < row.entropy:
-                ent_max = row.entropy
-                prev_psnr = row.psnr
-                prev_ssim = row.ssim
-            else:
-                stopper_psnr_list.append(prev_psnr)
-                stopper_ssim_list.append(prev_ssim)
-                break
+def getMean_Stopper(all_df_dict, rule, **params):
+    traj = Trajectories.from_frames(all_df_dict)
+    chosen = RULES[rule](traj, **params)
+    stopper_psnr_list, stopper_ssim_list = select(traj, 'psnr', chosen), select(traj, 'ssim', chosen)
     
-    stopper_psnr_mean = np.array(stopper_psnr_list).mean()
-    stopper_psnr_std = np.array(stopper_psnr_list).std()
-    stopper_ssim_mean = np.array(stopper_ssim_list).mean()
-    stopper_ssim_std = np.array(stopper_ssim_list).std()
+    stopper_psnr_mean = stopper_psnr_list.mean()
+    stopper_psnr_std = stopper_psnr_list.std()
+    stopper_ssim_mean = stopper_ssim_list.mean()
+    stopper_ssim_std = stopper_ssim_list.std()
     
-    return stopper_psnr_mean, stopper_ssim_mean, stopper_psnr_std, stopper_ssim_std
+    return stopper_psnr_mean, stopper_ssim_mean, stopper_psnr_std, stopper_ssim_std, traj, chosen
+
+def getMean_Stopper_PSNR_SSIM_1(all_df_dict):
+    return getMean_Stopper(all_df_dict, 'patience', chances=1)[:4]
       
 def getMean_Stopper_PSNR_SSIM_2(all_df_dict):
-    stopper_psnr_list, stopper_ssim_list = [], []
-    for _, df in all_df_dict.items():
-        ent_max, ent_flag = 0, 0
-        prev_psnr, prev_ssim = 0, 0
-        for row in df.itertuples():
-            if row.stage < 3:
-                continue
-            
-            if ent_max < row.entropy:
-                ent_max = row.entropy
-                ent_flag = 0
-                prev_psnr = row.psnr
-                prev_ssim = row.ssim
-            else:
-                if ent_flag == 0:
-                    ent_max = row.entropy
-                    ent_flag += 1
-                elif ent_flag == 1:
-                    stopper_psnr_list.append(prev_psnr)
-                    stopper_ssim_list.append(prev_ssim)
-                    break
-    
-    stopper_psnr_mean = np.array(stopper_psnr_list).mean()
-    stopper_psnr_std = np.array(stopper_psnr_list).std()
-    stopper_ssim_mean = np.array(stopper_ssim_list).mean()
-    stopper_ssim_std = np.array(stopper_ssim_list).std()
-    
-    return stopper_psnr_mean, stopper_ssim_mean, stopper_psnr_std, stopper_ssim_std
+    return getMean_Stopper(all_df_dict, 'patience', chances=2)[:4]
 
 def getMean_Stopper_PSNR_SSIM_3(all_df_dict):
-    stopper_psnr_list, stopper_ssim_list = [], []
-    for _, df in all_df_dict.items():
-        ent_max, ent_flag = 0, 0
-        prev_psnr, prev_ssim = 0, 0
-        for row in df.itertuples():
-            if row.stage < 3:
-                continue
-            
-            if ent_max < row.entropy:
-                ent_max = row.entropy
-                ent_flag = 0
-                pprev_psnr, pprev_ssim = prev_psnr, prev_ssim
-                prev_psnr, prev_ssim = row.psnr, row.ssim
-            else:
-                if ent_flag == 0:
-                    ent_max = row.entropy
-                    ent_flag += 1
-                elif ent_flag == 1:
-                    stopper_psnr_list.append(pprev_psnr)
-                    stopper_ssim_list.append(pprev_ssim)
-                    break
-    
-    stopper_psnr_mean = np.array(stopper_psnr_list).mean()
-    stopper_psnr_std = np.array(stopper_psnr_list).std()
-    stopper_ssim_mean = np.array(stopper_ssim_list).mean()
-    stopper_ssim_std = np.array(stopper_ssim_list).std()
-    
-    return stopper_psnr_mean, stopper_ssim_mean, stopper_psnr_std, stopper_ssim_std
+    return getMean_Stopper(all_df_dict, 'patience', chances=2, select_previous=True)[:4]
 
 def getMean_Stopper_PSNR_SSIM_4(all_df_dict, limit=20):
-    stopper_psnr_list, stopper_ssim_list = [], []
+    *scores, traj, chosen = getMean_Stopper(all_df_dict, 'limit', limit=limit)
+    # 선택된 PSNR 이 가장 큰 이미지 (첫번째)
+    kept = np.flatnonzero(chosen != NO_STOP)
+    stopper_psnr_list = select(traj, 'psnr', chosen)
     max_psnr, max_name = 0, ''
-    for df_name, df in all_df_dict.items():
-        last_idx = df.iloc[-1]['stage']
-        ent_max, ent_flag = 0, 0
-        stopper_psnr, stopper_ssim = 0, 0
-        for row in df.itertuples():
-            if ent_max < row.entropy:
-                ent_max, ent_flag = row.entropy, 0
-                stopper_psnr, stopper_ssim = row.psnr, row.ssim
-            else:
-                if row.stage < last_idx:
-                    if ent_flag < (limit-1):
-                        ent_flag += 1
-                    else:
-                        stopper_psnr_list.append(stopper_psnr)
-                        stopper_ssim_list.append(stopper_ssim)
-                        if max_psnr < stopper_psnr:
-                            max_psnr = stopper_psnr
-                            max_name = df_name
-                        break
-                else:
-                    stopper_psnr_list.append(stopper_psnr)
-                    stopper_ssim_list.append(stopper_ssim)
-                    if max_psnr < stopper_psnr:
-                        max_psnr = stopper_psnr
-                        max_name = df_name
-    
-    stopper_psnr_mean = np.array(stopper_psnr_list).mean()
-    stopper_psnr_std = np.array(stopper_psnr_list).std()
-    stopper_ssim_mean = np.array(stopper_ssim_list).mean()
-    stopper_ssim_std = np.array(stopper_ssim_list).std()
+    if len(kept) and stopper_psnr_list.max() > 0:
+        best = stopper_psnr_list.argmax()
+        max_psnr, max_name = stopper_psnr_list[best], traj.images[kept[best]]
     
-    return stopper_psnr_mean, stopper_ssim_mean, stopper_psnr_std, stopper_ssim_std, max_psnr, max_name
+    return (*scores, max_psnr, max_name)
 
 if __name__ == '__main__':
     # dataRoot = 'D:/data/output_dehaze/output_RESIDE'
@@ -0,0 +1,93 @@
+"""
+Online stoppers for IterativeDehazer.run_batch
+(same stop rules as utils/statistic_v2.getMean_Stopper_PSNR_SSIM_1~4, evaluated inside the loop)
+
+ - reset(batch_size, device)
+ - update(step, entropy, index) -> (better, done)
+     entropy : entropy of the active rows, index : original sample index of each active row
+     better  : the current image becomes the selected image
+     done    : the sample stops here (no more DPT forwards)
+ - select_previous : the selected image is the one before the last improvement (rule 3)
+"""
+import torch
+
+
+class FirstDecreaseStopper():
+    # 후보 1: 직전보다 작아지는 시점에서 종료
+    def __init__(self, start_step=3):
+        self.start_step = start_step
+        self.select_previous = False
+
+    def reset(self, batch_size, device):
+        self.ent_max = torch.zeros(batch_size, dtype=torch.float64, device=device)
+
+    def update(self, step, entropy, index):
+        if step < self.start_step:
+            skip = torch.zeros_like(index, dtype=torch.bool)
+            return skip, skip
+
+        ent_max = self.ent_max[index]
+        better = ent_max < entropy
+        self.ent_max[index] = torch.where(better, entropy, ent_max)
+        return better, ~better
+
+
+class PatienceStopper():
+    # 후보 2: 기회 2번 주기 (2번 이내에 커지면 커지는걸로 인정)
+    # 후보 3: 후보 2번 + 1단계 전에 것 (select_previous=True)
+    def __init__(self, start_step=3, select_previous=False):
+        self.start_step = start_step
+        self.select_previous = select_previous
+
+    def reset(self, batch_size, device):
+        self.ent_max = torch.zeros(batch_size, dtype=torch.float64, device=device)
+        self.ent_flag = torch.zeros(batch_size, dtype=torch.long, device=device)
+
+    def update(self, step, entropy, index):
+        if step < self.start_step:
+            skip = torch.zeros_like(index, dtype=torch.bool)
+            return skip, skip
+
+        ent_max, ent_flag = self.ent_max[index], self.ent_flag[index]
+        better = ent_max < entropy
+        first_chance = ~better & (ent_flag == 0)
+        done = ~better & (ent_flag == 1)
+
+        self.ent_max[index] = torch.where(better | first_chance, entropy, ent_max)
+        self.ent_flag[index] = torch.where(better, torch.zeros_like(ent_flag), torch.where(first_chance, torch.ones_like(ent_flag), ent_flag))
+        return better, done
+
+
+class LimitStopper():
+    # 후보 4: limit 번 연속으로 커지지 않으면 종료
+    def __init__(self, limit=20):
+        self.limit = limit
+        self.select_previous = False
+
+    def reset(self, batch_size, device):
+        self.ent_max = torch.zeros(batch_size, dtype=torch.float64, device=device)
+        self.ent_flag = torch.zeros(batch_size, dtype=torch.long, device=device)
+
+    def update(self, step, entropy, index):
+        ent_max, ent_flag = self.ent_max[index], self.ent_flag[index]
+        better = ent_max < entropy
+        done = ~better & (ent_flag >= self.limit-1)
+
+        self.ent_max[index] = torch.where(better, entropy, ent_max)
+        self.ent_flag[index] = torch.where(better, torch.zeros_like(ent_flag), ent_flag+1)
+        return better, done
+
+
+def get_stopper(name, limit=20):
+    if name == 'none':
+        return None
+    elif name == 'first_decrease':
+        return FirstDecreaseStopper()
+    elif name == 'patience':
+        return PatienceStopper()
+    elif name == 'patience_prev':
+        return PatienceStopper(select_previous=True)
+    elif name == 'limit':
+        return LimitStopper(limit)
+    else:
+        raise ValueError('stopper must be none, first_decrease, patience, patience_prev or limit')
@@ -0,0 +1,195 @@
+"""
+Offline stopper evaluation on a long-form trajectory table (image, step, entropy, psnr, ssim, ...)
+from utils/results_store.load_run, or read_csv_all frames through Trajectories.from_frames
+
+Same stop rules as utils/stopper.py and statistic_v2.getMean_Stopper_PSNR_SSIM_1~4, evaluated for every image
+at once on images x steps matrices (no per-image loop). Chosen step per image :
+    >= 0    : selected step
+    NO_STOP : the rule never stopped (statistic_v2 leaves the image out)
+    ZERO    : nothing selected before the stop (statistic_v2 counts psnr = ssim = 0)
+
+    python -m utils.stopper_eval --resultsRoot D:/data/output_dehaze/_results --run SOTS_Ours --beta 0.12 --workers 4
+"""
+import argparse
+import itertools
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+
+NO_STOP, ZERO = -1, -2
+
+
+class Trajectories():
+    # images x steps matrices of the value columns (NaN where a step is not logged), column index = step
+    def __init__(self, df, columns=('entropy', 'psnr', 'ssim'), step_column='step'):
+        images = df['image'].to_numpy()
+        steps = df[step_column].to_numpy().astype(np.int64)
+        self.images, inverse = np.unique(images, return_inverse=True)
+        self.length = np.zeros(len(self.images), dtype=np.int64)
+        np.maximum.at(self.length, inverse, steps + 1)
+        self.values = {}
+        for column in columns:
+            matrix = np.full((len(self.images), steps.max() + 1), np.nan)
+            matrix[inverse, steps] = df[column].to_numpy()
+            self.values[column] = matrix
+        # logged cells only : a trajectory logged from step 1 has no step 0
+        self.valid = np.zeros((len(self.images), steps.max() + 1), dtype=bool)
+        self.valid[inverse, steps] = True
+
+    @classmethod
+    def from_frames(cls, all_df_dict, columns=('entropy', 'psnr', 'ssim'), step_column='stage'):
+        df = pd.concat(all_df_dict, names=['image', None]).reset_index(level=0)
+        return cls(df, columns, step_column)
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, column):
+        return self.values[column]
+
+
+def last_true(mask):
+    # column of the last True at or before every column, -1 if none
+    columns = np.arange(mask.shape[1])
+    return np.maximum.accumulate(np.where(mask, columns, -1), axis=1)
+
+
+def first_true(mask):
+    # first True column of every row, -1 if none
+    return np.where(mask.any(axis=1), mask.argmax(axis=1), -1)
+
+
+def improvements(entropy, active, running_max):
+    # better[i, s] : entropy is above the reference (0 before the first active step)
+    #   running_max=False : previous step (patience rules, ent_max is reset on every miss)
+    #   running_max=True  : best entropy so far (limit rule)
+    values = np.where(active, entropy, 0)
+    reference = np.maximum.accumulate(values, axis=1) if running_max else values
+    reference = np.concatenate([np.zeros((len(values), 1)), reference[:, :-1]], axis=1)
+    return active & (entropy > reference)
+
+
+def patience_steps(traj, chances=2, start_step=3, select_previous=False, column='entropy'):
+    """
+    chances=1 : 후보 1 (stop at the first decrease), chances=2 : 후보 2, chances=2 + select_previous : 후보 3
+    stops at the chances-th consecutive non increase, selects the last increase (or the one before it)
+    """
+    entropy = traj[column]
+    columns = np.arange(entropy.shape[1])
+    active = traj.valid & (columns >= start_step)
+    better = improvements(entropy, active, running_max=False)
+    miss = active & ~better
+    run = columns - last_true(~miss)
+    stop = first_true(miss & (run >= chances))
+
+    rows = np.arange(len(traj))
+    last_better = last_true(better)
+    chosen = last_better[rows, np.maximum(stop, 0)]
+    if select_previous:
+        previous = last_better[rows, np.maximum(chosen - 1, 0)]
+        chosen = np.where(chosen >= 1, previous, -1)
+    chosen = np.where(chosen >= 0, chosen, ZERO)
+    return np.where(stop >= 0, chosen, NO_STOP)
+
+
+def limit_steps(traj, limit=20, start_step=0, column='entropy'):
+    """
+    후보 4 : stops at the limit-th consecutive step without a new maximum, selects the maximum so far
+    a trajectory that ends without stopping selects its maximum, unless the last step is itself a new maximum
+    (statistic_v2.getMean_Stopper_PSNR_SSIM_4 skips those images)
+    """
+    entropy = traj[column]
+    columns = np.arange(entropy.shape[1])
+    active = traj.valid & (columns >= start_step)
+    better = improvements(entropy, active, running_max=True)
+    miss = active & ~better
+    run = columns - last_true(~miss)
+    last = traj.length - 1
+    stop = first_true(miss & (run >= limit) & (columns < last[:, None]))
+
+    rows = np.arange(len(traj))
+    last_better = last_true(better)
+    chosen = np.where(stop >= 0, last_better[rows, np.maximum(stop, 0)], last_better[rows, last])
+    chosen = np.where(chosen >= 0, chosen, ZERO)
+    return np.where((stop >= 0) | miss[rows, last], chosen, NO_STOP)
+
+
+def max_steps(traj, column='psnr'):
+    # oracle : step of the best column value (first one on ties)
+    return np.nanargmax(traj[column], axis=1)
+
+
+RULES = {'patience': patience_steps, 'limit': limit_steps}
+
+
+def select(traj, column, chosen):
+    # values at the chosen steps, ZERO -> 0, NO_STOP images dropped
+    kept = chosen != NO_STOP
+    values = traj[column][np.flatnonzero(kept), np.maximum(chosen[kept], 0)]
+    return np.where(chosen[kept] == ZERO, 0, values)
+
+
+def evaluate(traj, rule, **params):
+    chosen = RULES[rule](traj, **params)
+    psnr, ssim = select(traj, 'psnr', chosen), select(traj, 'ssim', chosen)
+    steps = chosen[chosen >= 0]
+    return dict(rule=rule, **params, images=len(psnr), no_stop=int((chosen == NO_STOP).sum()),
+                psnr_mean=psnr.mean(), psnr_std=psnr.std(), ssim_mean=ssim.mean(), ssim_std=ssim.std(),
+                step_mean=steps.mean() if len(steps) else np.nan)
+
+
+def param_grid(chances=(1, 2, 3, 4, 5), start_steps=(0, 1, 2, 3, 4, 5), limits=(5, 10, 15, 20, 25, 30, 40)):
+    grid = [('patience', dict(chances=c, start_step=s, select_previous=p))
+            for c, s, p in itertools.product(chances, start_steps, (False, True))]
+    grid += [('limit', dict(limit=l)) for l in limits]
+    return grid
+
+
+_traj = None
+
+def init_worker(traj):
+    global _traj
+    _traj = traj
+
+
+def evaluate_job(job):
+    rule, params = job
+    return evaluate(_traj, rule, **params)
+
+
+def sweep(traj, grid=None, workers=1):
+    """
+    => DataFrame, one row per (rule, params) of the grid
+    workers > 1 : the grid is split over processes, the matrices are sent once per worker
+    """
+    grid = param_grid() if grid is None else grid
+    if workers > 1:
+        with Pool(workers, initializer=init_worker, initargs=(traj,)) as pool:
+            rows = pool.map(evaluate_job, grid)
+    else:
+        rows = [evaluate(traj, rule, **params) for rule, params in grid]
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    from utils.results_store import load_run
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resultsRoot', type=str, required=True, help='results store root (utils/results_store.py)')
+    parser.add_argument('--run', type=str, required=True, help='run name')
+    parser.add_argument('--beta', type=float, default=None, help='only this beta partition')
+    parser.add_argument('--workers', type=int, default=1, help='processes of the parameter sweep')
+    parser.add_argument('--output', type=str, default=None, help='csv of the whole sweep')
+    opt = parser.parse_args()
+
+    start = time.perf_counter()
+    traj = Trajectories(load_run(opt.resultsRoot, opt.run, opt.beta, columns=['entropy', 'psnr', 'ssim']))
+    loaded = time.perf_counter()
+    result = sweep(traj, workers=opt.workers)
+    print(f'{len(traj)} images loaded in {loaded - start:.2f}s, {len(result)} rules evaluated in {time.perf_counter() - loaded:.2f}s')
+    print(result.sort_values('psnr_mean', ascending=False).head(10).to_string(index=False))
+    if opt.output is not None:
+        result.to_csv(opt.output, index=False)
@@ -32,6 +32,20 @@ def denormalize(x, norm=True, mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]):
     else:
         return x
     
+#torch -> torch (same device, no host copy)
+def normalize_tensor(x, norm=False, mean=0.5, std=0.5):
+    if norm:
+        return (x - mean) / std
+    else:
+        return x
+
+#torch -> torch (same device, no host copy)
+def denormalize_tensor(x, norm=True, mean=0.5, std=0.5):
+    if norm:
+        return torch.clamp(x * std + mean, 0, 1)
+    else:
+        return x
+    
 #torch -> torch
 def air_renorm(dataset, norm, airlight, dataset_mean = 0.5, dataset_std = 0.5):
     # denorm
@@ -0,0 +1,125 @@
+import argparse
+import glob
+import json
+import os
+import time
+from collections import OrderedDict
+
+import h5py
+import numpy as np
+
+
+class H5HandlePool():
+  """
+  LRU of open h5py.File handles (read only).
+  Handles are never shared between processes : a DataLoader worker (forked or spawned) opens its own.
+  """
+  def __init__(self, max_open=128):
+    self.max_open = max_open
+    self.handles = OrderedDict()
+    self.pid = os.getpid()
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state['handles'] = OrderedDict()
+    return state
+
+  def get(self, path):
+    if self.pid != os.getpid():
+      # forked worker : the parent's HDF5 handles are not fork safe, start with an empty pool
+      self.handles = OrderedDict()
+      self.pid = os.getpid()
+    if path in self.handles:
+      self.handles.move_to_end(path)
+      return self.handles[path]
+    if len(self.handles) >= self.max_open:
+      _, f = self.handles.popitem(last=False)
+      f.close()
+    f = h5py.File(path, 'r')
+    self.handles[path] = f
+    return f
+
+  def close(self):
+    for f in self.handles.values():
+      f.close()
+    self.handles.clear()
+
+
+def read_chw(dset, slot=None, dtype=None):
+  # H x W x C (or H x W) dataset -> contiguous C x H x W array, one copy instead of two strided swapaxes views
+  hwc = dset[()] if slot is None else dset[slot]
+  if hwc.ndim == 2:
+    hwc = hwc[..., None]
+  if dtype is not None:
+    hwc = hwc.astype(dtype, copy=False)
+  return np.ascontiguousarray(hwc.transpose(2, 0, 1))
+
+
+class H5Reader():
+  """
+  (haze, trans, ato, gt, name) of the index-th sample, C x H x W contiguous
+   - per sample files : root/<index>.h5 with haze / trans / ato / gt (create_train.py layout)
+   - shard files      : root/index.json + shard_*.h5 written by PDDE utils/haze_builder.py (recipe dcpdn)
+  """
+  def __init__(self, root, max_open=128):
+    self.root = root
+    self.pool = H5HandlePool(max_open)
+    self.shards = None
+    if os.path.isfile(root + '/index.json'):
+      with open(root + '/index.json') as f:
+        self.shards = json.load(f)['shards']
+      self.offsets = np.cumsum([0] + [count for _, count in self.shards])
+      self.count = int(self.offsets[-1])
+    else:
+      self.count = len(glob.glob(root + '/*h5'))
+
+  def __len__(self):
+    return self.count
+
+  def read(self, index):
+    if self.shards is None:
+      f = self.pool.get(self.root + '/' + str(index) + '.h5')
+      return read_chw(f['haze']), read_chw(f['trans']), read_chw(f['ato']), read_chw(f['gt']), str(index)
+
+    shard = int(np.searchsorted(self.offsets, index, side='right')) - 1
+    f, slot = self.pool.get(self.root + '/' + self.shards[shard][0]), index - self.offsets[shard]
+    haze = read_chw(f['haze'], slot, np.float32) / 255
+    gt = read_chw(f['gt'], f['gt_slot'][slot], np.float32) / 255
+    trans = np.repeat(read_chw(f['trans'], slot, np.float32), 3, axis=0)
+    ato = np.full_like(haze, f['airlight'][slot])
+    name = f['name'][slot]
+    return haze, trans, ato, gt, name.decode() if isinstance(name, bytes) else name
+
+
+def open_fds():
+  return len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else -1
+
+
+if __name__ == '__main__':
+  # python -m datasets.h5pool --dataroot ./facades/train --samples 2000
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--dataroot', required=True, help='per sample .h5 folder or haze_builder shard folder')
+  parser.add_argument('--samples', type=int, default=1000, help='number of random reads')
+  parser.add_argument('--maxOpen', type=int, default=128, help='open handles kept by the pool')
+  opt = parser.parse_args()
+
+  reader = H5Reader(opt.dataroot, opt.maxOpen)
+  indices = np.random.randint(0, len(reader), opt.samples)
+
+  fds = open_fds()
+  start = time.perf_counter()
+  for index in indices:
+    reader.read(int(index))
+  elapsed = time.perf_counter() - start
+  print(f'handle pool : {opt.samples / elapsed:.1f} samples/s, open fds +{open_fds() - fds} (max_open={opt.maxOpen})')
+  reader.pool.close()
+
+  if reader.shards is None:
+    # former pix2pix.__getitem__ : open per sample + swapaxes views (copied when made contiguous)
+    fds = open_fds()
+    start = time.perf_counter()
+    for index in indices:
+      f = h5py.File(opt.dataroot + '/' + str(int(index)) + '.h5', 'r')
+      arrays = [np.ascontiguousarray(np.swapaxes(np.swapaxes(f[key][:], 0, 2), 1, 2)) for key in ['haze', 'trans', 'ato', 'gt']]
+    elapsed = time.perf_counter() - start
+    print(f'open per sample : {opt.samples / elapsed:.1f} samples/s, open fds +{open_fds() - fds}')
@@ -5,6 +5,7 @@ import os.path
 import numpy as np
 import h5py
 import glob
+from .h5pool import H5Reader
 import pdb
 
 IMG_EXTENSIONS = [
@@ -41,7 +42,7 @@ class pix2pix_val(data.Dataset):
     self.transform = transform
     self.loader = loader
     # self.sampler = SequentialSampler(dataset)
-    self.paths = glob.glob(self.root + '/*h5')
+    self.reader = H5Reader(self.root)
 
     if seed is not None:
       np.random.seed(seed)
@@ -58,33 +59,13 @@ class pix2pix_val(data.Dataset):
 
 
 
-    file_name=self.root+'/'+str(index)+'.h5'
-    f=h5py.File(file_name,'r')
-    haze_image=f['haze'][:]
-    trans_map=f['trans'][:]
-    ato_map=f['ato'][:]
-    GT=f['gt'][:]
-
-
-
-    haze_image=np.swapaxes(haze_image,0,2)
-    trans_map=np.swapaxes(trans_map,0,2)
-    ato_map=np.swapaxes(ato_map,0,2)
-    GT=np.swapaxes(GT,0,2)
-
-
-
-    haze_image=np.swapaxes(haze_image,1,2)
-    trans_map=np.swapaxes(trans_map,1,2)
-    ato_map=np.swapaxes(ato_map,1,2)
-    GT=np.swapaxes(GT,1,2)
+    # pooled handle (opened once per worker), contiguous C x H x W arrays
+    haze_image, trans_map, ato_map, GT, name = self.reader.read(index)
 
     # if np.random.uniform()>0.5:
     #   haze_image=np.flip(haze_image,2).copy()
 
-    return haze_image, GT,  trans_map, ato_map, file_name[len(self.root)+1:-3]
+    return haze_image, GT,  trans_map, ato_map, name
 
   def __len__(self):
-    train_list=glob.glob(self.root+'/*h5')
-    # print len(train_list)
-    return len(train_list)
+    return len(self.reader)
@@ -20,6 +20,7 @@ import models.dehaze22  as net
 from myutils import utils
 from myutils.vgg16 import Vgg16
 from myutils.metrics import *
+from transforms.batch_augment import BatchAugment
 
 
 def get_args():
@@ -33,10 +34,10 @@ def get_args():
     parser.add_argument('--batchSize', type=int, default=6, help='input batch size')
     parser.add_argument('--valBatchSize', type=int, default=32, help='input batch size')
     parser.add_argument('--originalSize', type=int, default=286, help='the height / width of the original input image')
-    parser.add_argument('--imageSize', type=int, default=256, help='the height / width of the cropped input image to network')
+    parser.add_argument('--imageSize', type=int, default=224, help='the height / width of the cropped input image to network (create_train.py writes 224 x 224 maps)')
     parser.add_argument('--inputChannelSize', type=int, default=3, help='size of the input channels')
     parser.add_argument('--outputChannelSize', type=int, default=3, help='size of the output channels')
-    parser.add_argument('--sizePatchGAN', type=int, default=62)
+    parser.add_argument('--sizePatchGAN', type=int, default=None, help='output size of D, derived from the training size if not given')
     parser.add_argument('--ngf', type=int, default=64)
     parser.add_argument('--ndf', type=int, default=64)
     parser.add_argument('--epoch', type=int, default=1, help='number of epochs to train for')
@@ -55,20 +56,44 @@ def get_args():
     parser.add_argument('--workers', type=int, default=4, help='number of data loading workers')
     parser.add_argument('--exp', default='sample', help='folder to output images and model checkpoints')
     parser.add_argument('--evalIter', type=int, default=5, help='interval for evauating(generating) images from valDataroot')
+    parser.add_argument('--gpuAugment', action='store_true', help='random imageSize crop + flip of (input, target, trans, ato) batches on the device')
     parser.add_argument('--device', default=torch.device('cuda' if torch.cuda.is_available() else 'cpu'))
     
     return parser.parse_args()
   
+def patch_size(size):
+    # output size of net.D : three 4x4 stride 2 convs (s // 2), then two 4x4 stride 1 convs (s - 1)
+    return size // 8 - 2
+
+
+def check_sizes(opt, dataset):
+    # pix2pix ignores its transforms : the networks see the stored maps, or their imageSize crop with --gpuAugment
+    H, W = dataset[0][0].shape[-2:]
+    if opt.gpuAugment and opt.imageSize > min(H, W):
+        raise ValueError(f'--imageSize {opt.imageSize} is larger than the {H}x{W} training maps of {opt.dataroot}')
+    if not opt.gpuAugment and H != W:
+        raise ValueError(f'the {H}x{W} training maps of {opt.dataroot} are not square, use --gpuAugment with --imageSize')
+    size = opt.imageSize if opt.gpuAugment else H
+    if opt.sizePatchGAN is None:
+        opt.sizePatchGAN = patch_size(size)
+    elif opt.sizePatchGAN != patch_size(size):
+        raise ValueError(f'--sizePatchGAN {opt.sizePatchGAN} does not match the {patch_size(size)}x{patch_size(size)} output of D on {size}x{size} inputs')
+
+
 def train_one_epoch(opt, dataloader, vgg, netG, netD, optimizerD, optimizerG, criterionBCE, criterionCAE, imagePool):
     i, loss_D, loss_G = 0, 0.0, 0.0
     loss_img, loss_ato, loss_tran, loss_content, loss_content1 = 0.0, 0.0, 0.0, 0.0, 0.0
     netG.train()
     netD.train()
+    # same crop / flip for the 4 maps, one gather per map
+    batch_aug = BatchAugment(opt.imageSize, flip=True, rot90=False) if opt.gpuAugment else None
     
     for data in tqdm(dataloader, desc=f'Train [{opt.epoch:3d}/{opt.niter}]'):
         i += 1
         input, target, trans, ato, imgname = data
         input, target, trans, ato = input.to(opt.device).float(), target.to(opt.device).float(), trans.to(opt.device).float(), ato.to(opt.device).float()
+        if batch_aug is not None:
+            input, target, trans, ato = batch_aug(input, target, trans, ato)
         
         optimizerD.zero_grad()
         
@@ -235,6 +260,7 @@ if __name__=='__main__':
     dataloader = getLoader(opt, 
                            mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5),
                            split='train', shuffle=True)
+    check_sizes(opt, dataloader.dataset)
     
     opt.dataset='pix2pix_val2'
     valDataloader = getLoader(opt, 
@@ -0,0 +1,54 @@
+import torch
+
+
+class BatchAugment():
+  """
+  Paired augmentation of a whole batch on its device (hazy / clear / trans / ato ...).
+  Every tensor of one call gets the same per-sample random crop, horizontal flip and rot90,
+  composed into a single index map : one gather per tensor, then the optional per-tensor normalization.
+    crop_size : None (whole image) or int
+    rot90     : k in 0~3 for square outputs, 0 / 2 otherwise
+    normalize : None or a list with (mean, std) or None per tensor
+  """
+  def __init__(self, crop_size=None, flip=True, rot90=True, normalize=None):
+    self.crop_size = crop_size
+    self.flip = flip
+    self.rot90 = rot90
+    self.normalize = normalize
+
+  def index(self, B, H, W, device):
+    if self.crop_size is not None and self.crop_size > min(H, W):
+      raise ValueError(f'crop_size {self.crop_size} is larger than the {H}x{W} batch')
+    h, w = (H, W) if self.crop_size is None else (self.crop_size, self.crop_size)
+    top = torch.randint(0, H - h + 1, (B, 1, 1), device=device)
+    left = torch.randint(0, W - w + 1, (B, 1, 1), device=device)
+    if not self.rot90:
+      k = torch.zeros((B, 1, 1), dtype=torch.long, device=device)
+    elif h == w:
+      k = torch.randint(0, 4, (B, 1, 1), device=device)
+    else:
+      k = torch.randint(0, 2, (B, 1, 1), device=device) * 2
+    flip = torch.randint(0, 2 if self.flip else 1, (B, 1, 1), device=device).bool()
+
+    # source pixel of output (i, j) : rot90 (counter-clockwise, like np.rot90) of the flipped crop
+    i = torch.arange(h, device=device).view(1, h, 1)
+    j = torch.arange(w, device=device).view(1, 1, w)
+    r = torch.where(k == 0, i, torch.where(k == 1, j, torch.where(k == 2, h - 1 - i, h - 1 - j)))
+    c = torch.where(k == 0, j, torch.where(k == 1, w - 1 - i, torch.where(k == 2, w - 1 - j, i)))
+    c = torch.where(flip, w - 1 - c, c)
+    return ((top + r) * W + (left + c)).view(B, 1, h * w), h, w
+
+  def __call__(self, *tensors):
+    B, _, H, W = tensors[0].shape
+    index, h, w = self.index(B, H, W, tensors[0].device)
+    out = []
+    for n, x in enumerate(tensors):
+      C = x.shape[1]
+      y = x.reshape(B, C, H * W).gather(2, index.expand(B, C, h * w)).view(B, C, h, w)
+      if self.normalize is not None and self.normalize[n] is not None:
+        mean, std = self.normalize[n]
+        mean = torch.as_tensor(mean, dtype=y.dtype, device=y.device).view(1, -1, 1, 1)
+        std = torch.as_tensor(std, dtype=y.dtype, device=y.device).view(1, -1, 1, 1)
+        y = (y - mean) / std
+      out.append(y)
+    return tuple(out)
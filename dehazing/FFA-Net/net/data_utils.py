@@ -33,11 +33,12 @@ def tensorShow(tensors,titles=None):
         plt.show()
 
 class RESIDE_Dataset(data.Dataset):
-    def __init__(self,path,train,size=crop_size,format='.png'):
+    def __init__(self,path,train,size=crop_size,format='.png',batch_aug=False):
         super(RESIDE_Dataset,self).__init__()
         self.size=size
         print('crop size',size)
         self.train=train
+        self.batch_aug=batch_aug#workers only decode + crop, flip/rot/normalize done by batch_augment on the device
         self.format=format
         self.haze_imgs_dir=os.listdir(os.path.join(path,'hazy'))
         self.haze_imgs=[os.path.join(path,'hazy',img) for img in self.haze_imgs_dir]
@@ -60,6 +61,8 @@ class RESIDE_Dataset(data.Dataset):
         haze,clear=self.augData(haze.convert("RGB") ,clear.convert("RGB") )
         return haze,clear
     def augData(self,data,target):
+        if self.train and self.batch_aug:
+            return tfs.ToTensor()(data),tfs.ToTensor()(target)
         if self.train:
             rand_hor=random.randint(0,1)
             rand_rot=random.randint(0,3)
@@ -75,15 +78,53 @@ class RESIDE_Dataset(data.Dataset):
     def __len__(self):
         return len(self.haze_imgs)
 
+class InfiniteLoader():
+    '''
+    persistent iterator over a DataLoader for step based training :
+    the epoch iterator (and its workers) is only rebuilt when it is exhausted,
+    and on cuda the next batch is copied from pinned memory on a side stream while the current step runs.
+    next(loader) -> (x,y) on device
+    '''
+    def __init__(self,loader,device):
+        self.loader=loader
+        self.device=torch.device(device)
+        self.cuda=self.device.type=='cuda'
+        self.stream=torch.cuda.Stream(self.device) if self.cuda else None
+        self.iterator=iter(self.loader)
+        self.epoch=0
+        self.next_batch=self.fetch()
+    def fetch(self):
+        try:
+            batch=next(self.iterator)
+        except StopIteration:
+            self.epoch+=1
+            self.iterator=iter(self.loader)
+            batch=next(self.iterator)
+        if not self.cuda:
+            return [t.to(self.device) for t in batch]
+        with torch.cuda.stream(self.stream):
+            return [t.pin_memory().to(self.device,non_blocking=True) if not t.is_pinned() else t.to(self.device,non_blocking=True) for t in batch]
+    def __iter__(self):
+        return self
+    def __next__(self):
+        if self.cuda:
+            torch.cuda.current_stream(self.device).wait_stream(self.stream)
+            for t in self.next_batch:
+                t.record_stream(torch.cuda.current_stream(self.device))
+        batch=self.next_batch
+        self.next_batch=self.fetch()
+        return batch
+
 import os
 pwd=os.getcwd()
 print(pwd)
 path='/home/zhilin007/VS/FFA-Net/data'#path to your 'data' folder
 
-ITS_train_loader=DataLoader(dataset=RESIDE_Dataset(path+'/RESIDE/ITS',train=True,size=crop_size),batch_size=BS,shuffle=True)
+train_args=dict(batch_size=BS,shuffle=True,num_workers=opt.workers,pin_memory=torch.cuda.is_available(),persistent_workers=opt.workers>0)
+ITS_train_loader=DataLoader(dataset=RESIDE_Dataset(path+'/RESIDE/ITS',train=True,size=crop_size,batch_aug=opt.gpu_aug),**train_args)
 ITS_test_loader=DataLoader(dataset=RESIDE_Dataset(path+'/RESIDE/SOTS/indoor',train=False,size='whole img'),batch_size=1,shuffle=False)
 
-OTS_train_loader=DataLoader(dataset=RESIDE_Dataset(path+'/RESIDE/OTS',train=True,format='.jpg'),batch_size=BS,shuffle=True)
+OTS_train_loader=DataLoader(dataset=RESIDE_Dataset(path+'/RESIDE/OTS',train=True,format='.jpg',batch_aug=opt.gpu_aug),**train_args)
 OTS_test_loader=DataLoader(dataset=RESIDE_Dataset(path+'/RESIDE/SOTS/outdoor',train=False,size='whole img',format='.png'),batch_size=1,shuffle=False)
 
 if __name__ == "__main__":
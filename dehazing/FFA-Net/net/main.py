@@ -1,6 +1,6 @@
 import torch,os,sys,torchvision,argparse
 import torchvision.transforms as tfs
-from metrics import psnr,ssim
+from metrics import psnr,ssim,batch_metrics
 from models import *
 import time,math
 import numpy as np
@@ -13,6 +13,7 @@ import torchvision.utils as vutils
 warnings.filterwarnings('ignore')
 from option import opt,model_name,log_dir
 from data_utils import *
+from batch_augment import BatchAugment
 from torchvision.models import vgg16
 print('log_dir :',log_dir)
 print('model_name:',model_name)
@@ -52,6 +53,10 @@ def train(net,loader_train,loader_test,optim,criterion):
 		print(f'start_step:{start_step} start training ---')
 	else :
 		print('train from scratch *** ')
+	train_iter=InfiniteLoader(loader_train,opt.device)
+	#crop stays in the workers (RESIDE images differ in size), flip/rot90/normalize of x and y in one gather each
+	batch_aug=BatchAugment(flip=True,rot90=True,normalize=[([0.64, 0.6, 0.58],[0.14,0.15, 0.152]),None]) if opt.gpu_aug else None
+	data_time=0
 	for step in range(start_step+1,opt.steps+1):
 		net.train()
 		lr=opt.lr
@@ -59,8 +64,11 @@ def train(net,loader_train,loader_test,optim,criterion):
 			lr=lr_schedule_cosdecay(step,T)
 			for param_group in optim.param_groups:
 				param_group["lr"] = lr  
-		x,y=next(iter(loader_train))
-		x=x.to(opt.device);y=y.to(opt.device)
+		data_start=time.time()
+		x,y=next(train_iter)
+		if batch_aug is not None:
+			x,y=batch_aug(x,y)
+		data_time+=time.time()-data_start
 		out=net(x)
 		loss=criterion[0](out,y)
 		if opt.perloss:
@@ -72,7 +80,7 @@ def train(net,loader_train,loader_test,optim,criterion):
 		optim.step()
 		optim.zero_grad()
 		losses.append(loss.item())
-		print(f'\rtrain loss : {loss.item():.5f}| step :{step}/{opt.steps}|lr :{lr :.7f} |time_used :{(time.time()-start_time)/60 :.1f}',end='',flush=True)
+		print(f'\rtrain loss : {loss.item():.5f}| step :{step}/{opt.steps}|lr :{lr :.7f} |time_used :{(time.time()-start_time)/60 :.1f} |data_wait :{data_time/(step-start_step)*1000 :.1f}ms',end='',flush=True)
 
 		#with SummaryWriter(logdir=log_dir,comment=log_dir) as writer:
 		#	writer.add_scalar('data/loss',loss,step)
@@ -124,15 +132,40 @@ def test(net,loader_test,max_psnr,max_ssim,step):
 		# tfs.ToPILImage()(torch.squeeze(targets.cpu())).save('111.png')
 		# vutils.save_image(targets.cpu(),'target.png')
 		# vutils.save_image(pred.cpu(),'pred.png')
-		ssim1=ssim(pred,targets).item()
-		psnr1=psnr(pred,targets)
+		#kept on the device, copied back once after the loop
+		psnr1,ssim1=batch_metrics(pred.detach(),targets)
 		ssims.append(ssim1)
 		psnrs.append(psnr1)
 		#if (psnr1>max_psnr or ssim1 > max_ssim) and s :
 		#		ts=vutils.make_grid([torch.squeeze(inputs.cpu()),torch.squeeze(targets.cpu()),torch.squeeze(pred.clamp(0,1).cpu())])
 		#		vutils.save_image(ts,f'samples/{model_name}/{step}_{psnr1:.4}_{ssim1:.4}.png')
 		#		s=False
-	return np.mean(ssims) ,np.mean(psnrs)
+	return torch.cat(ssims).mean().item() ,torch.cat(psnrs).mean().item()
+
+def bench_loader(net,loader_train,optim,criterion,steps):
+	# mean step time / data wait : fresh iterator every step (former train loop) vs InfiniteLoader
+	def step_time(next_batch):
+		wait,total=0,0
+		for _ in range(steps):
+			start=time.time()
+			x,y=next_batch()
+			wait+=time.time()-start
+			loss=criterion[0](net(x),y)
+			loss.backward()
+			optim.step()
+			optim.zero_grad()
+			if opt.device=='cuda':
+				torch.cuda.synchronize()
+			total+=time.time()-start
+		return total/steps*1000,wait/steps*1000
+	net.train()
+	def fresh():
+		x,y=next(iter(loader_train))
+		return x.to(opt.device),y.to(opt.device)
+	train_iter=InfiniteLoader(loader_train,opt.device)
+	for name,next_batch in [('next(iter(loader))',fresh),('InfiniteLoader',lambda:next(train_iter))]:
+		total,wait=step_time(next_batch)
+		print(f'{name:20s} step :{total:.1f}ms | data wait :{wait:.1f}ms ({wait/total*100:.0f}%)')
 
 
 if __name__ == "__main__":
@@ -153,6 +186,9 @@ if __name__ == "__main__":
 			criterion.append(PerLoss(vgg_model).to(opt.device))
 	optimizer = optim.Adam(params=filter(lambda x: x.requires_grad, net.parameters()),lr=opt.lr, betas = (0.9, 0.999), eps=1e-08)
 	optimizer.zero_grad()
-	train(net,loader_train,loader_test,optimizer,criterion)
+	if opt.bench_loader>0:
+		bench_loader(net,loader_train,optimizer,criterion,opt.bench_loader)
+	else:
+		train(net,loader_train,loader_test,optimizer,criterion)
 	
 
@@ -26,6 +26,9 @@ parser.add_argument('--crop',action='store_true')
 parser.add_argument('--crop_size',type=int,default=240,help='Takes effect when using --crop ')
 parser.add_argument('--no_lr_sche',action='store_true',help='no lr cos schedule')
 parser.add_argument('--perloss',action='store_true',help='perceptual loss')
+parser.add_argument('--workers',type=int,default=4,help='train loader workers (kept alive across epochs)')
+parser.add_argument('--gpu_aug',action='store_true',help='flip / rot90 / normalize of the train batch on the device (one gather per tensor) instead of per image in the workers')
+parser.add_argument('--bench_loader',type=int,default=0,help='only time this many train steps : fresh iterator per step vs InfiniteLoader')
 
 opt=parser.parse_args()
 opt.device='cuda' if torch.cuda.is_available() else 'cpu'
@@ -63,35 +63,112 @@ class DataValSet(data.Dataset):
 
 
 class DataSet_HDF5(data.Dataset):
-    def __init__(self, file_path):
+    """
+    dataset[index] -> one (LR, HR) patch pair, dataset[list of indices] -> a batch (B x C x H x W) read as
+    contiguous slices, one per chunk, with flip / rot90 applied on the batched array.
+    augment=False : clipped patches only, flip / rot90 left to batch_augment.BatchAugment on the training device.
+    The file is opened lazily in every process, DataLoader workers never share the parent's handle.
+    Use with ChunkBatchSampler and DataLoader(batch_size=None).
+    """
+    def __init__(self, file_path, augment=True):
         super(DataSet_HDF5, self).__init__()
-        hf = h5py.File(file_path,'r')
-        self.data = hf.get("data")
-        self.target = hf.get("label")
-        # hf.close()
+        self.file_path = file_path
+        self.augment = augment
+        self.hf, self.pid = None, None
+        with h5py.File(file_path, 'r') as hf:
+            self.length = hf["data"].shape[0]
+            chunks = hf["data"].chunks
+        # rows per chunk (contiguous datasets : any slice is contiguous, read in blocks of 64)
+        self.chunk_size = chunks[0] if chunks is not None else 64
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['hf'] = None
+        return state
+
+    def open(self):
+        if self.hf is None or self.pid != os.getpid():
+            self.hf, self.pid = h5py.File(self.file_path, 'r'), os.getpid()
+            self.data = self.hf.get("data")
+            self.target = self.hf.get("label")
+
+    def read(self, indices):
+        # one slice per chunk touched by the batch, then the rows in the requested order
+        indices = np.asarray(indices)
+        LR_batch = np.empty((len(indices),) + self.data.shape[1:], np.float32)
+        HR_batch = np.empty((len(indices),) + self.target.shape[1:], np.float32)
+        chunk_ids = indices // self.chunk_size
+        for chunk in np.unique(chunk_ids):
+            rows = np.nonzero(chunk_ids == chunk)[0]
+            lo, hi = indices[rows].min(), indices[rows].max() + 1
+            LR_batch[rows] = self.data[lo:hi][indices[rows] - lo]
+            HR_batch[rows] = self.target[lo:hi][indices[rows] - lo]
+        return LR_batch, HR_batch
 
     def __getitem__(self, index):
-        # randomly flip
-        #print(index)
-        #data shppe: C*H*W
-        LR_patch = self.data[index, :, :, :]
-        HR_patch = self.target[index, :, :, :]
-        LR_patch = np.clip(LR_patch, 0, 1)  # we might get out of bounds due to noise
-        HR_patch = np.clip(HR_patch, 0, 1)  # we might get out of bounds due to noise
-        LR_patch = np.asarray(LR_patch, np.float32)
-        HR_patch = np.asarray(HR_patch, np.float32)
-
-        flip_channel = random.randint(0, 1)
-        if flip_channel != 0:
-            LR_patch = np.flip(LR_patch, 2)
-            HR_patch = np.flip(HR_patch, 2)
-        # randomly rotation
-        rotation_degree = random.randint(0, 3)
-        LR_patch = np.rot90(LR_patch, rotation_degree, (1,2))
-        HR_patch = np.rot90(HR_patch, rotation_degree, (1,2))
-        return LR_patch.copy(), \
-               HR_patch.copy()
+        self.open()
+        transform = augment_batch if self.augment else clip_batch
+        if np.ndim(index) == 0:
+            LR_patch, HR_patch = transform(*self.read([index]))
+            return LR_patch[0], HR_patch[0]
+        return transform(*self.read(index))
 
     def __len__(self):
-        return self.data.shape[0]
+        return self.length
+
+
+def clip_batch(LR_batch, HR_batch):
+    # we might get out of bounds due to noise
+    return np.clip(LR_batch, 0, 1), np.clip(HR_batch, 0, 1)
+
 
+def augment_batch(LR_batch, HR_batch):
+    # per patch random flip / rotation, applied once for every (flip, rotation) group of the batch
+    LR_batch, HR_batch = clip_batch(LR_batch, HR_batch)
+    flip_channel = np.random.randint(0, 2, len(LR_batch))
+    rotation_degree = np.random.randint(0, 4, len(LR_batch))
+    LR_out, HR_out = np.empty_like(LR_batch), np.empty_like(HR_batch)
+    for flip in range(2):
+        for degree in range(4):
+            sel = (flip_channel == flip) & (rotation_degree == degree)
+            if not sel.any():
+                continue
+            LR_patch, HR_patch = LR_batch[sel], HR_batch[sel]
+            if flip != 0:
+                LR_patch, HR_patch = LR_patch[..., ::-1], HR_patch[..., ::-1]
+            LR_out[sel] = np.rot90(LR_patch, degree, (2, 3))
+            HR_out[sel] = np.rot90(HR_patch, degree, (2, 3))
+    return LR_out, HR_out
+
+
+class ChunkBatchSampler(data.Sampler):
+    """
+    Shuffles the chunk order, then the rows inside each chunk, and yields lists of indices (one batch each),
+    so a batch touches one or two chunks instead of batch_size random ones.
+    """
+    def __init__(self, length, chunk_size, batch_size, shuffle=True, drop_last=False):
+        self.length = length
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        chunks = np.arange(0, self.length, self.chunk_size)
+        if self.shuffle:
+            chunks = np.random.permutation(chunks)
+        order = []
+        for start in chunks:
+            rows = np.arange(start, min(start + self.chunk_size, self.length))
+            order.append(np.random.permutation(rows) if self.shuffle else rows)
+        order = np.concatenate(order)
+        for i in range(0, self.length, self.batch_size):
+            batch = order[i:i + self.batch_size]
+            if self.drop_last and len(batch) < self.batch_size:
+                break
+            yield batch.tolist()
+
+    def __len__(self):
+        if self.drop_last:
+            return self.length // self.batch_size
+        return (self.length + self.batch_size - 1) // self.batch_size
@@ -0,0 +1,83 @@
+"""
+Batched PSNR / SSIM shared by every metrics.py (PDDE, depth and the dehazing baselines)
+The copies next to each metrics.py are kept identical to PDDE/utils/metrics_engine.py :
+    python check_metrics_engine.py          (from PDDE, fails when a copy differs)
+    python check_metrics_engine.py --sync   (copies PDDE/utils/metrics_engine.py over the others)
+"""
+from math import exp
+
+import torch
+import torch.nn.functional as F
+from torch.autograd import Variable
+
+
+# Gaussian windows per (window_size, channel, device, dtype, separable), built once and kept on the device
+_windows = {}
+
+def gaussian(window_size, sigma):
+    gauss = torch.Tensor([exp(-(x - window_size // 2) ** 2 / float(2 * sigma ** 2)) for x in range(window_size)])
+    return gauss / gauss.sum()
+
+def create_window(window_size, channel):
+    _1D_window = gaussian(window_size, 1.5).unsqueeze(1)
+    _2D_window = _1D_window.mm(_1D_window.t()).float().unsqueeze(0).unsqueeze(0)
+    window = Variable(_2D_window.expand(channel, 1, window_size, window_size).contiguous())
+    return window
+
+def cached_window(window_size, channel, device, dtype, separable=False):
+    # separable : C x 1 x 1 x window_size row kernel (its transpose is the column kernel)
+    key = (window_size, channel, str(device), dtype, separable)
+    if key not in _windows:
+        _1D_window = gaussian(window_size, 1.5)
+        if separable:
+            window = _1D_window.view(1, 1, 1, window_size).expand(channel, 1, 1, window_size)
+        else:
+            window = create_window(window_size, channel)
+        _windows[key] = window.to(device=device, dtype=dtype).contiguous()
+    return _windows[key]
+
+def gaussian_filter(x, window_size, separable=False):
+    # depthwise Gaussian blur with zero padding (two 1D passes when separable, same result)
+    channel = x.size(1)
+    window = cached_window(window_size, channel, x.device, x.dtype, separable)
+    if separable:
+        x = F.conv2d(x, window, padding=(0, window_size // 2), groups=channel)
+        return F.conv2d(x, window.transpose(2, 3), padding=(window_size // 2, 0), groups=channel)
+    return F.conv2d(x, window, padding=window_size // 2, groups=channel)
+
+
+def ssim_batch(img1, img2, window_size=11, separable=False):
+    """
+    SSIM of every image of the batch (B tensor, on the device of img1)
+    the 5 filtered maps (mu1, mu2, E[x^2], E[y^2], E[xy]) are one grouped convolution
+    """
+    channel = img1.size(1)
+    filtered = gaussian_filter(torch.cat([img1, img2, img1 * img1, img2 * img2, img1 * img2], 1), window_size, separable)
+    mu1, mu2, e11, e22, e12 = filtered.split(channel, 1)
+    mu1_sq = mu1.pow(2)
+    mu2_sq = mu2.pow(2)
+    mu1_mu2 = mu1 * mu2
+    C1 = 0.01 ** 2
+    C2 = 0.03 ** 2
+    ssim_map = ((2 * mu1_mu2 + C1) * (2 * (e12 - mu1_mu2) + C2)) / ((mu1_sq + mu2_sq + C1) * (e11 - mu1_sq + e22 - mu2_sq + C2))
+    return torch.mean(ssim_map, dim=(1,2,3))
+
+def psnr_batch(pred, gt, max_psnr=100):
+    # PSNR of every image of the batch (B tensor), max_psnr for identical images
+    mse = torch.mean(torch.square(pred - gt), dim=(1,2,3))
+    psnr = 10 * torch.log10(1.0 / mse)
+    return torch.where(mse == 0, torch.full_like(psnr, max_psnr), psnr)
+
+def to_batch(x, device=None):
+    # numpy / tensor, CxHxW or BxCxHxW -> float tensor BxCxHxW (no copy when it already is one)
+    x = torch.as_tensor(x, device=device).float()
+    return x.unsqueeze(0) if x.dim() == 3 else x
+
+def batch_metrics(pred, gt, window_size=11, separable=False, device=None, max_psnr=100):
+    """
+    (psnr B, ssim B) tensors of 0~1 images, numpy or tensors, computed on device (default : pred's device)
+    same values as the per-image psnr / ssim of metrics.py
+    """
+    pred = torch.clamp(to_batch(pred, device), 0, 1)
+    gt = torch.clamp(to_batch(gt, pred.device), 0, 1)
+    return psnr_batch(pred, gt, max_psnr), ssim_batch(pred, gt, window_size, separable)
@@ -23,7 +23,7 @@ import statistics
 import re
 import torch.nn as nn
 import torch.nn.functional as F
-import pytorch_ssim
+from metrics import batch_metrics
 
 parser = argparse.ArgumentParser(description="PyTorch LapSRN Test")
 parser.add_argument("--scale", default=4, type=int, help="scale factor, Default: 4")
@@ -77,12 +77,12 @@ def test(test_gen, model, criterion, SR_dir):
             med_time.append(evalation_time)
 
 
-            ssim = pytorch_ssim.ssim(sr, HR)
+            # PSNR / SSIM of the clamped (0~1) outputs and targets, like the other baselines' metrics.py :
+            # the reported numbers differ from the former pytorch_ssim / MSE PSNR when HR leaves [0, 1]
+            psnr, ssim = batch_metrics(sr, HR)
             #print(ssim)
-            avg_ssim += ssim
-
-            mse = criterion(sr, HR)
-            psnr = 10 * log10(1 / mse)
+            avg_ssim += ssim.mean()
+            psnr = psnr.mean().item()
             #
             resultSRDeblur = transforms.ToPILImage()(sr.cpu()[0])
             resultSRDeblur.save(join(SR_dir, '{0}_{1}.png'.format(name, opt.name)))
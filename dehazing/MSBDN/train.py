@@ -5,7 +5,8 @@ import os
 from os.path import join
 import torch
 from torch.utils.data import DataLoader
-from datasets.dataset_hf5 import DataSet_HDF5
+from datasets.dataset_hf5 import DataSet_HDF5, ChunkBatchSampler
+from datasets.batch_augment import BatchAugment
 from importlib import import_module
 import random
 import re
@@ -30,6 +31,7 @@ parser.add_argument('--gpu_ids', type=str, default='0, 1', help='gpu ids: e.g. 0
 parser.add_argument("--train_step", type=int, default=1, help="Activated gate module")
 parser.add_argument("--clip", type=float, default=0.25, help="Clipping Gradients. Default=0.1")
 parser.add_argument("--lr", type=float, default=1e-4, help="Learning rate, default=1e-4")
+parser.add_argument("--gpuAugment", action='store_true', help="flip / rot90 of the whole batch on the device instead of in the loader")
 
 training_settings=[
     {'nEpochs': 100, 'lr': 1e-4, 'step': 50, 'lr_decay': 0.1}
@@ -94,6 +96,8 @@ def train(train_gen, model, criterion, optimizer, epoch):
         GT = batch[1]
         Hazy = Hazy.to(device)
         GT = GT.to(device)
+        if batch_augment is not None:
+            Hazy, GT = batch_augment(Hazy, GT)
 
         dehaze = model(Hazy)
         mse = criterion(dehaze, GT)
@@ -121,6 +125,7 @@ opt = parser.parse_args()
 Net = import_module('networks.' + opt.model)
 print(opt.resume)
 device = torch.device('cuda:{}'.format(opt.gpu_ids[0])) if torch.cuda.is_available() else torch.device('cpu')
+batch_augment = BatchAugment(flip=True, rot90=True) if opt.gpuAugment else None
 str_ids = opt.gpu_ids.split(',')
 torch.cuda.set_device(int(str_ids[0]))
 opt.seed = random.randint(1, 10000)
@@ -170,8 +175,10 @@ for i in range(opt.start_training_step, 3):
         random.shuffle(train_sets)
         for j in range(len(train_sets)):
             print("Step {}:Training folder is {}".format(i, join(train_dir, train_sets[j])))
-            train_set = DataSet_HDF5(join(train_dir, train_sets[j]))
-            trainloader = DataLoader(dataset=train_set, batch_size=opt.batchSize, shuffle=True, num_workers=1)
+            train_set = DataSet_HDF5(join(train_dir, train_sets[j]), augment=not opt.gpuAugment)
+            # chunk-ordered batches, each one read as contiguous slices by the dataset (batch_size=None : no collation)
+            train_sampler = ChunkBatchSampler(len(train_set), train_set.chunk_size, opt.batchSize, shuffle=True)
+            trainloader = DataLoader(dataset=train_set, sampler=train_sampler, batch_size=None, num_workers=1)
             avg_psnr = train(trainloader, model, criterion, optimizer, epoch)
             psnr = psnr + avg_psnr
         if epoch % 1 == 0:
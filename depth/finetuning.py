@@ -23,6 +23,7 @@ def get_args():
     # model parameters : RESIDE-V0-OTS
     parser.add_argument('--dataset', required=False, default='RESIDE',  help='dataset name')
     parser.add_argument('--dataRoot', type=str, default='D:/data/RESIDE_V0_outdoor',  help='data file path')
+    parser.add_argument('--packedRoot', type=str, default=None,  help='packed dataset path (dataset.packed, train/ and val/ inside)')
     parser.add_argument('--scale', type=float, default=0.000150,  help='depth scale')
     parser.add_argument('--shift', type=float, default= 0.1378,  help='depth shift')
     parser.add_argument('--preTrainedModel', type=str, default='weights/depth_weights/dpt_hybrid_kitti-cb926ef4.pt', help='pretrained DPT path')
@@ -139,15 +140,18 @@ if __name__ == '__main__':
         invert = True,
         non_negative = True,
         enable_attention_hooks=False,
+        channels_last=True,
     )
     
+    # NHWC weights, forward converts the input to match
     model = model.to(memory_format = torch.channels_last)
     model.to(opt.device)
     
     dataset_args = dict(img_size=[opt.imageSize_W, opt.imageSize_H], norm=opt.norm)
     if opt.dataset == 'RESIDE':
-        train_set = RESIDE_Dataset(opt.dataRoot + '/train', **dataset_args)
-        val_set = RESIDE_Dataset(opt.dataRoot + '/val', **dataset_args)
+        train_packed, val_packed = (None, None) if opt.packedRoot is None else (opt.packedRoot + '/train', opt.packedRoot + '/val')
+        train_set = RESIDE_Dataset(opt.dataRoot + '/train', packed=train_packed, **dataset_args)
+        val_set = RESIDE_Dataset(opt.dataRoot + '/val', packed=val_packed, **dataset_args)
         
     
     loader_args = dict(num_workers=4, drop_last=False, shuffle=True)
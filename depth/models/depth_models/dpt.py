@@ -1,8 +1,12 @@
+import os
+import hashlib
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
 from .base_model import BaseModel
+from .cache import DepthCache
+from . import quantize as quant
 from .blocks import (
     FeatureFusionBlock,
     FeatureFusionBlock_custom,
@@ -67,7 +71,7 @@ class DPT(BaseModel):
 
     def forward(self, x):
         if self.channels_last == True:
-            x.contiguous(memory_format=torch.channels_last)
+            x = x.contiguous(memory_format=torch.channels_last)
 
         layer_1, layer_2, layer_3, layer_4 = forward_vit(self.pretrained, x)
 
@@ -108,12 +112,136 @@ class DPTDepthModel(DPT):
 
         super().__init__(head, **kwargs)
 
+        self.path = path
+        self.depth_cache = None
+        self.inference = None
+        self.quantized = None
         if path is not None:
             self.load(path)
 
+        # opt-in depth cache for every caller : DPT_DEPTH_CACHE=<dir> [DPT_DEPTH_CACHE_GB=8]
+        if os.environ.get("DPT_DEPTH_CACHE"):
+            max_gb = float(os.environ.get("DPT_DEPTH_CACHE_GB", 8))
+            self.enable_cache(os.environ["DPT_DEPTH_CACHE"], int(max_gb * 1024**3))
+
+    def enable_cache(self, root, max_bytes=8 * 1024**3):
+        if self.path is not None:
+            weights_hash = DepthCache.hash_file(self.path)
+        else:
+            sha = hashlib.sha1()
+            for value in self.state_dict().values():
+                if not torch.is_tensor(value):
+                    continue
+                sha.update(value.detach().cpu().numpy().tobytes())
+            weights_hash = sha.hexdigest()
+        self.weights_hash = weights_hash
+        self.update_cache_hash()
+        self.depth_cache = DepthCache(root, max_bytes)
+
+    def update_cache_hash(self):
+        # weights + depth conversion + numeric mode (int8 layout, autocast dtype, compile)
+        self.cache_hash = f"{self.weights_hash}_{self.scale}_{self.shift}_{self.invert}"
+        if self.quantized is not None:
+            self.cache_hash += self.quantized_tag()
+        if self.inference is not None:
+            self.cache_hash += self.inference_tag()
+
+    def quantize(self, dynamic=True, static=(), calibration=None):
+        """
+        int8 inference on cpu (models/depth_models/quantize.py)
+            dynamic     : int8 nn.Linear in the ViT blocks (attention / mlp projections)
+            static      : parts of quant.STATIC_PARTS ('stem', 'refinenets') with calibrated int8 activations
+            calibration : iterable of input batches (Bx3xHxW, as for forward) observed before converting the static parts,
+                          None when the quantized weights are loaded right after (load_quantized)
+        """
+        if self.quantized is not None:
+            raise RuntimeError('model is already quantized')
+        self.cpu()
+        self.eval()
+        modules = quant.static_modules(self, static)
+        if modules:
+            quant.prepare_static(modules)
+            with torch.no_grad():
+                for x in calibration if calibration is not None else []:
+                    super().forward(x.cpu())
+            quant.convert_static(modules)
+        if dynamic:
+            quant.quantize_linear(self.pretrained.model.blocks)
+        self.quantized = dict(dynamic=dynamic, static=list(static))
+        if self.depth_cache is not None:
+            self.update_cache_hash()
+        return self
+
+    def quantized_tag(self):
+        return '_int8' + ('_dynamic' if self.quantized['dynamic'] else '') + ''.join('_' + part for part in self.quantized['static'])
+
+    def save_quantized(self, path, calibration=None):
+        # calibration : description of the calibration images, kept next to the int8 weights
+        torch.save({'quantized': self.quantized, 'model': self.state_dict(), 'calibration': calibration}, path)
+
+    def load_quantized(self, path):
+        # same quantized layout as the saved model, then its int8 weights and calibrated scales
+        parameters = torch.load(path, map_location=torch.device("cpu"), weights_only=False)
+        self.quantize(**parameters['quantized'])
+        self.load_state_dict(parameters['model'])
+        return self
+
+    def inference_mode(self, channels_last=True, autocast_dtype=None, capture=None):
+        """
+        Inference only settings (eval, frozen weights, no autograd graph around the network)
+            channels_last  : NHWC weights and input for the convolutions (ResNet stem, reassemble, refinenets)
+            autocast_dtype : None, torch.bfloat16 or torch.float16 (bfloat16 on cpu), depth is returned in float32
+            capture        : None or 'compile' (torch.compile, one graph per input shape)
+        (TorchScript tracing is not offered : forward_vit builds its reshapes from tensor sizes)
+        """
+        if capture not in [None, 'compile']:
+            raise ValueError("capture is None or 'compile'")
+        if self.quantized is not None and autocast_dtype is not None:
+            raise ValueError('int8 quantized model runs without autocast')
+        self.eval()
+        for param in self.parameters():
+            param.requires_grad_(False)
+        self.channels_last = channels_last
+        if channels_last:
+            self.to(memory_format=torch.channels_last)
+        self.inference = dict(autocast_dtype=autocast_dtype, capture=capture)
+        if capture == 'compile':
+            self.inference['compiled'] = torch.compile(super().forward, dynamic=False)
+        if self.depth_cache is not None:
+            self.update_cache_hash()
+        return self
+
+    def inference_tag(self):
+        dtype = self.inference['autocast_dtype']
+        return ('_' + str(dtype).replace('torch.', '') if dtype is not None else '') + \
+               ('_' + self.inference['capture'] if self.inference['capture'] is not None else '')
+
+    def forward_network(self, x):
+        if self.inference is None:
+            return super().forward(x)
+
+        dtype = self.inference['autocast_dtype']
+        if dtype == torch.float16 and x.device.type == 'cpu':
+            dtype = torch.bfloat16
+        # no_grad rather than inference_mode : callers scale the returned depth in place
+        with torch.no_grad(), torch.autocast(x.device.type, dtype=dtype, enabled=dtype is not None):
+            if self.inference['capture'] == 'compile':
+                out = self.inference['compiled'](x)
+            else:
+                out = super().forward(x)
+        return out.float()
+
     def forward(self, x):
-        inv_depth = super().forward(x)
+        # cache only for inference (eval + no_grad)
+        if self.depth_cache is not None and not self.training and not torch.is_grad_enabled():
+            return self.depth_cache.forward(self.forward_depth, self.cache_hash, x)
+        return self.forward_depth(x)
+
+    def forward_depth(self, x):
+        return self.to_depth(self.forward_network(x))
 
+    def to_depth(self, inv_depth):
+        # network output (inverse depth) -> depth with scale / shift / invert
         if self.invert:
             depth = self.scale * inv_depth + self.shift
             depth[depth < 1e-8] = 1e-8
@@ -0,0 +1,89 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.ao.quantization import DeQuantStub, QuantStub, convert, get_default_qconfig, prepare, quantize_dynamic
+from timm.layers.padding import pad_same
+
+
+# int8 inference parts of DPT (cpu quantized engine : torch.backends.quantized.engine)
+#   dynamic : nn.Linear of the ViT blocks (attention qkv / proj, mlp fc1 / fc2), weights int8, activations per batch
+#   static  : 'stem'       ResNet stem of the hybrid backbone (conv 7x7 + GroupNorm + ReLU + max pool)
+#             'refinenets' scratch.refinenet1~4 (conv units, FloatFunctional adds, bilinear upsampling)
+STATIC_PARTS = ['stem', 'refinenets']
+
+
+def quantize_linear(blocks):
+    quantize_dynamic(blocks, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class QuantBlock(nn.Module):
+    # float inputs -> int8 block -> float output (one QuantStub per input, inputs have their own scales)
+    def __init__(self, block, inputs=2):
+        super().__init__()
+        self.quant = nn.ModuleList([QuantStub() for _ in range(inputs)])
+        self.block = block
+        self.dequant = DeQuantStub()
+
+    def forward(self, *xs):
+        return self.dequant(self.block(*[quant(x) for quant, x in zip(self.quant, xs)]))
+
+
+class QuantStem(nn.Module):
+    """
+    ResNetV2 stem (StdConv2dSame -> GroupNormAct -> MaxPool2dSame) rebuilt from quantizable modules
+    weight standardization is folded into a plain conv, max pool pads with 0 instead of -inf (inputs are >= 0 after ReLU)
+    """
+    def __init__(self, stem):
+        super().__init__()
+        conv, norm = stem.conv, stem.norm
+        self.kernel_size, self.stride = conv.kernel_size, conv.stride
+        self.pool_size, self.pool_stride = stem.pool.kernel_size, stem.pool.stride
+
+        weight = F.batch_norm(conv.weight.reshape(1, conv.out_channels, -1), None, None,
+                              training=True, momentum=0., eps=conv.eps).reshape_as(conv.weight)
+        self.conv = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, conv.stride, bias=False)
+        self.conv.weight.data.copy_(weight)
+        self.norm = nn.GroupNorm(norm.num_groups, norm.num_channels, norm.eps, norm.affine)
+        self.norm.load_state_dict(norm.state_dict())
+        self.act = nn.ReLU()
+        self.pool = nn.MaxPool2d(self.pool_size, self.pool_stride)
+        self.quant = QuantStub()
+        self.dequant = DeQuantStub()
+
+    def forward(self, x):
+        x = self.quant(x)
+        x = self.conv(pad_same(x, self.kernel_size, self.stride))
+        x = self.act(self.norm(x))
+        x = self.pool(pad_same(x, self.pool_size, self.pool_stride))
+        return self.dequant(x)
+
+
+def static_modules(model, parts):
+    # wraps the float parts in place, returns the wrappers to prepare / convert
+    modules = []
+    for part in parts:
+        if part == 'stem':
+            if not hasattr(model.pretrained.model.patch_embed, 'backbone'):
+                raise ValueError('stem quantization needs the hybrid backbone (vitb_rn50_384)')
+            backbone = model.pretrained.model.patch_embed.backbone
+            backbone.stem = QuantStem(backbone.stem)
+            modules.append(backbone.stem)
+        elif part == 'refinenets':
+            for name in ['refinenet1', 'refinenet2', 'refinenet3', 'refinenet4']:
+                setattr(model.scratch, name, QuantBlock(getattr(model.scratch, name)))
+                modules.append(getattr(model.scratch, name))
+        else:
+            raise ValueError(f'static parts are {STATIC_PARTS}')
+    return modules
+
+
+def prepare_static(modules):
+    qconfig = get_default_qconfig(torch.backends.quantized.engine)
+    for module in modules:
+        module.qconfig = qconfig
+        prepare(module, inplace=True)
+
+
+def convert_static(modules):
+    for module in modules:
+        convert(module, inplace=True)
@@ -3,6 +3,8 @@ from glob import glob
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
+from utils.results_store import load_run, to_frames
+from utils.stopper_eval import Trajectories, max_steps
 
 
 def read_csv_all(dataRoot, target_beta=None):
@@ -23,6 +25,12 @@ def read_csv_all(dataRoot, target_beta=None):
     return all_df_dict
 
 
+def read_run_all(resultsRoot, run, target_beta=None):
+    # same dict as read_csv_all, from one read of the results store (validDepth_*.py --resultsRoot)
+    labels = ['abs_rel', 'sq_rel','rmse', 'rmse_log', 'a1', 'a2', 'a3', 'entropy']
+    return to_frames(load_run(resultsRoot, run, target_beta, columns=labels))
+
+
 def data_plot(dfName, df):
     fig, ax1 = plt.subplots() 
     ax1.set_title(dfName, fontsize=16)
@@ -45,27 +53,20 @@ def get_Varitation(dataRoot, all_df_dict, labels, gt_beta=None, step_beta=0.005)
     if not isinstance(labels, list):
         labels = list(labels)
     
-    haze_err_dict = {'abs_rel':[], 'sq_rel':[], 'rmse':[], 'rmse_log':[], 'a1':[], 'a2':[], 'a3':[]}
-    dehaze_err_dict = {'abs_rel':[], 'sq_rel':[], 'rmse':[], 'rmse_log':[], 'a1':[], 'a2':[], 'a3':[]}
-    improve_err_dict = {'name':[], 'abs_rel':[], 'sq_rel':[], 'rmse':[], 'rmse_log':[], 'a1':[], 'a2':[], 'a3':[]}
-    beta_err_list, cnt = [], 0
-    for df_name, df in all_df_dict.items():
-        improve_err_dict['name'].append(df_name)
-        est_step = int(df.iloc[df['entropy'].idxmax()].stage)
-        if gt_beta is not None:
-            beta_err = abs(gt_beta - (est_step*step_beta))
-            beta_err_list.append(beta_err)
-
-        if est_step == 0:
-            cnt += 1
-            # print(df_name)
-        
-        for label in labels:
-            haze_err_dict[label].append(df.loc[0, label])
-            dehaze_err_dict[label].append(df.loc[est_step, label])
-            
-            percent = abs(df.loc[0, label] - df.loc[est_step, label]) / df.loc[0, label] * 100
-            improve_err_dict[label].append(percent)
+    # 모든 이미지를 한번에 : images x stages matrices (utils/stopper_eval.py)
+    traj = Trajectories.from_frames(all_df_dict, columns=labels + ['entropy'])
+    rows = np.arange(len(traj))
+    est_step = max_steps(traj, 'entropy')
+    beta_err_list = np.abs(gt_beta - (est_step*step_beta)) if gt_beta is not None else np.array([])
+    cnt = int((est_step == 0).sum())
+    
+    haze_err_dict, dehaze_err_dict = {}, {}
+    improve_err_dict = {'name': list(traj.images)}
+    for label in labels:
+        haze_err, dehaze_err = traj[label][:, 0], traj[label][rows, est_step]
+        haze_err_dict[label] = haze_err.tolist()
+        dehaze_err_dict[label] = dehaze_err.tolist()
+        improve_err_dict[label] = (np.abs(haze_err - dehaze_err) / haze_err * 100).tolist()
     
     improve_best_top(improve_err_dict, dataRoot, gt_beta)
     beta_err_mean = np.array(beta_err_list).mean()
@@ -1,5 +1,6 @@
 import cv2
 import numpy as np
+import torch
 
         # img should be 0~1
 class Entropy_Module():
@@ -29,12 +30,29 @@ class Entropy_Module():
             entropys[i] = H_s
         return np.mean(entropys), np.max(entropys), np.min(entropys)
     
+    def get_cur_batch(self, images):
+        return get_entropy_batch(images, self.eps)
+    
     def get_diff(self, cur_img):
         self.cur_value = self.get_cur(cur_img)
         diff_etp = self.cur_value - self.last_value
         self.last_value = self.cur_value
         return diff_etp
+
+
+# images : Bx3xHxW tensor (0~1), CPU or GPU
+# same uint8 quantization as get_cur -> (mean, max, min) entropy tensors of shape B
+def get_entropy_batch(images, eps=np.finfo(float).eps):
+    B, C, H, W = images.shape
+    img = (images.detach()*255).to(torch.uint8).long()
     
+    offset = torch.arange(B*C, device=img.device).view(B, C, 1, 1) * 256
+    hist = torch.bincount((img + offset).flatten(), minlength=B*C*256).view(B, C, 256)
+    
+    prob = hist.double() / (H*W)    # PMF
+    entropys = (-1) * torch.sum(prob * torch.log2(prob + eps), dim=2)
+    return entropys.mean(1), entropys.max(1).values, entropys.min(1).values
+
 
 if __name__=='__main__':
     dataRoot = 'C:/Users/IIPL/Desktop/data/O_Haze/train/hazy/'
@@ -0,0 +1,180 @@
+"""
+Columnar store of per-step trajectories, one row per (image, step) instead of one csv file per image
+
+<root>/run=<run>/beta=<beta>/part-<writer>-<n>.parquet   (hive partitioned)
+    image, step, <values> (entropy, psnr, ssim / abs_rel, ..., entropy)
+    one row per (run, image, step) : a rerun replaces its run partition once it completes (like the csv files it replaces),
+    load_run / to_frames reject duplicated rows
+
+    python -m utils.results_store --csvRoot D:/data/output_dehaze/SOTS_Ours --root D:/data/results --run SOTS_Ours
+    (imports an existing tree of <image>.csv files, header as in statistic_v2 / statistic_depth)
+"""
+import argparse
+import os
+import shutil
+import time
+import uuid
+from glob import glob
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+PARTITIONING = ds.partitioning(pa.schema([('run', pa.string()), ('beta', pa.float64())]), flavor='hive')
+
+
+def beta_of(image_name):
+    # <name>_<airlight>_<beta>
+    return float(image_name.split('_')[-1])
+
+
+class ResultsWriter():
+    """
+    Buffers rows in memory and writes one parquet part per beta every flush_rows rows (and on close).
+    Parts are only added while the writer is open : several writers (runs, processes) can share a root.
+        mode : existing run=<run> partition on open
+               'overwrite' : replaced on close (a rerun of an evaluation replaces its rows), parts are written
+                             to a hidden .run=<run>-<writer> folder swapped in by close, an exception inside
+                             the with block removes it and keeps the old partition
+               'error'     : FileExistsError
+               'append'    : kept, for several writers of one run on disjoint images
+    """
+    def __init__(self, root, run, flush_rows=50000, mode='overwrite'):
+        if mode not in ['overwrite', 'error', 'append']:
+            raise ValueError('mode must be overwrite, error or append')
+        self.run_path = os.path.join(root, f'run={run}')
+        if mode == 'error' and os.path.isdir(self.run_path):
+            raise FileExistsError(f'{self.run_path} already exists')
+        self.flush_rows = flush_rows
+        self.writer_id = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        # readers skip folders starting with '.'
+        self.path = os.path.join(root, f'.run={run}-{self.writer_id}') if mode == 'overwrite' else self.run_path
+        self.columns = None
+        self.buffers = {}
+        self.rows = 0
+        self.parts = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None and self.path != self.run_path:
+            self.discard()
+        else:
+            self.close()
+
+    def append(self, image, beta, step, **values):
+        # rows are kept as tuples, converted to columns once per flush
+        if self.columns is None:
+            self.columns = tuple(values)
+        elif tuple(values) != self.columns:
+            raise ValueError(f'columns {list(values)} differ from {list(self.columns)}')
+        self.buffers.setdefault(float(beta), []).append((image, step) + tuple(values.values()))
+        self.rows += 1
+        if self.rows >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        for beta, rows in self.buffers.items():
+            folder = os.path.join(self.path, f'beta={beta}')
+            if not os.path.exists(folder):
+                os.makedirs(folder, exist_ok=True)
+            columns = list(zip(*rows))
+            table = pa.table([pa.array(columns[0], pa.string()), pa.array(columns[1], pa.int64())] +
+                             [pa.array(column, pa.float64()) for column in columns[2:]],
+                             names=['image', 'step'] + list(self.columns))
+            name = f'part-{self.writer_id}-{self.parts:05}.parquet'
+            # hidden until complete : readers skip files starting with '.'
+            pq.write_table(table, os.path.join(folder, '.' + name))
+            os.replace(os.path.join(folder, '.' + name), os.path.join(folder, name))
+            self.parts += 1
+        self.buffers, self.rows = {}, 0
+
+    def close(self):
+        self.flush()
+        if self.path != self.run_path:
+            # old partition moved aside first : readers see the old or the new rows, never both
+            old_path = self.path + '.old'
+            if os.path.isdir(self.run_path):
+                os.replace(self.run_path, old_path)
+            if os.path.isdir(self.path):
+                os.replace(self.path, self.run_path)
+            if os.path.isdir(old_path):
+                shutil.rmtree(old_path)
+            self.path = self.run_path
+
+    def discard(self):
+        # overwrite mode : drops the rows of this writer, the old partition stays
+        self.buffers, self.rows = {}, 0
+        if self.path != self.run_path and os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+
+
+def load_run(root, run=None, beta=None, columns=None):
+    """
+    => long-form DataFrame (image, step, <values>, run, beta) of a whole run in one read, sorted by (image, step)
+    run / beta : None for all
+    ValueError when an (run, image, step) row is stored more than once (run appended twice)
+    """
+    dataset = ds.dataset(root, format='parquet', partitioning=PARTITIONING)
+    condition = None
+    if run is not None:
+        condition = ds.field('run') == run
+    if beta is not None:
+        beta_condition = ds.field('beta') == float(beta)
+        condition = beta_condition if condition is None else condition & beta_condition
+    if columns is not None:
+        columns = list(dict.fromkeys(['image', 'step', 'run'] + list(columns)))
+    df = dataset.to_table(columns=columns, filter=condition).to_pandas()
+    duplicated = df.duplicated(['run', 'image', 'step'])
+    if duplicated.any():
+        raise ValueError(f'{root} : {int(duplicated.sum())} duplicated (run, image, step) rows, rewrite the run')
+    return df.sort_values(['image', 'step'], kind='stable').reset_index(drop=True)
+
+
+def to_frames(df, step_column='stage'):
+    # long form -> {image: per-image DataFrame} as read_csv_all returned it (step column named stage, index 0~)
+    images, steps = df['image'].to_numpy(), df['step'].to_numpy()
+    if np.any((images[1:] == images[:-1]) & (steps[1:] <= steps[:-1])):
+        raise ValueError('steps of an image are not unique (several runs or a run appended twice)')
+    values = df.drop(columns=[c for c in ['image', 'run', 'beta'] if c in df]).rename(columns={'step': step_column})
+    # rows of an image are contiguous (load_run sorts by image) : slice instead of groupby
+    bounds = np.flatnonzero(images[1:] != images[:-1]) + 1
+    starts, ends = np.r_[0, bounds], np.r_[bounds, len(images)]
+    return {images[start]: pd.DataFrame({column: values[column].to_numpy()[start:end] for column in values})
+            for start, end in zip(starts, ends)}
+
+
+def import_csv_tree(csv_root, root, run, header, flush_rows=50000):
+    # <csv_root>/**/<image>.csv (no header, first column = step) -> store, returns the number of rows
+    rows = 0
+    with ResultsWriter(root, run, flush_rows) as writer:
+        for file in glob(csv_root + '/**/*.csv', recursive=True):
+            image = os.path.basename(file)[:-4]
+            if image[0] == '_':
+                continue
+            df = pd.read_csv(file, header=None, names=header)
+            for values in df.itertuples(index=False):
+                values = values._asdict()
+                writer.append(image, beta_of(image), values.pop(header[0]), **values)
+                rows += 1
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csvRoot', type=str, required=True, help='folder of per image csv files')
+    parser.add_argument('--root', type=str, required=True, help='results store root')
+    parser.add_argument('--run', type=str, required=True, help='run name')
+    parser.add_argument('--header', type=str, default='stage,entropy,psnr,ssim', help='csv columns (first = step)')
+    opt = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = import_csv_tree(opt.csvRoot, opt.root, opt.run, opt.header.split(','))
+    print(f'{rows} rows imported in {time.perf_counter() - start:.1f}s')
+    start = time.perf_counter()
+    df = load_run(opt.root, opt.run)
+    print(f'load_run : {len(df)} rows, {df["image"].nunique()} images in {time.perf_counter() - start:.2f}s')
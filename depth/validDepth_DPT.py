@@ -10,6 +10,7 @@ from utils.entropy_module import Entropy_Module
 from utils.airlight_module import Airlight_Module
 from utils import util
 from utils.metrics import get_ssim, get_psnr
+from utils.results_store import ResultsWriter, beta_of
 import os
 import csv
 import pandas as pd
@@ -28,6 +29,10 @@ def get_args():
     
     
     
+    parser.add_argument('--resultsRoot', type=str, default='D:/data/output_depth/_results', help='results store root (utils/results_store.py)')
+    parser.add_argument('--backend', type=str, default='torch', choices=['torch', 'onnx'], help='DPT backend (onnx : onnxruntime cpu, graph from PDDE/export_onnx.py)')
+    parser.add_argument('--onnxModel', type=str, default=None, help='DPT onnx path, exported with the scale / shift of the dataset (--dynamicSpatial or the dataset image size)')
+    parser.add_argument('--onnxThreads', type=int, default=None, help='onnxruntime intra-op threads (default : one per core)')
     return parser.parse_args()
 
 def print_score(score):
@@ -46,119 +51,120 @@ def run(opt, model, loader, airlight_module, entropy_module, improve_best_list=N
     if opt.dataset == 'NYU':
         cat_axis = 1
     
-    for batch in tqdm(loader):
-        # hazy_input, clear_input, GT_depth, GT_airlight, GT_beta, haze
-        hazy_images, clear_images, depth_images, gt_airlight, gt_beta, input_names = batch
+    # one row per (image, step) : utils/results_store.py
+    labels = ['abs_rel', 'sq_rel','rmse', 'rmse_log', 'a1', 'a2', 'a3']
+    with ResultsWriter(opt.resultsRoot, os.path.basename(output_folder)) as writer:
+        for batch in tqdm(loader):
+            # hazy_input, clear_input, GT_depth, GT_airlight, GT_beta, haze
+            hazy_images, clear_images, depth_images, gt_airlight, gt_beta, input_names = batch
         
-        # Improve best
-        if improve_best_list is not None:
-            if os.path.basename(input_names[0])[:-4] not in improve_best_list:
-                continue
+            # Improve best
+            if improve_best_list is not None:
+                if os.path.basename(input_names[0])[:-4] not in improve_best_list:
+                    continue
         
-        with torch.no_grad():
-            clear_images = clear_images.to('cuda')
-            gt_depth_median = torch.median(depth_images)
+            with torch.no_grad():
+                clear_images = clear_images.to('cuda')
+                gt_depth_median = torch.median(depth_images)
             
-            depth_images = model.forward(clear_images)
-            init_ratio = gt_depth_median / torch.median(depth_images).item()
-            depth_images *= init_ratio
-            print(torch.max(depth_images))
-
-            # depth_images = depth_images.to('cuda')
-            trans = torch.exp(depth_images*gt_beta.item()*-1)
-            gt_airlight = util.air_denorm(opt.dataset, opt.norm, gt_airlight)[0][0]
-            hazy_images = clear_images*trans + gt_airlight*(1-trans)
-            cur_hazy = hazy_images
-            init_depth = model.forward(cur_hazy) * init_ratio
-
-        output_name = output_folder + '/' + input_names[0][:-4] + '/' + input_names[0][:-4] + '.csv'
-        if not os.path.exists(f'{output_folder}/{input_names[0][:-4]}'):
-            os.makedirs(f'{output_folder}/{input_names[0][:-4]}')
-        f = open(output_name,'w', newline='')
-        wr = csv.writer(f)
+                depth_images = model.forward(clear_images)
+                init_ratio = gt_depth_median / torch.median(depth_images).item()
+                depth_images *= init_ratio
+                print(torch.max(depth_images))
+
+                # depth_images = depth_images.to('cuda')
+                trans = torch.exp(depth_images*gt_beta.item()*-1)
+                gt_airlight = util.air_denorm(opt.dataset, opt.norm, gt_airlight)[0][0]
+                hazy_images = clear_images*trans + gt_airlight*(1-trans)
+                cur_hazy = hazy_images
+                init_depth = model.forward(cur_hazy) * init_ratio
+
+            image_name = input_names[0][:-4]
         
-        cur_depth = None
-        sum_depth = torch.zeros_like(init_depth).to('cuda')
+            cur_depth = None
+            sum_depth = torch.zeros_like(init_depth).to('cuda')
 
-        airlight = airlight_module.get_airlight(cur_hazy, opt.norm)
-        airlight = util.air_denorm(opt.dataset, opt.norm, airlight)
+            airlight = airlight_module.get_airlight(cur_hazy, opt.norm)
+            airlight = util.air_denorm(opt.dataset, opt.norm, airlight)
 
-        # airlight = util.air_denorm(opt.dataset, opt.norm, airlight).item()
-        # airlight = util.air_denorm(opt.dataset, opt.norm, gt_airlight).item()
+            # airlight = util.air_denorm(opt.dataset, opt.norm, airlight).item()
+            # airlight = util.air_denorm(opt.dataset, opt.norm, gt_airlight).item()
 
-        steps = int((gt_beta*2) / opt.betaStep)
-        for step in range(0,steps):
-            with torch.no_grad():
-                cur_depth = model.forward(cur_hazy) * init_ratio
+            steps = int((gt_beta*2) / opt.betaStep)
+            for step in range(0,steps):
+                with torch.no_grad():
+                    cur_depth = model.forward(cur_hazy) * init_ratio
             
-            diff_depth = cur_depth*step - sum_depth
-            cur_hazy = util.denormalize(cur_hazy,opt.norm)
-            trans = torch.exp((diff_depth+cur_depth)*opt.betaStep*-1)
-            sum_depth = cur_depth * (step+1)
-            prediction = (cur_hazy - airlight) / (trans + 1e-12) + airlight
-            prediction = torch.clamp(prediction.float(),0,1)
+                diff_depth = cur_depth*step - sum_depth
+                cur_hazy = util.denormalize(cur_hazy,opt.norm)
+                trans = torch.exp((diff_depth+cur_depth)*opt.betaStep*-1)
+                sum_depth = cur_depth * (step+1)
+                prediction = (cur_hazy - airlight) / (trans + 1e-12) + airlight
+                prediction = torch.clamp(prediction.float(),0,1)
              
-            entropy, _, _ = entropy_module.get_cur(cur_hazy[0].detach().cpu().numpy().transpose(1,2,0))
-
-            ratio = np.median(depth_images[0].detach().cpu().numpy()) / np.median(cur_depth[0].detach().cpu().numpy())
-            multi_score = util.compute_errors(depth_images[0].detach().cpu().numpy(), cur_depth[0].detach().cpu().numpy() * ratio)
-            wr.writerow([step]+multi_score+[entropy])
-
-            # # ##viz haze##
-            # init_haze_viz = (util.denormalize(hazy_images, opt.norm)[0].detach().cpu().numpy().transpose(1,2,0)*255).astype(np.uint8)
-            # cur_haze_viz = (cur_hazy[0].detach().cpu().numpy().transpose(1,2,0)*255).astype(np.uint8)
-            # init_clear_viz = (util.denormalize(clear_images, opt.norm)[0].detach().cpu().numpy().transpose(1,2,0)*255).astype(np.uint8)
-            # haze_set= cv2.cvtColor(np.concatenate([init_haze_viz, cur_haze_viz, init_clear_viz], axis = cat_axis), cv2.COLOR_RGB2BGR)
-            # ############        
-
-            # ##viz depth##
-            # init_depth_viz = util.visualize_depth(init_depth[0])
-            # cur_depth_viz = util.visualize_depth(cur_depth[0])
-            # gt_depth_viz = util.visualize_depth(depth_images[0])
-            # depth_set_1 = np.concatenate([init_depth_viz, cur_depth_viz, gt_depth_viz],axis=0)
-            # #############
-
-            # ##viz depth##
-            # init_depth_viz = util.visualize_depth_inverse(init_depth[0])
-            # cur_depth_viz = util.visualize_depth_inverse(cur_depth[0])
-            # gt_depth_viz = util.visualize_depth_inverse(depth_images[0])
-            # depth_set_2 = np.concatenate([init_depth_viz, cur_depth_viz, gt_depth_viz],axis=0)
-            # #############
-
-            # ##viz depth##
-            # init_depth_viz = util.visualize_depth_gray(init_depth[0])
-            # cur_depth_viz = util.visualize_depth_gray(cur_depth[0])
-            # gt_depth_viz = util.visualize_depth_gray(depth_images[0])
-            # depth_set_3 = np.concatenate([init_depth_viz, cur_depth_viz, gt_depth_viz],axis=0)
-            # #############
+                entropy = entropy_module.get_cur_batch(cur_hazy)[0][0].item()
+
+                ratio = np.median(depth_images[0].detach().cpu().numpy()) / np.median(cur_depth[0].detach().cpu().numpy())
+                multi_score = util.compute_errors(depth_images[0].detach().cpu().numpy(), cur_depth[0].detach().cpu().numpy() * ratio)
+                writer.append(image_name, beta_of(image_name), step, **dict(zip(labels, multi_score)), entropy=entropy)
+
+                # # ##viz haze##
+                # init_haze_viz = (util.denormalize(hazy_images, opt.norm)[0].detach().cpu().numpy().transpose(1,2,0)*255).astype(np.uint8)
+                # cur_haze_viz = (cur_hazy[0].detach().cpu().numpy().transpose(1,2,0)*255).astype(np.uint8)
+                # init_clear_viz = (util.denormalize(clear_images, opt.norm)[0].detach().cpu().numpy().transpose(1,2,0)*255).astype(np.uint8)
+                # haze_set= cv2.cvtColor(np.concatenate([init_haze_viz, cur_haze_viz, init_clear_viz], axis = cat_axis), cv2.COLOR_RGB2BGR)
+                # ############        
+
+                # ##viz depth##
+                # init_depth_viz = util.visualize_depth(init_depth[0])
+                # cur_depth_viz = util.visualize_depth(cur_depth[0])
+                # gt_depth_viz = util.visualize_depth(depth_images[0])
+                # depth_set_1 = np.concatenate([init_depth_viz, cur_depth_viz, gt_depth_viz],axis=0)
+                # #############
+
+                # ##viz depth##
+                # init_depth_viz = util.visualize_depth_inverse(init_depth[0])
+                # cur_depth_viz = util.visualize_depth_inverse(cur_depth[0])
+                # gt_depth_viz = util.visualize_depth_inverse(depth_images[0])
+                # depth_set_2 = np.concatenate([init_depth_viz, cur_depth_viz, gt_depth_viz],axis=0)
+                # #############
+
+                # ##viz depth##
+                # init_depth_viz = util.visualize_depth_gray(init_depth[0])
+                # cur_depth_viz = util.visualize_depth_gray(cur_depth[0])
+                # gt_depth_viz = util.visualize_depth_gray(depth_images[0])
+                # depth_set_3 = np.concatenate([init_depth_viz, cur_depth_viz, gt_depth_viz],axis=0)
+                # #############
             
-            # ##viz depth##
-            # init_depth_viz = util.visualize_depth_inverse_gray(init_depth[0])
-            # cur_depth_viz = util.visualize_depth_inverse_gray(cur_depth[0])
-            # gt_depth_viz = util.visualize_depth_inverse_gray(depth_images[0])
-            # depth_set_4 = np.concatenate([init_depth_viz, cur_depth_viz, gt_depth_viz],axis=0)
-            # #############
+                # ##viz depth##
+                # init_depth_viz = util.visualize_depth_inverse_gray(init_depth[0])
+                # cur_depth_viz = util.visualize_depth_inverse_gray(cur_depth[0])
+                # gt_depth_viz = util.visualize_depth_inverse_gray(depth_images[0])
+                # depth_set_4 = np.concatenate([init_depth_viz, cur_depth_viz, gt_depth_viz],axis=0)
+                # #############
 
 
-            # save_set = np.concatenate([haze_set, depth_set_1], axis=1)
-            # cv2.imwrite(f'{output_folder}/{input_names[0][:-4]}/{step:03}.jpg', save_set)
+                # save_set = np.concatenate([haze_set, depth_set_1], axis=1)
+                # cv2.imwrite(f'{output_folder}/{input_names[0][:-4]}/{step:03}.jpg', save_set)
             
-            # cv2.imshow('depth', cv2.resize(save_set,(2000,1000)))
-            # cv2.waitKey(0)    
+                # cv2.imshow('depth', cv2.resize(save_set,(2000,1000)))
+                # cv2.waitKey(0)    
             
-            # cv2.imshow('depth', cv2.resize(depth_set.detach().cpu().numpy().astype(np.uint8).transpose(1,2,0),(500,500)))
-            # cv2.imshow('dehaze', cv2.resize(cv2.cvtColor(haze_set.detach().cpu().numpy().astype(np.uint8).transpose(1,2,0),cv2.COLOR_RGB2BGR),(500,500)))
-            # cv2.waitKey(0)        
+                # cv2.imshow('depth', cv2.resize(depth_set.detach().cpu().numpy().astype(np.uint8).transpose(1,2,0),(500,500)))
+                # cv2.imshow('dehaze', cv2.resize(cv2.cvtColor(haze_set.detach().cpu().numpy().astype(np.uint8).transpose(1,2,0),cv2.COLOR_RGB2BGR),(500,500)))
+                # cv2.waitKey(0)        
 
-            cur_hazy = util.normalize(prediction[0].detach().cpu().numpy().transpose(1,2,0).astype(np.float32),opt.norm).unsqueeze(0).to('cuda')
-        f.close()
+                cur_hazy = util.normalize(prediction[0].detach().cpu().numpy().transpose(1,2,0).astype(np.float32),opt.norm).unsqueeze(0).to('cuda')
     
 
 if __name__ == '__main__':
     opt = get_args()
     opt.norm = True
     
-    if opt.dataset == 'NYU':
+    if opt.backend == 'onnx':
+        from models.onnx_backend import OnnxModel
+        model = OnnxModel(opt.onnxModel, opt.onnxThreads)
+    elif opt.dataset == 'NYU':
         model = DPTDepthModel(
             path = 'weights/depth_weights/dpt_hybrid_nyu-2ce69ec7.pt',
             scale = 0.000305,
@@ -167,7 +173,7 @@ if __name__ == '__main__':
             backbone = 'vitb_rn50_384',
             non_negative=True,
             enable_attention_hooks=False
-        ).to(memory_format=torch.channels_last)
+        )
         model.to('cuda')
     elif opt.dataset == 'KITTI':
         model = DPTDepthModel(
@@ -180,6 +186,8 @@ if __name__ == '__main__':
             enable_attention_hooks=False,
         )
         model.to('cuda')
+    if opt.backend == 'torch':
+        model.inference_mode(channels_last=True)
     
     if opt.dataset == 'NYU':
         dataset = NYU_Dataset(opt.dataRoot, img_size=[640,480], norm=opt.norm)